@@ -9,7 +9,10 @@ import Link from 'next/link'
 import { Button } from '@/components/ui/button'
 
 interface Message {
-  id: number
+  // null until the server stores a message it broadcast early; provisional_id names it until then
+  id: number | null
+  provisional_id?: string
+  failed?: boolean
   content: string
   sender: {
     id: number
@@ -223,6 +226,20 @@ const ChatRoomPage = () => {
           }
           
           setMessages(prev => [...prev, data.message])
+        } else if (data.type === 'message_saved') {
+          // Stored IDs of messages broadcast under provisional IDs
+          const saved = new Map<string, { id: number, created_at: string }>(
+            data.messages.map((item: any) => [item.provisional_id, item])
+          )
+          setMessages(prev => prev.map(message => {
+            const stored = message.provisional_id ? saved.get(message.provisional_id) : undefined
+            return stored ? { ...message, id: stored.id, created_at: stored.created_at } : message
+          }))
+        } else if (data.type === 'message_failed') {
+          const failed = new Set<string>(data.provisional_ids)
+          setMessages(prev => prev.map(message =>
+            message.provisional_id && failed.has(message.provisional_id) ? { ...message, failed: true } : message
+          ))
         }
       }
       
@@ -447,7 +464,7 @@ const ChatRoomPage = () => {
               )
 
               return (
-                <div key={message.id}>
+                <div key={message.provisional_id ?? message.id}>
                   {/* Date separator */}
                   {showDate && (
                     <div className="flex justify-center my-6">
@@ -467,6 +484,9 @@ const ChatRoomPage = () => {
                           {/* <p className="text-xs opacity-70 mt-1">YOU (ID: {message.sender.id})</p> */}
                         </div>
                         <div className="flex items-center justify-end gap-1 mt-1 px-2">
+                          {message.failed && (
+                            <span className="text-xs text-red-500">Not sent</span>
+                          )}
                           <span className="text-xs text-gray-600">
                             {formatMessageTime(message.created_at)}
                           </span>
@@ -0,0 +1,107 @@
+"""
+Accepting and unaccepting answers.
+
+The question row is the lock: both operations take it with select_for_update,
+so concurrent accepts on one question run one after the other and each sees
+the accepted_answer left by the last. Every write is an update() of flag or
+counter columns only, and the answer author's best_answers count and
+reputation ledger move in the same transaction.
+"""
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.db.models.functions import Greatest
+from django.shortcuts import get_object_or_404
+
+from common.cache import invalidate_responses
+from profile_app.models import Reputation, UserProfile
+from questions.models import Question
+from .models import Answer
+
+# Reputation for an accepted answer, as listed in Reputation.ACTION_TYPES
+ACCEPTED_POINTS = 15
+
+
+class NotQuestionAuthor(Exception):
+    """Only the author of a question can accept or unaccept its answers"""
+
+
+def _lock_question(answer_id, user):
+    """Load the answer with its question locked, plus the current accepted answer's author"""
+    answer = get_object_or_404(
+        Answer.objects.select_related('question__accepted_answer')
+        .select_for_update(of=('question',))
+        .only(
+            'id', 'author_id', 'question__author_id',
+            'question__accepted_answer__id', 'question__accepted_answer__author_id'
+        ),
+        pk=answer_id
+    )
+    if answer.question.author_id != user.id:
+        raise NotQuestionAuthor
+    return answer
+
+
+def _move_credit(grant=None, revoke=None):
+    """
+    Grant and/or revoke the accepted-answer credit, each given as an
+    answer with its author_id, in one ledger INSERT and one profile UPDATE.
+    """
+    ledger, deltas = [], {}
+    for answer, sign in ((grant, 1), (revoke, -1)):
+        if answer is None:
+            continue
+        ledger.append(Reputation(
+            user_id=answer.author_id, action='answer_accepted',
+            points=sign * ACCEPTED_POINTS, content_object_id=answer.id
+        ))
+        deltas[answer.author_id] = deltas.get(answer.author_id, 0) + sign
+    # bulk_create skips Reputation.save, which re-sums the whole ledger
+    Reputation.objects.bulk_create(ledger)
+
+    deltas = {user_id: delta for user_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    delta = Case(
+        *[When(user_id=user_id, then=Value(delta)) for user_id, delta in deltas.items()],
+        output_field=IntegerField()
+    )
+    UserProfile.objects.filter(user_id__in=deltas).update(
+        best_answers=Greatest(F('best_answers') + delta, 0),
+        reputation=Greatest(F('reputation') + delta * ACCEPTED_POINTS, 0),
+    )
+
+
+@transaction.atomic
+def accept(answer_id, user):
+    """Make the answer its question's accepted answer; False if it already was"""
+    answer = _lock_question(answer_id, user)
+    question = answer.question
+    previous = question.accepted_answer
+    if previous is not None and previous.id == answer.id:
+        return False
+
+    if previous is None:
+        Answer.objects.filter(pk=answer.id).update(is_accepted=True)
+    else:
+        Answer.objects.filter(pk__in=[answer.id, previous.id]).update(
+            is_accepted=Case(When(pk=answer.id, then=Value(True)), default=Value(False))
+        )
+    Question.objects.filter(pk=question.id).update(is_answered=True, accepted_answer_id=answer.id)
+    _move_credit(grant=answer, revoke=previous)
+    invalidate_responses('questions', 'leaderboard')
+    return True
+
+
+@transaction.atomic
+def unaccept(answer_id, user):
+    """Withdraw the answer's acceptance; False if it was not accepted"""
+    answer = _lock_question(answer_id, user)
+    question = answer.question
+    if question.accepted_answer_id != answer.id:
+        return False
+
+    Answer.objects.filter(pk=answer.id).update(is_accepted=False)
+    Question.objects.filter(pk=question.id).update(is_answered=False, accepted_answer=None)
+    _move_credit(revoke=answer)
+    invalidate_responses('questions', 'leaderboard')
+    return True
@@ -0,0 +1,75 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from answers import acceptance
+from answers.models import Answer
+from questions.models import Question
+
+User = get_user_model()
+
+
+def legacy_accept(answer_id, user):
+    """The previous accept path: full-row saves of both answers and the question"""
+    answer = Answer.objects.get(id=answer_id)
+    if answer.question.author != user:
+        raise acceptance.NotQuestionAuthor
+    if answer.question.accepted_answer:
+        old_answer = answer.question.accepted_answer
+        old_answer.is_accepted = False
+        old_answer.save()
+    answer.is_accepted = True
+    answer.save()
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare accepts per second and queries per accept for the legacy and transactional paths'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--accepts', type=int, default=1000, help='Accepts per run')
+        parser.add_argument(
+            '--content-size',
+            type=int,
+            default=20000,
+            help='Characters of question and answer content rewritten by full-row saves'
+        )
+
+    def handle(self, *args, **options):
+        accepts = options['accepts']
+        content = 'x' * options['content_size']
+        try:
+            with transaction.atomic():
+                asker = User.objects.create_user(
+                    username='accept-benchmark', email='accept-benchmark@example.com', password='benchmark'
+                )
+                question = Question.objects.create(title='Benchmark question', content=content, author=asker)
+                answer_ids = [
+                    Answer.objects.create(question=question, author=asker, content=content).id
+                    for _ in range(2)
+                ]
+
+                for label, accept in (('Legacy saves:  ', legacy_accept), ('Transactional: ', acceptance.accept)):
+                    rate, queries = self.run(accept, answer_ids, asker, accepts)
+                    self.stdout.write(f'{label}{rate:,.0f} accepts/s, {queries} queries per accept')
+                    if accept is legacy_accept:
+                        before = rate
+                self.stdout.write(self.style.SUCCESS(f'Speedup: {rate / before:.1f}x'))
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, accept, answer_ids, user, accepts):
+        with CaptureQueriesContext(connection) as queries:
+            accept(answer_ids[0], user)
+            accept(answer_ids[1], user)
+        start = time.perf_counter()
+        for i in range(accepts):
+            accept(answer_ids[i % 2], user)
+        return accepts / (time.perf_counter() - start), len(queries) // 2
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.3 on 2026-10-17 00:24
+
+import math
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_scores(apps, schema_editor):
+    # Same formula as answers.ranking.wilson_lower_bound, copied so the
+    # migration does not depend on application code
+    Answer = apps.get_model('answers', 'Answer')
+    z2 = 1.96 * 1.96
+    voted = Answer.objects.filter(models.Q(upvotes__gt=0) | models.Q(downvotes__gt=0))
+    answers = []
+    for answer in voted.only('id', 'upvotes', 'downvotes').iterator():
+        n = answer.upvotes + answer.downvotes
+        p = answer.upvotes / n
+        spread = 1.96 * math.sqrt((p * (1 - p) + z2 / (4 * n)) / n)
+        answer.score = (p + z2 / (2 * n) - spread) / (1 + z2 / n)
+        answers.append(answer)
+    Answer.objects.bulk_update(answers, ['score'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('answers', '0002_initial'),
+        ('questions', '0005_trending_scores'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='answer',
+            options={'ordering': ['-is_accepted', '-score', '-id']},
+        ),
+        migrations.RemoveIndex(
+            model_name='answer',
+            name='answers_ans_questio_0c8642_idx',
+        ),
+        migrations.AddField(
+            model_name='answer',
+            name='score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='answer',
+            index=models.Index(fields=['question', 'is_accepted', 'score', 'id'], name='answer_best_idx'),
+        ),
+        migrations.RunPython(populate_scores, migrations.RunPython.noop),
+    ]
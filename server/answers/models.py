@@ -11,13 +11,15 @@ class Answer(models.Model):
     upvotes = models.PositiveIntegerField(default=0)
     downvotes = models.PositiveIntegerField(default=0)
     is_accepted = models.BooleanField(default=False)
+    # Wilson lower bound of the vote ratio, maintained by answers.ranking
+    score = models.FloatField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
-        ordering = ['-is_accepted', '-upvotes', '-created_at']
+        ordering = ['-is_accepted', '-score', '-id']
         indexes = [
-            models.Index(fields=['question', 'is_accepted']),
+            models.Index(fields=['question', 'is_accepted', 'score', 'id'], name='answer_best_idx'),
             models.Index(fields=['upvotes']),
         ]
     
@@ -50,23 +52,6 @@ class AnswerVote(models.Model):
     
     class Meta:
         unique_together = ['answer', 'user']
-    
-    def save(self, *args, **kwargs):
-        # Update answer vote counts
-        if self.pk:  # If updating existing vote
-            old_vote = AnswerVote.objects.get(pk=self.pk)
-            if old_vote.vote_type == 'up':
-                self.answer.upvotes -= 1
-            else:
-                self.answer.downvotes -= 1
-        
-        super().save(*args, **kwargs)
-        
-        if self.vote_type == 'up':
-            self.answer.upvotes += 1
-        else:
-            self.answer.downvotes += 1
-        self.answer.save()
 
 
 class Comment(models.Model):
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from .models import Answer, AnswerVote, Comment
 from auth_app.serializers import UserSerializer
+from common.serializers import ViewerRelation, ViewerStateListSerializer, ViewerStateMixin
 
 
 class CommentSerializer(serializers.ModelSerializer):
@@ -18,7 +19,7 @@ class QuestionBasicSerializer(serializers.Serializer):
     title = serializers.CharField()
 
 
-class AnswerSerializer(serializers.ModelSerializer):
+class AnswerSerializer(ViewerStateMixin, serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     comments = CommentSerializer(many=True, read_only=True)
     vote_score = serializers.ReadOnlyField()
@@ -31,16 +32,27 @@ class AnswerSerializer(serializers.ModelSerializer):
             'is_accepted', 'comments', 'user_vote', 'created_at', 'updated_at'
         ]
         read_only_fields = ['author', 'upvotes', 'downvotes', 'is_accepted']
+        list_serializer_class = ViewerStateListSerializer
+    
+    viewer_relations = {
+        'vote': ViewerRelation(AnswerVote, 'answer', value='vote_type'),
+    }
     
     def get_user_vote(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            vote = AnswerVote.objects.filter(answer=obj, user=request.user).first()
-            return vote.vote_type if vote else None
-        return None
+        return self.viewer_value('vote', obj)
+
+
+class AnswerThreadSerializer(AnswerSerializer):
+    """Answer with its first comments, for querysets prepared by answers.threads"""
+    comments = CommentSerializer(source='thread_comments', many=True, read_only=True)
+    comment_count = serializers.IntegerField(source='comment_total', read_only=True)
+    comments_next_cursor = serializers.CharField(read_only=True, allow_null=True)
+    
+    class Meta(AnswerSerializer.Meta):
+        fields = AnswerSerializer.Meta.fields + ['comment_count', 'comments_next_cursor']
 
 
-class UserAnswerSerializer(serializers.ModelSerializer):
+class UserAnswerSerializer(ViewerStateMixin, serializers.ModelSerializer):
     """Serializer for user answers that includes question info"""
     author = UserSerializer(read_only=True)
     question = QuestionBasicSerializer(read_only=True)
@@ -54,13 +66,14 @@ class UserAnswerSerializer(serializers.ModelSerializer):
             'is_accepted', 'user_vote', 'created_at', 'updated_at'
         ]
         read_only_fields = ['author', 'is_accepted']
+        list_serializer_class = ViewerStateListSerializer
+    
+    viewer_relations = {
+        'vote': ViewerRelation(AnswerVote, 'answer', value='vote_type'),
+    }
     
     def get_user_vote(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            vote = AnswerVote.objects.filter(answer=obj, user=request.user).first()
-            return vote.vote_type if vote else None
-        return None
+        return self.viewer_value('vote', obj)
 
 
 class AnswerListSerializer(serializers.ModelSerializer):
@@ -79,28 +92,3 @@ class AnswerVoteSerializer(serializers.ModelSerializer):
     class Meta:
         model = AnswerVote
         fields = ['vote_type']
-    
-    def create(self, validated_data):
-        answer = self.context['answer']
-        user = self.context['user']
-        
-        # Check if user already voted
-        existing_vote = AnswerVote.objects.filter(answer=answer, user=user).first()
-        
-        if existing_vote:
-            if existing_vote.vote_type == validated_data['vote_type']:
-                # Same vote type - remove vote
-                existing_vote.delete()
-                return None
-            else:
-                # Different vote type - update vote
-                existing_vote.vote_type = validated_data['vote_type']
-                existing_vote.save()
-                return existing_vote
-        else:
-            # New vote
-            return AnswerVote.objects.create(
-                answer=answer,
-                user=user,
-                **validated_data
-            )
@@ -0,0 +1,29 @@
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from common.cache import invalidate_responses
+from questions.models import Question
+from questions.trending import record_event
+from .models import Answer
+
+
+@receiver(post_save, sender=Answer)
+def increment_question_answer_count(sender, instance, created, **kwargs):
+    """Keep Question.answer_count in step when an answer is posted"""
+    if created:
+        Question.objects.filter(pk=instance.question_id).update(answer_count=F('answer_count') + 1)
+        record_event(instance.question_id, 'answer')
+
+
+@receiver(post_delete, sender=Answer)
+def decrement_question_answer_count(sender, instance, **kwargs):
+    """Keep Question.answer_count in step when an answer is deleted"""
+    Question.objects.filter(pk=instance.question_id, answer_count__gt=0).update(
+        answer_count=F('answer_count') - 1
+    )
+
+
+@receiver([post_save, post_delete], sender=Answer)
+def invalidate_answer_responses(sender, **kwargs):
+    """Question lists show answer counts and can be sorted by them"""
+    invalidate_responses('questions')
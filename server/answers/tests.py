@@ -1,3 +1,304 @@
 from django.test import TestCase
 
 # Create your tests here.
+import threading
+import unittest
+
+from rest_framework.test import APITestCase
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from io import StringIO
+
+from profile_app.models import Reputation, UserProfile
+from questions.models import Question
+from questions.tests import supports_concurrent_writes
+from . import acceptance
+from .models import Answer, AnswerVote, Comment
+from .ranking import wilson_lower_bound
+
+User = get_user_model()
+
+
+class AnswerCountTests(APITestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='asker', email='asker@example.com', password='password123'
+        )
+        self.answerer = User.objects.create_user(
+            username='answerer', email='answerer@example.com', password='password123'
+        )
+        self.question = Question.objects.create(title='Question', content='Body', author=self.author)
+
+    def test_answer_count_follows_creates_and_deletes(self):
+        first = Answer.objects.create(question=self.question, author=self.answerer, content='One')
+        Answer.objects.create(question=self.question, author=self.answerer, content='Two')
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.answer_count, 2)
+
+        first.delete()
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.answer_count, 1)
+
+    def test_list_serializer_reads_stored_count(self):
+        Answer.objects.create(question=self.question, author=self.answerer, content='One')
+        response = self.client.get('/api/questions/', {'sort': 'answers'})
+        self.assertEqual(response.data['questions'][0]['answer_count'], 1)
+
+    def test_reconcile_command_repairs_drift(self):
+        Answer.objects.create(question=self.question, author=self.answerer, content='One')
+        other = Question.objects.create(title='Other', content='Body', author=self.author)
+        Question.objects.filter(pk=self.question.pk).update(answer_count=7)
+        Question.objects.filter(pk=other.pk).update(answer_count=3)
+
+        out = StringIO()
+        call_command('reconcile_answer_counts', chunk_size=1, stdout=out)
+        self.assertIn('Successfully updated 2 questions', out.getvalue())
+        self.assertEqual(
+            dict(Question.objects.values_list('id', 'answer_count')),
+            {self.question.pk: 1, other.pk: 0}
+        )
+
+
+class AnswerVoteTests(APITestCase):
+
+    def setUp(self):
+        author = User.objects.create_user(
+            username='asker', email='asker@example.com', password='password123'
+        )
+        answerer = User.objects.create_user(
+            username='answerer', email='answerer@example.com', password='password123'
+        )
+        self.voter = User.objects.create_user(
+            username='voter', email='voter@example.com', password='password123'
+        )
+        question = Question.objects.create(title='Question', content='Body', author=author)
+        self.answer = Answer.objects.create(question=question, author=answerer, content='Answer')
+        self.url = reverse('vote-answer', args=[self.answer.id])
+
+    def test_vote_toggle_and_flip(self):
+        self.client.force_authenticate(self.voter)
+        self.assertEqual(self.client.post(self.url, {'vote_type': 'up'}).data['upvotes'], 1)
+
+        data = self.client.post(self.url, {'vote_type': 'down'}).data
+        self.assertEqual((data['upvotes'], data['downvotes'], data['user_vote']), (0, 1, 'down'))
+
+        data = self.client.post(self.url, {'vote_type': 'down'}).data
+        self.assertEqual((data['upvotes'], data['downvotes'], data['user_vote']), (0, 0, None))
+        self.assertFalse(AnswerVote.objects.exists())
+
+    def test_vote_recomputes_score(self):
+        self.client.force_authenticate(self.voter)
+        self.client.post(self.url, {'vote_type': 'up'})
+        self.answer.refresh_from_db()
+        self.assertAlmostEqual(self.answer.score, wilson_lower_bound(1, 0))
+
+        self.client.post(self.url, {'vote_type': 'up'})
+        self.answer.refresh_from_db()
+        self.assertEqual(self.answer.score, 0)
+
+
+class AnswerRankingTests(APITestCase):
+
+    def test_wilson_lower_bound_weighs_confidence(self):
+        self.assertEqual(wilson_lower_bound(0, 0), 0)
+        self.assertGreater(wilson_lower_bound(40, 5), wilson_lower_bound(1, 0))
+        self.assertGreater(wilson_lower_bound(10, 0), wilson_lower_bound(10, 5))
+        self.assertLess(wilson_lower_bound(5, 0), 5 / 5)
+
+    def test_sort_by_best(self):
+        author = User.objects.create_user(
+            username='asker', email='asker@example.com', password='password123'
+        )
+        question = Question.objects.create(title='Question', content='Body', author=author)
+        counts = {'lucky': (1, 0), 'solid': (40, 5), 'mixed': (10, 10), 'accepted': (0, 2)}
+        for content, (upvotes, downvotes) in counts.items():
+            Answer.objects.create(
+                question=question, author=author, content=content,
+                upvotes=upvotes, downvotes=downvotes, is_accepted=content == 'accepted',
+                score=wilson_lower_bound(upvotes, downvotes)
+            )
+        url = reverse('answer-list-create', args=[question.id])
+
+        for params in ({'sort_by': 'best'}, {'sort_by': 'best', 'cursor': ''}):
+            response = self.client.get(url, params)
+            order = [answer['content'] for answer in response.data['answers']]
+            self.assertEqual(order, ['accepted', 'solid', 'mixed', 'lucky'])
+
+
+class AnswerThreadTests(APITestCase):
+
+    def setUp(self):
+        author = User.objects.create_user(
+            username='asker', email='asker@example.com', password='password123'
+        )
+        self.viewer = User.objects.create_user(
+            username='viewer', email='viewer@example.com', password='password123'
+        )
+        commenters = [
+            User.objects.create_user(
+                username=f'user{i}', email=f'user{i}@example.com', password='password123'
+            )
+            for i in range(5)
+        ]
+        self.question = Question.objects.create(title='Question', content='Body', author=author)
+        self.answers = Answer.objects.bulk_create([
+            Answer(question=self.question, author=commenters[i % 5], content=f'Answer {i}')
+            for i in range(50)
+        ])
+        Comment.objects.bulk_create([
+            Comment(answer=answer, author=commenters[i % 5], content=f'Comment {i}')
+            for answer in self.answers
+            for i in range(10)
+        ])
+        AnswerVote.objects.bulk_create([
+            AnswerVote(answer=answer, user=self.viewer, vote_type='up') for answer in self.answers[::2]
+        ])
+        self.url = reverse('answer-list-create', args=[self.question.id])
+
+    def test_thread_query_budget(self):
+        self.client.force_authenticate(self.viewer)
+        # count, answers with authors, first comments with authors, viewer votes
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url, {'page_size': 50})
+        answers = response.data['answers']
+        self.assertEqual(len(answers), 50)
+        self.assertEqual(sum(answer['user_vote'] == 'up' for answer in answers), 25)
+        for answer in answers:
+            self.assertEqual(len(answer['comments']), 3)
+            self.assertEqual(answer['comment_count'], 10)
+            self.assertIsNotNone(answer['comments_next_cursor'])
+
+    def test_load_more_comments(self):
+        answer = self.client.get(self.url, {'comments': 4}).data['answers'][0]
+        self.assertEqual(len(answer['comments']), 4)
+
+        url = reverse('comment-list-create', args=[answer['id']])
+        page = self.client.get(url, {'cursor': answer['comments_next_cursor'], 'page_size': 10}).data
+        self.assertEqual(len(page['comments']), 6)
+        self.assertFalse(page['isNext'])
+        shown = [comment['id'] for comment in answer['comments'] + page['comments']]
+        expected = list(Comment.objects.filter(answer_id=answer['id']).order_by('created_at', 'id')
+                        .values_list('id', flat=True))
+        self.assertEqual(shown, expected)
+
+    def test_comments_can_be_left_out(self):
+        answer = self.client.get(self.url, {'comments': 0}).data['answers'][0]
+        self.assertEqual(answer['comments'], [])
+        self.assertEqual(answer['comment_count'], 10)
+
+        url = reverse('comment-list-create', args=[answer['id']])
+        page = self.client.get(url, {'cursor': answer['comments_next_cursor']}).data
+        self.assertEqual(len(page['comments']), 10)
+
+
+class AcceptAnswerTests(APITestCase):
+
+    def setUp(self):
+        self.asker = User.objects.create_user(
+            username='asker', email='asker@example.com', password='password123'
+        )
+        self.first_author = User.objects.create_user(
+            username='first', email='first@example.com', password='password123'
+        )
+        self.second_author = User.objects.create_user(
+            username='second', email='second@example.com', password='password123'
+        )
+        self.question = Question.objects.create(title='Question', content='Body', author=self.asker)
+        self.first = Answer.objects.create(question=self.question, author=self.first_author, content='One')
+        self.second = Answer.objects.create(question=self.question, author=self.second_author, content='Two')
+
+    def profile(self, user):
+        return UserProfile.objects.get(user=user)
+
+    def test_accept_switch_and_unaccept(self):
+        self.client.force_authenticate(self.asker)
+        self.assertEqual(self.client.post(reverse('accept-answer', args=[self.first.id])).status_code, 200)
+        self.question.refresh_from_db()
+        self.assertTrue(self.question.is_answered)
+        self.assertEqual(self.question.accepted_answer_id, self.first.id)
+        self.assertEqual(self.profile(self.first_author).best_answers, 1)
+        self.assertEqual(self.profile(self.first_author).reputation, acceptance.ACCEPTED_POINTS)
+
+        self.client.post(reverse('accept-answer', args=[self.second.id]))
+        self.first.refresh_from_db()
+        self.assertFalse(self.first.is_accepted)
+        self.assertEqual(self.profile(self.first_author).best_answers, 0)
+        self.assertEqual(self.profile(self.first_author).reputation, 0)
+        self.assertEqual(self.profile(self.second_author).best_answers, 1)
+
+        self.client.delete(reverse('accept-answer', args=[self.second.id]))
+        self.question.refresh_from_db()
+        self.assertFalse(self.question.is_answered)
+        self.assertIsNone(self.question.accepted_answer_id)
+        self.assertFalse(Answer.objects.filter(is_accepted=True).exists())
+        self.assertEqual(self.profile(self.second_author).best_answers, 0)
+        # The ledger keeps every grant and reversal
+        self.assertEqual(Reputation.objects.count(), 4)
+
+    def test_accept_is_idempotent(self):
+        acceptance.accept(self.first.id, self.asker)
+        self.assertFalse(acceptance.accept(self.first.id, self.asker))
+        self.assertEqual(self.profile(self.first_author).best_answers, 1)
+
+    def test_accept_touches_flag_columns_only(self):
+        acceptance.accept(self.first.id, self.asker)
+        with CaptureQueriesContext(connection) as queries:
+            acceptance.accept(self.second.id, self.asker)
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 3)
+        for sql in updates:
+            self.assertNotIn('"content"', sql)
+
+    def test_only_question_author_can_accept(self):
+        self.client.force_authenticate(self.first_author)
+        response = self.client.post(reverse('accept-answer', args=[self.first.id]))
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Answer.objects.filter(is_accepted=True).exists())
+
+
+@unittest.skipUnless(supports_concurrent_writes(), 'database does not support concurrent writers')
+class AcceptAnswerConcurrencyTests(TransactionTestCase):
+
+    def test_concurrent_accepts_leave_one_accepted_answer(self):
+        asker = User.objects.create_user(
+            username='asker', email='asker@example.com', password='password123'
+        )
+        question = Question.objects.create(title='Contested', content='Body', author=asker)
+        answers = [
+            Answer.objects.create(
+                question=question, content=f'Answer {i}',
+                author=User.objects.create_user(
+                    username=f'author{i}', email=f'author{i}@example.com', password='password123'
+                )
+            )
+            for i in range(12)
+        ]
+        barrier = threading.Barrier(len(answers))
+        errors = []
+
+        def run(answer):
+            try:
+                barrier.wait()
+                acceptance.accept(answer.id, asker)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(answer,)) for answer in answers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        question.refresh_from_db()
+        accepted = list(Answer.objects.filter(is_accepted=True).values_list('id', flat=True))
+        self.assertEqual(accepted, [question.accepted_answer_id])
+        self.assertEqual(sum(UserProfile.objects.values_list('best_answers', flat=True)), 1)
+        self.assertEqual(sum(Reputation.objects.values_list('points', flat=True)), acceptance.ACCEPTED_POINTS)
@@ -0,0 +1,73 @@
+"""
+Assembly of answer threads: a page of answers with their first comments.
+
+with_thread() adds to an answer queryset everything AnswerThreadSerializer
+reads: authors with their activity, each answer's comment total and its
+first comments (one sliced prefetch across the whole page, with authors and
+activity). Together with the viewer's votes, primed once per page by
+ViewerStateListSerializer, a page costs the same few queries whatever its
+size. assemble_thread() trims the comments to the cap and leaves a cursor
+for loading the rest from the comments endpoint.
+"""
+from django.db.models import Count, IntegerField, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
+
+from common.pagination import KeysetPagination
+from .models import Comment
+
+COMMENT_ORDERING = ['created_at', 'id']
+DEFAULT_COMMENTS_PER_ANSWER = 3
+MAX_COMMENTS_PER_ANSWER = 20
+
+
+class CommentKeysetPagination(KeysetPagination):
+    page_size = 20
+    max_page_size = 100
+
+
+def comments_per_answer(request):
+    """The ``comments`` query parameter, clamped to 0..MAX_COMMENTS_PER_ANSWER"""
+    try:
+        limit = int(request.query_params.get('comments', DEFAULT_COMMENTS_PER_ANSWER))
+    except ValueError:
+        return DEFAULT_COMMENTS_PER_ANSWER
+    return min(max(limit, 0), MAX_COMMENTS_PER_ANSWER)
+
+
+def with_thread(answers, comment_limit):
+    """Annotate and prefetch an answer queryset for AnswerThreadSerializer"""
+    comment_total = (
+        Comment.objects.filter(answer=OuterRef('pk'))
+        .order_by()
+        .values('answer')
+        .annotate(total=Count('id'))
+        .values('total')
+    )
+    answers = answers.select_related('author__activity').annotate(
+        comment_total=Coalesce(Subquery(comment_total, output_field=IntegerField()), 0)
+    )
+    if comment_limit > 0:
+        # One extra comment tells us whether there are more to load
+        first_comments = Comment.objects.select_related('author__activity').order_by(
+            *COMMENT_ORDERING
+        )[:comment_limit + 1]
+        answers = answers.prefetch_related(
+            Prefetch('comments', queryset=first_comments, to_attr='first_comments')
+        )
+    return answers
+
+
+def assemble_thread(answers, comment_limit):
+    """Cap each answer's prefetched comments and set its "load more" cursor"""
+    paginator = CommentKeysetPagination(COMMENT_ORDERING)
+    for answer in answers:
+        comments = getattr(answer, 'first_comments', [])
+        answer.thread_comments = comments[:comment_limit]
+        if answer.comment_total <= len(answer.thread_comments):
+            answer.comments_next_cursor = None
+        elif answer.thread_comments:
+            answer.comments_next_cursor = paginator.encode_cursor(answer.thread_comments[-1])
+        else:
+            # An empty cursor starts from the first comment
+            answer.comments_next_cursor = ''
+    return answers
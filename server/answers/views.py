@@ -4,9 +4,17 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.pagination import PageNumberPagination
 from django.shortcuts import get_object_or_404
+from common.pagination import KeysetPagination
 from questions.models import Question
+from . import acceptance
 from .models import Answer, AnswerVote, Comment
-from .serializers import AnswerSerializer, AnswerVoteSerializer, CommentSerializer
+from .ranking import AnswerVoteEngine
+from .serializers import AnswerSerializer, AnswerThreadSerializer, AnswerVoteSerializer, CommentSerializer
+from .threads import (
+    COMMENT_ORDERING, CommentKeysetPagination, assemble_thread, comments_per_answer, with_thread
+)
+
+answer_votes = AnswerVoteEngine(AnswerVote, 'answer')
 
 
 class AnswerPagination(PageNumberPagination):
@@ -15,35 +23,62 @@ class AnswerPagination(PageNumberPagination):
     max_page_size = 50
 
 
+class AnswerKeysetPagination(KeysetPagination):
+    page_size = 10
+    max_page_size = 50
+
+
 class AnswerListCreateView(APIView):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     
     def get(self, request, question_id):
-        """List answers for a question"""
-        answers = Answer.objects.filter(question_id=question_id).select_related('author')
+        """List answers for a question with their first comments"""
+        comment_limit = comments_per_answer(request)
+        answers = with_thread(Answer.objects.filter(question_id=question_id), comment_limit)
         
-        # Apply sorting if specified
+        # Apply sorting if specified; the primary key breaks ties
         sort_by = request.query_params.get('sort_by', 'newest')
         if sort_by == 'oldest':
-            answers = answers.order_by('created_at')
+            ordering = ['created_at', 'id']
         elif sort_by == 'votes':
-            answers = answers.order_by('-upvotes', '-created_at')
+            ordering = ['-upvotes', '-created_at', '-id']
+        elif sort_by == 'best':
+            # Served in order by the (question, is_accepted, score, id) index
+            ordering = ['-is_accepted', '-score', '-id']
         else:  # newest
-            answers = answers.order_by('-created_at')
+            ordering = ['-created_at', '-id']
+        
+        if KeysetPagination.is_requested(request):
+            paginator = AnswerKeysetPagination(ordering)
+            page = assemble_thread(paginator.paginate_queryset(answers, request), comment_limit)
+            serializer = AnswerThreadSerializer(page, many=True, context={'request': request})
+            response = {
+                'success': True,
+                'answers': serializer.data,
+                'isNext': paginator.has_next,
+                'nextCursor': paginator.next_cursor,
+            }
+            if paginator.total is not None:
+                response['count'] = paginator.total
+            return Response(response)
+        
+        answers = answers.order_by(*ordering)
         
         # Apply pagination
         paginator = AnswerPagination()
         page = paginator.paginate_queryset(answers, request)
         
         if page is not None:
-            serializer = AnswerSerializer(page, many=True, context={'request': request})
+            assemble_thread(page, comment_limit)
+            serializer = AnswerThreadSerializer(page, many=True, context={'request': request})
             return Response({
                 'success': True,
                 'answers': serializer.data,
                 'isNext': paginator.get_next_link() is not None
             })
         
-        serializer = AnswerSerializer(answers, many=True, context={'request': request})
+        answers = assemble_thread(list(answers), comment_limit)
+        serializer = AnswerThreadSerializer(answers, many=True, context={'request': request})
         return Response({
             'success': True,
             'answers': serializer.data,
@@ -146,57 +181,45 @@ class AnswerDetailView(APIView):
 @permission_classes([permissions.IsAuthenticated])
 def vote_answer(request, answer_id):
     """Vote on an answer"""
-    answer = get_object_or_404(Answer, id=answer_id)
+    answer = get_object_or_404(Answer.objects.only('id', 'author_id'), id=answer_id)
     
-    if answer.author == request.user:
+    if answer.author_id == request.user.id:
         return Response(
             {'error': 'You cannot vote on your own answer.'}, 
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    serializer = AnswerVoteSerializer(
-        data=request.data,
-        context={'answer': answer, 'user': request.user}
-    )
+    serializer = AnswerVoteSerializer(data=request.data)
     
     if serializer.is_valid():
-        vote = serializer.save()
-        answer.refresh_from_db()
+        result = answer_votes.cast(answer.id, request.user, serializer.validated_data['vote_type'])
         
         return Response({
             'message': 'Vote recorded successfully.',
-            'upvotes': answer.upvotes,
-            'downvotes': answer.downvotes,
-            'vote_score': answer.vote_score,
-            'user_vote': vote.vote_type if vote else None
+            'upvotes': result.upvotes,
+            'downvotes': result.downvotes,
+            'vote_score': result.upvotes - result.downvotes,
+            'user_vote': result.user_vote
         })
     
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-@api_view(['POST'])
+@api_view(['POST', 'DELETE'])
 @permission_classes([permissions.IsAuthenticated])
 def accept_answer(request, answer_id):
-    """Accept an answer as the best answer"""
-    answer = get_object_or_404(Answer, id=answer_id)
-    
-    # Only question author can accept answers
-    if answer.question.author != request.user:
+    """Accept an answer as the best answer; DELETE withdraws the acceptance"""
+    try:
+        if request.method == 'DELETE':
+            acceptance.unaccept(answer_id, request.user)
+            return Response({'message': 'Answer unaccepted successfully.'})
+        acceptance.accept(answer_id, request.user)
+    except acceptance.NotQuestionAuthor:
         return Response(
             {'error': 'Only the question author can accept answers.'}, 
             status=status.HTTP_403_FORBIDDEN
         )
     
-    # Remove previously accepted answer
-    if answer.question.accepted_answer:
-        old_answer = answer.question.accepted_answer
-        old_answer.is_accepted = False
-        old_answer.save()
-    
-    # Accept this answer
-    answer.is_accepted = True
-    answer.save()
-    
     return Response({'message': 'Answer accepted successfully.'})
 
 
@@ -204,8 +227,19 @@ class CommentListCreateView(APIView):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     
     def get(self, request, answer_id):
-        """List comments for an answer"""
-        comments = Comment.objects.filter(answer_id=answer_id).select_related('author')
+        """List comments for an answer; with ?cursor= returns one page at a time"""
+        comments = Comment.objects.filter(answer_id=answer_id).select_related('author__activity')
+        
+        if KeysetPagination.is_requested(request):
+            paginator = CommentKeysetPagination(COMMENT_ORDERING)
+            page = paginator.paginate_queryset(comments, request)
+            serializer = CommentSerializer(page, many=True, context={'request': request})
+            return Response({
+                'comments': serializer.data,
+                'isNext': paginator.has_next,
+                'nextCursor': paginator.next_cursor,
+            })
+        
         serializer = CommentSerializer(comments, many=True, context={'request': request})
         return Response(serializer.data)
     
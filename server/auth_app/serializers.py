@@ -2,10 +2,27 @@ from urllib import request
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from django.contrib.auth import authenticate
+from django.db import models
 import os
+from community.presence import presence
 
 User = get_user_model()
 
+
+def online_users(context):
+    """{user_id: is_online} resolved so far while serializing one response"""
+    return context.setdefault('online_users', {})
+
+
+class UserListSerializer(serializers.ListSerializer):
+    """Looks up the presence of every user in the list at once"""
+    
+    def to_representation(self, data):
+        users = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        self.child.prime_instances(users)
+        return super().to_representation(users)
+
+
 class UserSerializer(serializers.ModelSerializer):
     """Basic user serializer for foreign key relationships"""
     activity_status = serializers.SerializerMethodField()
@@ -21,6 +38,22 @@ class UserSerializer(serializers.ModelSerializer):
             'activity_status', 'is_recently_active', 'is_online', 'last_activity'
         ]
         read_only_fields = ['id', 'date_joined']
+        list_serializer_class = UserListSerializer
+    
+    def prime_instances(self, users):
+        """Look up the presence of many users in one call; see common.serializers.prime_nested"""
+        resolved = online_users(self.context)
+        unknown = {user.id for user in users} - set(resolved)
+        if unknown:
+            online = presence.online(unknown)
+            resolved.update({user_id: user_id in online for user_id in unknown})
+    
+    def online(self, obj):
+        # One presence lookup per user and response, shared by both fields
+        resolved = online_users(self.context)
+        if obj.id not in resolved:
+            resolved[obj.id] = presence.is_online(obj.id)
+        return resolved[obj.id]
     
     def get_profile_picture(self, obj):
         request = self.context.get('request')
@@ -38,8 +71,11 @@ class UserSerializer(serializers.ModelSerializer):
         return None
     
     def get_activity_status(self, obj):
+        if self.online(obj):
+            return 'online'
+        # activity_status would also trust the lazily written is_online flag
         if hasattr(obj, 'activity'):
-            return obj.activity.activity_status
+            return obj.activity.recency_status()
         return 'offline'
     
     def get_is_recently_active(self, obj):
@@ -48,9 +84,7 @@ class UserSerializer(serializers.ModelSerializer):
         return False
     
     def get_is_online(self, obj):
-        if hasattr(obj, 'activity'):
-            return obj.activity.is_online
-        return False
+        return self.online(obj)
     
     def get_last_activity(self, obj):
         if hasattr(obj, 'activity'):
@@ -0,0 +1,214 @@
+"""
+Coalesced typing indicators and join/leave notices.
+
+Typing frames and connection churn used to become one group_send each, to
+every member of the room. ChatConsumer now reports them to the
+process-wide room_events coalescer, which only broadcasts state changes:
+
+* Typing: a (room, user) pair broadcasts a change of its typing state at
+  most once every CHAT_TYPING_INTERVAL seconds. Frames repeating the state
+  others already see are dropped; a change arriving sooner waits for the
+  interval, and is dropped if the user flips back before then.
+* Join/leave: a user's second connection to a room is not announced, nor is
+  the closing of any but their last one. A leave waits
+  CHAT_JOIN_LEAVE_DEBOUNCE seconds and is dropped, together with the join,
+  if the user reconnects meanwhile. Connections are counted per process.
+
+What survives is collected per room for CHAT_EVENT_BATCH_WINDOW seconds and
+sent as one ``room_state`` event listing every change, at most
+CHAT_EVENT_BATCH_SIZE changes per event. ``counters`` tallies events
+received, broadcast and suppressed since the process started.
+"""
+import asyncio
+import math
+import time
+from collections import Counter
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .writer import room_group_name
+
+DEFAULT_TYPING_INTERVAL = 2.0  # seconds
+DEFAULT_JOIN_LEAVE_DEBOUNCE = 3.0  # seconds
+DEFAULT_BATCH_WINDOW = 0.1  # seconds
+DEFAULT_BATCH_SIZE = 50
+
+
+class TypingState:
+    __slots__ = ('broadcast', 'broadcast_at', 'timer')
+
+    def __init__(self):
+        self.broadcast = False  # the state other members last saw
+        self.broadcast_at = -math.inf
+        self.timer = None  # pending flip of the broadcast state
+
+
+class RoomEventCoalescer:
+    """Per-process throttle and batcher of typing and join/leave events"""
+
+    def __init__(self, typing_interval=None, debounce=None, batch_window=None, batch_size=None):
+        self._typing_interval = typing_interval
+        self._debounce = debounce
+        self._batch_window = batch_window
+        self._batch_size = batch_size
+        self.counters = Counter()
+        self._loop = None
+        self._reset()
+
+    def _reset(self):
+        self._typing = {}  # (room_id, user_id) -> TypingState
+        self._connections = Counter()  # (room_id, user_id) -> open connections
+        self._leaving = {}  # (room_id, user_id) -> timer of the debounced leave
+        self._batches = {}  # room_id -> [event, ...]
+        self._timers = {}  # room_id -> timer of the batch
+
+    @property
+    def typing_interval(self):
+        if self._typing_interval is not None:
+            return self._typing_interval
+        return getattr(settings, 'CHAT_TYPING_INTERVAL', DEFAULT_TYPING_INTERVAL)
+
+    @property
+    def debounce(self):
+        if self._debounce is not None:
+            return self._debounce
+        return getattr(settings, 'CHAT_JOIN_LEAVE_DEBOUNCE', DEFAULT_JOIN_LEAVE_DEBOUNCE)
+
+    @property
+    def batch_window(self):
+        if self._batch_window is not None:
+            return self._batch_window
+        return getattr(settings, 'CHAT_EVENT_BATCH_WINDOW', DEFAULT_BATCH_WINDOW)
+
+    @property
+    def batch_size(self):
+        if self._batch_size is not None:
+            return self._batch_size
+        return getattr(settings, 'CHAT_EVENT_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+
+    def _bind(self):
+        """Attach to the running event loop, starting afresh if it changed"""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._reset()
+        return loop
+
+    def stats(self):
+        suppressed = self.counters['typing_suppressed'] + self.counters['joins_suppressed'] \
+            + self.counters['leaves_suppressed']
+        return {**self.counters, 'suppressed': suppressed}
+
+    async def typing(self, room_id, user_id, username, is_typing):
+        loop = self._bind()
+        self.counters['typing_received'] += 1
+        key = (room_id, user_id)
+        state = self._typing.setdefault(key, TypingState())
+        is_typing = bool(is_typing)
+
+        if is_typing == state.broadcast:
+            # Others already see this state; a pending flip back is dropped too
+            self.counters['typing_suppressed'] += 1
+            if state.timer is not None:
+                state.timer.cancel()
+                state.timer = None
+                self.counters['typing_suppressed'] += 1
+            return
+        if state.timer is not None:
+            # The same flip is already waiting for the interval
+            self.counters['typing_suppressed'] += 1
+            return
+
+        wait = state.broadcast_at + self.typing_interval - time.monotonic()
+        if wait > 0:
+            state.timer = loop.call_later(wait, self._typing_due, key, username)
+            return
+        await self._broadcast_typing(key, username)
+
+    def _typing_due(self, key, username):
+        state = self._typing.get(key)
+        if state is not None and state.timer is not None:
+            state.timer = None
+            self._loop.create_task(self._broadcast_typing(key, username))
+
+    async def _broadcast_typing(self, key, username):
+        state = self._typing[key]
+        state.broadcast = not state.broadcast
+        state.broadcast_at = time.monotonic()
+        room_id, user_id = key
+        await self._queue(room_id, {
+            'type': 'typing',
+            'user': username,
+            'user_id': user_id,
+            'is_typing': state.broadcast
+        })
+
+    async def joined(self, room_id, user_id, username):
+        self._bind()
+        key = (room_id, user_id)
+        self._connections[key] += 1
+        if self._connections[key] > 1:
+            self.counters['joins_suppressed'] += 1
+            return
+        leaving = self._leaving.pop(key, None)
+        if leaving is not None:
+            # Back before the leave went out: neither is announced
+            leaving.cancel()
+            self.counters['joins_suppressed'] += 1
+            self.counters['leaves_suppressed'] += 1
+            return
+        await self._queue(room_id, {'type': 'user_joined', 'user': username, 'user_id': user_id})
+
+    async def left(self, room_id, user_id, username):
+        loop = self._bind()
+        key = (room_id, user_id)
+        if self._connections[key] > 1:
+            self._connections[key] -= 1
+            self.counters['leaves_suppressed'] += 1
+            return
+        self._connections.pop(key, None)
+        self._leaving[key] = loop.call_later(self.debounce, self._leave_due, key, username)
+
+    def _leave_due(self, key, username):
+        if self._leaving.pop(key, None) is None:
+            return
+        state = self._typing.pop(key, None)
+        if state is not None and state.timer is not None:
+            state.timer.cancel()
+        room_id, user_id = key
+        self._loop.create_task(
+            self._queue(room_id, {'type': 'user_left', 'user': username, 'user_id': user_id})
+        )
+
+    async def _queue(self, room_id, event):
+        self.counters[f'{event["type"]}_broadcast'] += 1
+        batch = self._batches.setdefault(room_id, [])
+        batch.append(event)
+        if len(batch) >= self.batch_size:
+            await self.flush(room_id)
+        elif room_id not in self._timers:
+            self._timers[room_id] = self._loop.call_later(
+                self.batch_window, lambda: self._loop.create_task(self.flush(room_id))
+            )
+
+    async def flush(self, room_id=None):
+        """Send the collected events of one room, or of every room"""
+        room_ids = list(self._batches) if room_id is None else [room_id]
+        channel_layer = get_channel_layer()
+        for room_id in room_ids:
+            timer = self._timers.pop(room_id, None)
+            if timer is not None:
+                timer.cancel()
+            events = self._batches.pop(room_id, None)
+            if not events:
+                continue
+            self.counters['frames_sent'] += 1
+            await channel_layer.group_send(room_group_name(room_id), {
+                'type': 'room_state',
+                'room_id': room_id,
+                'events': events
+            })
+
+
+room_events = RoomEventCoalescer()
@@ -1,16 +1,41 @@
+"""
+WebSocket consumers for chat.
+
+ChatConsumer serves one room per connection at ws/chat/<room_id>/.
+UserChatConsumer serves a whole user at ws/chat/: the client subscribes it
+to any number of its rooms with subscribe/unsubscribe frames, names the room
+in every frame it sends about one, and receives every room event wrapped in
+an envelope carrying its room_id. Typing, join and leave changes arrive
+coalesced into ``events`` frames (see chat.coalescing). Either connection
+also carries the user's notifications and the presence changes of the
+users they follow, which arrive on the user's own group. A client with many conversations open thus
+needs one socket, one authentication and one membership check per
+subscription batch instead of one of each per room.
+"""
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from .models import ChatRoom, Message, MessageReadStatus
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from community.presence import presence, user_group_name
+from .coalescing import room_events
+from .history import history_page, history_params, next_cursor
+from .membership import accessible_rooms, is_participant
+from .models import Message
+from .serializers import MessageSerializer
+from .watermarks import advance
+from .writer import COMMIT, message_writer, room_group_name
 
 User = get_user_model()
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
-        self.room_id = self.scope['url_route']['kwargs']['room_id']
-        self.room_group_name = f'chat_{self.room_id}'
+        self.room_id = int(self.scope['url_route']['kwargs']['room_id'])
+        self.room_group_name = room_group_name(self.room_id)
+        self.rooms = set()
         
         print(f"WebSocket connection attempt for room {self.room_id}")
         print(f"User: {self.scope['user']}")
@@ -30,81 +55,115 @@ class ChatConsumer(AsyncWebsocketConsumer):
         
         print("User authenticated and has room access, accepting connection")
         
-        # Join room group
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
-        )
+        # Join room group and send user joined message
+        await self.join_rooms([self.room_id])
+        await self.join_user()
         
         await self.accept()
+        await self.start_presence()
         
         print(f"WebSocket connection accepted for user {self.scope['user'].username}")
-        
-        # Send user joined message
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'user_joined',
-                'user': self.scope['user'].username,
-                'user_id': self.scope['user'].id
-            }
-        )
     
     async def disconnect(self, close_code):
-        # Leave room group
-        await self.channel_layer.group_discard(
-            self.room_group_name,
+        await self.leave_rooms(list(getattr(self, 'rooms', ())))
+        await self.leave_user()
+    
+    async def join_user(self):
+        # Notifications and presence changes of followed users arrive on the user's own group
+        await self.channel_layer.group_add(
+            user_group_name(self.scope['user'].id),
             self.channel_name
         )
-        
-        # Send user left message
-        if hasattr(self, 'room_group_name'):
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'user_left',
-                    'user': self.scope['user'].username,
-                    'user_id': self.scope['user'].id
-                }
+    
+    async def start_presence(self):
+        await presence.connect(self.scope['user'].id, self.channel_name)
+        self.tracks_presence = True
+    
+    async def leave_user(self):
+        if getattr(self, 'tracks_presence', False):
+            await self.channel_layer.group_discard(
+                user_group_name(self.scope['user'].id),
+                self.channel_name
             )
+            await presence.disconnect(self.scope['user'].id, self.channel_name)
+    
+    async def join_rooms(self, room_ids):
+        """Subscribe to rooms the user was checked to belong to"""
+        for room_id in room_ids:
+            if room_id in self.rooms:
+                continue
+            await self.channel_layer.group_add(room_group_name(room_id), self.channel_name)
+            self.rooms.add(room_id)
+            await room_events.joined(room_id, self.scope['user'].id, self.scope['user'].username)
+    
+    async def leave_rooms(self, room_ids):
+        for room_id in room_ids:
+            if room_id not in self.rooms:
+                continue
+            await self.channel_layer.group_discard(room_group_name(room_id), self.channel_name)
+            self.rooms.discard(room_id)
+            await room_events.left(room_id, self.scope['user'].id, self.scope['user'].username)
+    
+    def frame_room(self, frame):
+        """The room a client frame is about, or None if this connection may not use it"""
+        return self.room_id
+    
+    async def send_error(self, error):
+        await self.send(text_data=json.dumps({'type': 'error', 'error': error}))
     
     async def receive(self, text_data):
         text_data_json = json.loads(text_data)
         message_type = text_data_json.get('type', 'message')
         
+        if message_type == 'read_message':
+            message_id = text_data_json.get('message_id')
+            if message_id:
+                await self.mark_message_read(message_id)
+            return
+        
+        if message_type == 'heartbeat':
+            # Keeps the user online; clients send one every PRESENCE['TTL'] / 3 seconds
+            await presence.heartbeat(self.scope['user'].id, self.channel_name)
+            return
+        
+        if message_type not in ('message', 'typing', 'sync'):
+            return
+        
+        room_id = self.frame_room(text_data_json)
+        if room_id is None:
+            await self.send_error('Not subscribed to this room')
+            return
+        
         if message_type == 'message':
-            message = text_data_json['message']
-            
-            # Save message to database
-            saved_message = await self.save_message(message)
+            message = await self.save_message(room_id, text_data_json['message'])
+            if message is None:
+                return
             
             # Send message to room group
             await self.channel_layer.group_send(
-                self.room_group_name,
+                room_group_name(room_id),
                 {
                     'type': 'chat_message',
-                    'message': saved_message
+                    'room_id': room_id,
+                    'message': message
                 }
             )
         
         elif message_type == 'typing':
             is_typing = text_data_json.get('is_typing', False)
             
-            # Send typing status to room group
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'typing_status',
-                    'user': self.scope['user'].username,
-                    'user_id': self.scope['user'].id,
-                    'is_typing': is_typing
-                }
-            )
+            # Throttled and batched with the room's other state changes
+            await room_events.typing(room_id, self.scope['user'].id, self.scope['user'].username, is_typing)
         
-        elif message_type == 'read_message':
-            message_id = text_data_json.get('message_id')
-            if message_id:
-                await self.mark_message_read(message_id)
+        elif message_type == 'sync':
+            # Catch up after a reconnect: {"type": "sync", "after": <last message id>}
+            try:
+                before, after, limit = history_params(text_data_json)
+            except ValueError as e:
+                await self.send_error(str(e))
+                return
+            history = await self.load_history(room_id, before, after, limit)
+            await self.send(text_data=json.dumps(history, cls=DjangoJSONEncoder))
     
     async def chat_message(self, event):
         message = event['message']
@@ -112,94 +171,181 @@ class ChatConsumer(AsyncWebsocketConsumer):
         # Send message to WebSocket
         await self.send(text_data=json.dumps({
             'type': 'message',
+            'room_id': event['room_id'],
             'message': message
         }))
     
-    async def typing_status(self, event):
-        # Don't send typing status to the sender
-        if event['user_id'] != self.scope['user'].id:
+    async def room_state(self, event):
+        # Typing, join and leave changes of a room, batched by chat.coalescing;
+        # the user's own changes are not sent back to them
+        events = [change for change in event['events'] if change['user_id'] != self.scope['user'].id]
+        if events:
             await self.send(text_data=json.dumps({
-                'type': 'typing',
-                'user': event['user'],
-                'user_id': event['user_id'],
-                'is_typing': event['is_typing']
+                'type': 'events',
+                'room_id': event['room_id'],
+                'events': events
             }))
     
-    async def user_joined(self, event):
-        # Don't send join message to the user who joined
-        if event['user_id'] != self.scope['user'].id:
-            await self.send(text_data=json.dumps({
-                'type': 'user_joined',
-                'user': event['user'],
-                'user_id': event['user_id']
-            }))
+    async def presence_changed(self, event):
+        # Online/offline changes of users this user follows
+        await self.send(text_data=json.dumps({
+            'type': 'presence',
+            'changes': event['changes']
+        }))
     
-    async def user_left(self, event):
-        # Don't send leave message to the user who left
-        if event['user_id'] != self.scope['user'].id:
-            await self.send(text_data=json.dumps({
-                'type': 'user_left',
-                'user': event['user'],
-                'user_id': event['user_id']
-            }))
+    async def notification(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'notification',
+            'notification': event['notification']
+        }, cls=DjangoJSONEncoder))
+    
+    async def message_saved(self, event):
+        # Provisional IDs of broadcast messages, now stored
+        await self.send(text_data=json.dumps({
+            'type': 'message_saved',
+            'room_id': event['room_id'],
+            'messages': event['messages']
+        }))
+    
+    async def message_failed(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'message_failed',
+            'room_id': event['room_id'],
+            'provisional_ids': event['provisional_ids']
+        }))
     
     @database_sync_to_async
     def check_room_access(self):
-        try:
-            room = ChatRoom.objects.get(id=self.room_id)
-            return room.can_user_access(self.scope['user'])
-        except ChatRoom.DoesNotExist:
-            return False
+        # Checked once; frames on this connection rely on the result
+        return is_participant(self.room_id, self.scope['user'].id)
     
-    @database_sync_to_async
-    def save_message(self, message_content):
-        try:
-            room = ChatRoom.objects.get(id=self.room_id)
-            message = Message.objects.create(
-                room=room,
-                sender=self.scope['user'],
-                content=message_content,
-                message_type='text'
-            )
-            
-            # Update room's updated_at timestamp
-            room.save()
+    async def save_message(self, room_id, message_content):
+        """Queue the message with the writer and build its broadcast payload"""
+        user = self.scope['user']
+        provisional_id, stored = message_writer.submit(
+            room_id, user.id, message_content, 'text'
+        )
+        message = {
+            'id': None,
+            'provisional_id': provisional_id,
+            'content': message_content,
+            'sender': self.sender_payload(),
+            'message_type': 'text',
+            'created_at': timezone.now().isoformat(),
+            'is_read': False
+        }
+        if message_writer.durability == COMMIT:
+            try:
+                message_id, created_at = await stored
+            except Exception:
+                return None
+            message['id'] = message_id
+            message['created_at'] = created_at.isoformat()
+        return message
+    
+    def sender_payload(self):
+        # Built from the user loaded at connect, so sending needs no queries
+        if not hasattr(self, '_sender_payload'):
+            user = self.scope['user']
             
             # Construct full profile picture URL
             profile_picture_url = None
-            if message.sender.profile_picture:
-                if message.sender.profile_picture.url.startswith('http'):
-                    profile_picture_url = message.sender.profile_picture.url
+            if user.profile_picture:
+                if user.profile_picture.url.startswith('http'):
+                    profile_picture_url = user.profile_picture.url
                 else:
                     # Add domain for relative URLs
-                    from django.conf import settings
-                    profile_picture_url = f"http://127.0.0.1:8000{message.sender.profile_picture.url}"
+                    profile_picture_url = f"http://127.0.0.1:8000{user.profile_picture.url}"
             
-            return {
-                'id': message.id,
-                'content': message.content,
-                'sender': {
-                    'id': message.sender.id,
-                    'username': message.sender.username,
-                    'profile_picture': profile_picture_url
-                },
-                'message_type': message.message_type,
-                'created_at': message.created_at.isoformat(),
-                'is_read': False
+            self._sender_payload = {
+                'id': user.id,
+                'username': user.username,
+                'profile_picture': profile_picture_url
             }
-        except ChatRoom.DoesNotExist:
-            return None
+        return self._sender_payload
+    
+    @database_sync_to_async
+    def load_history(self, room_id, before, after, limit):
+        page, has_more = history_page(room_id, before, after, limit)
+        return {
+            'type': 'sync',
+            'room_id': room_id,
+            'messages': MessageSerializer(page, many=True).data,
+            'isNext': has_more,
+            'nextCursor': next_cursor(page, has_more, after)
+        }
     
     @database_sync_to_async
     def mark_message_read(self, message_id):
+        room_id = Message.objects.filter(id=message_id).values_list('room_id', flat=True).first()
+        if room_id is None:
+            return False
+        # Membership of the rooms this connection subscribed to was checked already
+        if room_id not in self.rooms and not is_participant(room_id, self.scope['user'].id):
+            return False
+        advance(room_id, self.scope['user'].id, message_id)
+        return True
+
+
+class UserChatConsumer(ChatConsumer):
+    """
+    One connection per user, multiplexing their rooms.
+    
+    Client frames:
+        {"type": "subscribe", "room_ids": [1, 2]}   -> {"type": "subscribed", "room_ids": [...], "denied": [...]}
+        {"type": "unsubscribe", "room_ids": [1]}    -> {"type": "unsubscribed", "room_ids": [...]}
+        {"type": "message" | "typing" | "sync", "room_id": 1, ...}
+        {"type": "read_message" | "heartbeat", ...}
+    Room events carry the room_id they belong to.
+    """
+    
+    async def connect(self):
+        self.rooms = set()
+        if not self.scope['user'].is_authenticated:
+            await self.close()
+            return
+        
+        await self.join_user()
+        await self.accept()
+        await self.start_presence()
+    
+    def frame_room(self, frame):
+        try:
+            room_id = int(frame.get('room_id'))
+        except (TypeError, ValueError):
+            return None
+        return room_id if room_id in self.rooms else None
+    
+    async def receive(self, text_data):
+        text_data_json = json.loads(text_data)
+        message_type = text_data_json.get('type')
+        
+        if message_type not in ('subscribe', 'unsubscribe'):
+            await super().receive(text_data)
+            return
+        
+        room_ids = text_data_json.get('room_ids')
         try:
-            message = Message.objects.get(id=message_id)
-            if message.room.can_user_access(self.scope['user']):
-                MessageReadStatus.objects.get_or_create(
-                    message=message,
-                    user=self.scope['user']
-                )
-                return True
-        except Message.DoesNotExist:
-            pass
-        return False
+            room_ids = [int(room_id) for room_id in room_ids]
+        except (TypeError, ValueError):
+            await self.send_error('room_ids must be a list of room IDs')
+            return
+        
+        if message_type == 'unsubscribe':
+            room_ids = [room_id for room_id in room_ids if room_id in self.rooms]
+            await self.leave_rooms(room_ids)
+            await self.send(text_data=json.dumps({'type': 'unsubscribed', 'room_ids': room_ids}))
+            return
+        
+        new_rooms = set(room_ids) - self.rooms
+        if len(self.rooms) + len(new_rooms) > settings.CHAT_MAX_SUBSCRIPTIONS:
+            await self.send_error(f'A connection can subscribe to at most {settings.CHAT_MAX_SUBSCRIPTIONS} rooms')
+            return
+        
+        allowed = await database_sync_to_async(accessible_rooms)(new_rooms, self.scope['user'].id)
+        await self.join_rooms(sorted(allowed))
+        await self.send(text_data=json.dumps({
+            'type': 'subscribed',
+            'room_ids': sorted(set(room_ids) & self.rooms),
+            'denied': sorted(new_rooms - allowed)
+        }))
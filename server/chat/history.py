@@ -0,0 +1,67 @@
+"""
+Cursor-paginated chat history.
+
+A room's messages are paged by ID over the (room, id) index, so a page
+costs the same however long the room's history is:
+
+* no cursor: the newest messages;
+* ``before=<id>``: the messages just older than that ID, for scrolling back;
+* ``after=<id>``: the messages newer than the last one a client holds, for
+  catching up after a reconnect.
+
+Pages are returned oldest first and fetch one extra row to tell whether
+more messages exist in the direction being paged. ``nextCursor`` is the ID
+to pass back as the same parameter for the following page.
+"""
+from .models import Message
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+
+def _optional_id(params, name):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be a message ID')
+    if value < 0:
+        raise ValueError(f'{name} must be a message ID')
+    return value
+
+
+def history_params(params):
+    """(before, after, limit) from query parameters or a sync frame; raises ValueError"""
+    before = _optional_id(params, 'before')
+    after = _optional_id(params, 'after')
+    if before is not None and after is not None:
+        raise ValueError('Use either before or after, not both')
+    try:
+        limit = int(params.get('limit') or DEFAULT_LIMIT)
+    except (TypeError, ValueError):
+        raise ValueError('limit must be a number')
+    return before, after, min(max(limit, 1), MAX_LIMIT)
+
+
+def history_page(room_id, before=None, after=None, limit=DEFAULT_LIMIT):
+    """(messages oldest first, whether more exist in the direction paged)"""
+    messages = Message.objects.filter(room_id=room_id).select_related('sender__activity')
+    if after is not None:
+        rows = list(messages.filter(id__gt=after).order_by('id')[:limit + 1])
+        return rows[:limit], len(rows) > limit
+
+    if before is not None:
+        messages = messages.filter(id__lt=before)
+    rows = list(messages.order_by('-id')[:limit + 1])
+    page = rows[:limit]
+    page.reverse()
+    return page, len(rows) > limit
+
+
+def next_cursor(page, has_more, after=None):
+    """The ID continuing the page in its direction, or None at the end"""
+    if not has_more or not page:
+        return None
+    return page[-1].id if after is not None else page[0].id
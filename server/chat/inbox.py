@@ -0,0 +1,67 @@
+"""
+Denormalized state behind the chat room list.
+
+Each ChatRoom carries a snapshot of its newest message and each participant's
+ReadWatermark an unread counter, so the inbox is read without touching the
+message table: one query for the rooms (with the snapshot's sender and the
+viewer's counter) and one for the participants with their activity.
+
+record_messages() keeps both up to date as messages are stored, with one
+UPDATE of the room and one of its watermarks per room and batch. Moving a
+watermark recounts the messages above it (see chat.watermarks.advance), so
+counters cannot drift past a read.
+"""
+from collections import Counter, defaultdict
+
+from django.contrib.auth import get_user_model
+from django.db.models import Case, F, IntegerField, OuterRef, Prefetch, Q, Subquery, Value, When
+
+from .models import ChatRoom, Message, ReadWatermark
+
+User = get_user_model()
+
+PREVIEW_LENGTH = ChatRoom._meta.get_field('last_message_content').max_length
+
+
+def record_messages(messages):
+    """Fold newly stored messages into their rooms' snapshots and unread counters"""
+    by_room = defaultdict(list)
+    for message in messages:
+        by_room[message.room_id].append(message)
+
+    for room_id, room_messages in by_room.items():
+        if all(message.id is not None for message in room_messages):
+            latest = max(room_messages, key=lambda message: message.id)
+        else:
+            # Rows from a bulk insert that returned no IDs: the snapshot needs a stored one
+            latest = Message.objects.filter(room_id=room_id).order_by('-id').first()
+        ChatRoom.objects.filter(
+            Q(last_message_id__isnull=True) | Q(last_message_id__lt=latest.id), pk=room_id
+        ).update(
+            last_message_id=latest.id,
+            last_message_sender_id=latest.sender_id,
+            last_message_content=latest.content[:PREVIEW_LENGTH],
+            last_message_type=latest.message_type,
+            last_message_at=latest.created_at,
+            updated_at=latest.created_at,
+        )
+
+        # Every participant gains the batch, less the messages they sent themselves
+        own = Counter(message.sender_id for message in room_messages)
+        increment = Value(len(room_messages)) - Case(
+            *[When(user_id=user_id, then=Value(count)) for user_id, count in own.items()],
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+        ReadWatermark.objects.filter(room_id=room_id).update(unread_count=F('unread_count') + increment)
+
+
+def inbox(user):
+    """The user's rooms, with everything ChatRoomSerializer reads"""
+    unread = ReadWatermark.objects.filter(room=OuterRef('pk'), user=user).values('unread_count')
+    return (
+        ChatRoom.objects.filter(participants=user)
+        .select_related('last_message_sender__activity')
+        .prefetch_related(Prefetch('participants', queryset=User.objects.select_related('activity')))
+        .annotate(viewer_unread_count=Subquery(unread, output_field=IntegerField()))
+    )
@@ -0,0 +1,135 @@
+import contextlib
+import io
+import json
+import time
+import tracemalloc
+
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chat.middleware import JWTAuthMiddlewareStack
+from chat.models import ChatRoom
+from chat.routing import websocket_urlpatterns
+
+from .benchmark_chat_throughput import IN_MEMORY_LAYER
+
+User = get_user_model()
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = 'Compare sockets, queries and memory of per-room and multiplexed chat connections'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50, help='Connected users')
+        parser.add_argument('--rooms', type=int, default=10, help='Open conversations per user')
+
+    def handle(self, *args, **options):
+        user_count = options['users']
+        room_count = options['rooms']
+        # database_sync_to_async closes connections found inside a transaction,
+        # so the benchmark data is committed and deleted afterwards
+        users = [
+            User.objects.create_user(
+                username=f'chat-benchmark-{i}',
+                email=f'chat-benchmark-{i}@example.com',
+                password='benchmark'
+            )
+            for i in range(user_count)
+        ]
+        rooms = [ChatRoom.objects.create(name=f'Benchmark room {i}', is_group=True) for i in range(room_count)]
+        for room in rooms:
+            room.participants.set(users)
+        tokens = {user.pk: str(AccessToken.for_user(user)) for user in users}
+        room_ids = [room.pk for room in rooms]
+
+        try:
+            with override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER):
+                per_room = self.run(self.per_room, users, tokens, room_ids)
+                multiplexed = self.run(self.multiplexed, users, tokens, room_ids)
+        finally:
+            ChatRoom.objects.filter(pk__in=room_ids).delete()
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+        self.stdout.write(f'{user_count} users with {room_count} rooms open each')
+        self.stdout.write(f'{"":24}{"per room":>12}{"":4}{"multiplexed":>10}')
+        for label, key, unit, digits in (
+            ('Sockets', 'sockets', '', 0),
+            ('Connect time', 'seconds', ' s', 1),
+            ('Queries', 'queries', '', 0),
+            ('Memory per user', 'memory', ' KiB', 1),
+        ):
+            self.stdout.write(
+                f'{label:24}{per_room[key]:>12,.{digits}f}{unit:4}{multiplexed[key]:>10,.{digits}f}{unit}'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Sockets: {per_room["sockets"] / multiplexed["sockets"]:.0f}x fewer, '
+            f'queries: {per_room["queries"] / max(multiplexed["queries"], 1):.1f}x fewer, '
+            f'memory: {per_room["memory"] / multiplexed["memory"]:.1f}x less'
+        ))
+
+    def run(self, scenario, users, tokens, room_ids):
+        """Connect every user, measuring queries and memory held until they disconnect"""
+        cache.clear()
+        application = JWTAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+        counter = QueryCounter()
+        # The middleware and ChatConsumer log every connection with print()
+        with contextlib.redirect_stdout(io.StringIO()), connection.execute_wrapper(counter):
+            tracemalloc.start()
+            try:
+                result = async_to_sync(scenario)(application, users, tokens, room_ids)
+            finally:
+                tracemalloc.stop()
+        result['queries'] = counter.count
+        result['memory'] = result['memory'] / len(users) / 1024
+        return result
+
+    async def open(self, application, path, token):
+        communicator = WebsocketCommunicator(application, f'{path}?token={token}')
+        connected, _ = await communicator.connect()
+        assert connected
+        return communicator
+
+    async def per_room(self, application, users, tokens, room_ids):
+        baseline = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        communicators = [
+            await self.open(application, f'/ws/chat/{room_id}/', tokens[user.pk])
+            for user in users
+            for room_id in room_ids
+        ]
+        return await self.finish(communicators, start, baseline)
+
+    async def multiplexed(self, application, users, tokens, room_ids):
+        baseline = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        communicators = []
+        for user in users:
+            communicator = await self.open(application, '/ws/chat/', tokens[user.pk])
+            await communicator.send_to(text_data=json.dumps({'type': 'subscribe', 'room_ids': room_ids}))
+            while json.loads(await communicator.receive_from())['type'] != 'subscribed':
+                pass
+            communicators.append(communicator)
+        return await self.finish(communicators, start, baseline)
+
+    async def finish(self, communicators, start, baseline):
+        seconds = time.perf_counter() - start
+        memory = tracemalloc.get_traced_memory()[0] - baseline
+        for communicator in communicators:
+            await communicator.disconnect()
+        return {'sockets': len(communicators), 'seconds': seconds, 'memory': memory}
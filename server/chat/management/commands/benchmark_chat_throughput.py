@@ -0,0 +1,141 @@
+import asyncio
+import contextlib
+import io
+import json
+import time
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from django.urls import re_path
+
+from chat import consumers
+from chat.models import ChatRoom, Message
+from chat.writer import COMMIT, DEFERRED, MessageWriter
+
+User = get_user_model()
+
+IN_MEMORY_LAYER = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        'CONFIG': {'capacity': 100000},
+    },
+}
+
+
+class InlineChatConsumer(consumers.ChatConsumer):
+    """The previous write path: a room lookup, an INSERT and a full room save per message"""
+
+    @database_sync_to_async
+    def save_message(self, room_id, message_content):
+        room = ChatRoom.objects.get(id=room_id)
+        message = Message.objects.create(
+            room=room, sender=self.scope['user'], content=message_content, message_type='text'
+        )
+        room.save()
+        return {
+            'id': message.id,
+            'content': message.content,
+            'sender': self.sender_payload(),
+            'message_type': message.message_type,
+            'created_at': message.created_at.isoformat(),
+            'is_read': False
+        }
+
+
+class Command(BaseCommand):
+    help = 'Compare chat messages per second over WebSockets with inline and batched writes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=20, help='Participants connected to one room')
+        parser.add_argument('--messages', type=int, default=50, help='Messages sent by each participant')
+
+    def handle(self, *args, **options):
+        clients = options['clients']
+        messages = options['messages']
+        original = consumers.message_writer
+        # database_sync_to_async closes connections found inside a transaction,
+        # so the benchmark data is committed and deleted afterwards
+        users = [
+            User.objects.create_user(
+                username=f'chat-benchmark-{i}',
+                email=f'chat-benchmark-{i}@example.com',
+                password='benchmark'
+            )
+            for i in range(clients)
+        ]
+        room = ChatRoom.objects.create(name='Benchmark room', is_group=True)
+        room.participants.set(users)
+        try:
+            with override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER):
+                before = self.run(InlineChatConsumer, room, users, messages)
+                self.stdout.write(f'Inline writes:             {before:,.0f} messages/s')
+
+                results = {}
+                for durability in (COMMIT, DEFERRED):
+                    consumers.message_writer = MessageWriter(durability=durability)
+                    results[durability] = self.run(consumers.ChatConsumer, room, users, messages)
+                    self.stdout.write(
+                        f'Batched writes ({durability}): {results[durability]:>9,.0f} messages/s'
+                    )
+
+            stored = Message.objects.filter(room=room).count()
+            expected = 3 * clients * messages
+            assert stored == expected, f'{stored} messages stored, expected {expected}'
+            self.stdout.write(self.style.SUCCESS(
+                f'Speedup: {results[COMMIT] / before:.1f}x (commit), '
+                f'{results[DEFERRED] / before:.1f}x (deferred)'
+            ))
+        finally:
+            consumers.message_writer = original
+            room.delete()
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+    def run(self, consumer_class, room, users, messages):
+        application = URLRouter([
+            re_path(r'^ws/chat/(?P<room_id>\d+)/$', consumer_class.as_asgi()),
+        ])
+        # The consumer logs every connection with print()
+        with contextlib.redirect_stdout(io.StringIO()):
+            return async_to_sync(self.exchange)(application, room, users, messages)
+
+    async def exchange(self, application, room, users, messages):
+        """Every participant sends its messages; timed until all have received every message"""
+        communicators = []
+        for user in users:
+            communicator = WebsocketCommunicator(application, f'/ws/chat/{room.pk}/')
+            communicator.scope['user'] = user
+            connected, _ = await communicator.connect()
+            assert connected
+            communicators.append(communicator)
+
+        expected = len(users) * messages
+
+        async def send(communicator, index):
+            for i in range(messages):
+                await communicator.send_to(text_data=json.dumps({
+                    'type': 'message', 'message': f'Message {i} from participant {index}'
+                }))
+
+        async def receive(communicator):
+            received = 0
+            while received < expected:
+                frame = json.loads(await communicator.receive_from(timeout=30))
+                if frame['type'] == 'message':
+                    received += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(send(communicator, index) for index, communicator in enumerate(communicators)),
+            *(receive(communicator) for communicator in communicators),
+        )
+        await consumers.message_writer.flush()
+        elapsed = time.perf_counter() - start
+
+        for communicator in communicators:
+            await communicator.disconnect()
+        return expected / elapsed
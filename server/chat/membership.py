@@ -0,0 +1,125 @@
+"""
+Cached chat room membership.
+
+Every WebSocket connect, read receipt and mark-read request asks whether a
+user belongs to a room. The participant IDs of each room are kept as one
+frozenset in the shared cache (settings.CACHES), so a check is one cache
+read however large the room. Entries are tagged with the room's version,
+a random token kept under its own key: signals on ChatRoom.participants
+replace the version once the change commits, and entries of any other
+version are ignored. The next check reloads the room with a single query
+over the join table. A check that loaded the old participants just before
+a change committed stores them under the version it read before its
+query, so they are ignored as soon as the new version is set.
+
+Rooms with more than MAX_CACHED_PARTICIPANTS members are not cached and,
+like any check the cache cannot answer, fall back to an EXISTS query for
+the one (room, user) pair. accessible_rooms() answers for many rooms at
+once, as a multiplexed connection subscribes, with one cache read and at
+most one query for the rooms the cache cannot answer.
+"""
+import logging
+import uuid
+
+from django.core.cache import cache
+
+from .models import ChatRoom
+
+logger = logging.getLogger(__name__)
+
+CACHE_TIMEOUT = 3600
+MAX_CACHED_PARTICIPANTS = 5000
+TOO_LARGE = 'too-large'
+
+
+def cache_key(room_id):
+    return f'chat:room:{room_id}:participants'
+
+
+def version_key(room_id):
+    return f'chat:room:{room_id}:version'
+
+
+def _current(cached, room_id):
+    """The room's entry in a get_many() result, if it has the room's current version"""
+    entry = cached.get(cache_key(room_id))
+    version = cached.get(version_key(room_id))
+    if not isinstance(entry, tuple) or version is None or entry[0] != version:
+        return None
+    return entry[1]
+
+
+def participant_ids(room_id):
+    """The room's participant IDs, or None when the room is too large to cache"""
+    try:
+        cached = cache.get_many([cache_key(room_id), version_key(room_id)])
+        members = _current(cached, room_id)
+        if members is not None:
+            return None if members == TOO_LARGE else members
+        version = cached.get(version_key(room_id))
+        if version is None:
+            cache.add(version_key(room_id), uuid.uuid4().hex, CACHE_TIMEOUT)
+            version = cache.get(version_key(room_id))
+    except Exception:
+        logger.warning('Room membership cache unavailable', exc_info=True)
+        return None
+
+    # A room without participants yields one NULL row
+    rows = ChatRoom.objects.filter(pk=room_id).values_list('participants', flat=True)
+    ids = [user_id for user_id in rows[:MAX_CACHED_PARTICIPANTS + 1] if user_id is not None]
+    members = frozenset(ids) if len(ids) <= MAX_CACHED_PARTICIPANTS else None
+    if version is not None:
+        try:
+            cache.set(cache_key(room_id), (version, TOO_LARGE if members is None else members), CACHE_TIMEOUT)
+        except Exception:
+            logger.warning('Room membership cache unavailable', exc_info=True)
+    return members
+
+
+def is_participant(room_id, user_id):
+    """Whether the user belongs to the room"""
+    if room_id is None or user_id is None:
+        return False
+    members = participant_ids(room_id)
+    if members is not None:
+        return user_id in members
+    return ChatRoom.objects.filter(pk=room_id, participants=user_id).exists()
+
+
+def accessible_rooms(room_ids, user_id):
+    """The subset of room_ids the user belongs to"""
+    room_ids = set(room_ids)
+    if not room_ids or user_id is None:
+        return set()
+    try:
+        cached = cache.get_many(
+            [cache_key(room_id) for room_id in room_ids] + [version_key(room_id) for room_id in room_ids]
+        )
+    except Exception:
+        logger.warning('Room membership cache unavailable', exc_info=True)
+        cached = {}
+
+    allowed, unknown = set(), set()
+    for room_id in room_ids:
+        members = _current(cached, room_id)
+        if members is None or members == TOO_LARGE:
+            unknown.add(room_id)
+        elif user_id in members:
+            allowed.add(room_id)
+    if unknown:
+        allowed.update(
+            ChatRoom.objects.filter(pk__in=unknown, participants=user_id).values_list('pk', flat=True)
+        )
+    return allowed
+
+
+def invalidate(room_ids):
+    """Give the rooms new versions, so their cached participants are ignored"""
+    versions = {version_key(room_id): uuid.uuid4().hex for room_id in room_ids}
+    if not versions:
+        return
+    try:
+        cache.set_many(versions, CACHE_TIMEOUT)
+    except Exception:
+        # Runs on commit: the change is stored, the entries lapse with CACHE_TIMEOUT
+        logger.warning('Room membership cache unavailable', exc_info=True)
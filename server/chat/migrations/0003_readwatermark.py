@@ -0,0 +1,83 @@
+# Generated by Django 5.2.3 on 2026-10-17 00:42
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+
+ROOMS_PER_BATCH = 500
+
+
+def compact_read_statuses(apps, schema_editor):
+    """
+    One watermark per (room, participant) at the highest message they marked
+    read, built a batch of rooms at a time
+    """
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    MessageReadStatus = apps.get_model('chat', 'MessageReadStatus')
+    ReadWatermark = apps.get_model('chat', 'ReadWatermark')
+    participants = ChatRoom._meta.get_field('participants')
+    Participant = participants.remote_field.through
+    room_field = participants.m2m_field_name()
+    user_field = participants.m2m_reverse_field_name()
+
+    last_room_id = 0
+    while True:
+        room_ids = list(
+            ChatRoom.objects.filter(pk__gt=last_room_id)
+            .order_by('pk')
+            .values_list('pk', flat=True)[:ROOMS_PER_BATCH]
+        )
+        if not room_ids:
+            break
+        last_room_id = room_ids[-1]
+
+        last_read = {
+            (room_id, user_id): message_id
+            for room_id, user_id, message_id in (
+                MessageReadStatus.objects.filter(message__room_id__in=room_ids)
+                .order_by()
+                .values('message__room_id', 'user_id')
+                .annotate(last=Max('message_id'))
+                .values_list('message__room_id', 'user_id', 'last')
+            )
+        }
+        pairs = Participant.objects.filter(**{f'{room_field}__in': room_ids}).values_list(room_field, user_field)
+        ReadWatermark.objects.bulk_create(
+            [
+                ReadWatermark(
+                    room_id=room_id,
+                    user_id=user_id,
+                    last_read_message_id=last_read.get((room_id, user_id), 0),
+                )
+                for room_id, user_id in pairs.iterator()
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_message_room_id_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReadWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_message_id', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_watermarks', to='chat.chatroom')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_read_watermarks', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='readwatermark',
+            constraint=models.UniqueConstraint(fields=('room', 'user'), name='chat_watermark_room_user_uniq'),
+        ),
+        migrations.RunPython(compact_read_statuses, migrations.RunPython.noop),
+    ]
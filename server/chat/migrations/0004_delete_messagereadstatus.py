@@ -0,0 +1,14 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_readwatermark'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='MessageReadStatus',
+        ),
+    ]
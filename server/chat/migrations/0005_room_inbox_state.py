@@ -0,0 +1,107 @@
+# Generated by Django 5.2.3 on 2026-10-17 00:44
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+ROOMS_PER_BATCH = 500
+PREVIEW_LENGTH = 200
+
+
+def populate_inbox_state(apps, schema_editor):
+    """
+    Snapshot each room's newest message and count every watermark's unread
+    messages, a batch of rooms at a time
+    """
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    Message = apps.get_model('chat', 'Message')
+    ReadWatermark = apps.get_model('chat', 'ReadWatermark')
+
+    last_room_id = 0
+    while True:
+        room_ids = list(
+            ChatRoom.objects.filter(pk__gt=last_room_id)
+            .order_by('pk')
+            .values_list('pk', flat=True)[:ROOMS_PER_BATCH]
+        )
+        if not room_ids:
+            break
+        last_room_id = room_ids[-1]
+
+        latest_ids = (
+            Message.objects.filter(room_id__in=room_ids)
+            .order_by()
+            .values('room_id')
+            .annotate(latest=Max('id'))
+            .values_list('latest', flat=True)
+        )
+        rooms = []
+        for message in Message.objects.filter(id__in=list(latest_ids)):
+            rooms.append(ChatRoom(
+                pk=message.room_id,
+                last_message_id=message.id,
+                last_message_sender_id=message.sender_id,
+                last_message_content=message.content[:PREVIEW_LENGTH],
+                last_message_type=message.message_type,
+                last_message_at=message.created_at,
+            ))
+        ChatRoom.objects.bulk_update(rooms, [
+            'last_message_id', 'last_message_sender', 'last_message_content',
+            'last_message_type', 'last_message_at',
+        ])
+
+        unread = (
+            Message.objects.filter(room_id=OuterRef('room_id'), id__gt=OuterRef('last_read_message_id'))
+            .exclude(sender_id=OuterRef('user_id'))
+            .order_by()
+            .values('room_id')
+            .annotate(total=Count('id'))
+            .values('total')
+        )
+        ReadWatermark.objects.filter(room_id__in=room_ids).update(
+            unread_count=Coalesce(Subquery(unread, output_field=IntegerField()), 0)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_delete_messagereadstatus'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message_content',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message_id',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message_sender',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message_type',
+            field=models.CharField(blank=True, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='readwatermark',
+            name='unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_inbox_state, migrations.RunPython.noop),
+    ]
@@ -13,6 +13,15 @@ class ChatRoom(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    # Snapshot of the newest message, kept by chat.inbox.record_messages
+    last_message_id = models.PositiveBigIntegerField(null=True, blank=True)
+    last_message_sender = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    last_message_content = models.CharField(max_length=200, blank=True)
+    last_message_type = models.CharField(max_length=10, blank=True)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    
     class Meta:
         ordering = ['-updated_at']
     
@@ -35,9 +44,8 @@ class ChatRoom(models.Model):
     
     def can_user_access(self, user):
         """Check if user can access this chat room"""
-        if user in self.participants.all():
-            return True
-        return False
+        from .membership import is_participant
+        return is_participant(self.pk, user.pk)
     
     def get_other_participant(self, user):
         """Get the other participant in a 1-on-1 chat"""
@@ -67,22 +75,29 @@ class Message(models.Model):
     
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['room', 'id'], name='chat_message_room_id_idx'),
+        ]
     
     def __str__(self):
         return f"{self.sender.username}: {self.content[:50]}"
 
 
-class MessageReadStatus(models.Model):
-    """Track message read status for each user"""
-    message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='read_status')
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    read_at = models.DateTimeField(auto_now_add=True)
+class ReadWatermark(models.Model):
+    """The last message a participant has read in a room; everything up to it counts as read"""
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='read_watermarks')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_read_watermarks')
+    last_read_message_id = models.PositiveBigIntegerField(default=0)
+    unread_count = models.PositiveIntegerField(default=0)  # messages from others above the watermark
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
-        unique_together = ['message', 'user']
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'user'], name='chat_watermark_room_user_uniq'),
+        ]
     
     def __str__(self):
-        return f"{self.user.username} read {self.message.id}"
+        return f"{self.user.username} read room {self.room_id} up to {self.last_read_message_id}"
 
 
 class FollowRequest(models.Model):
@@ -1,5 +1,7 @@
 from rest_framework import serializers
-from .models import ChatRoom, Message, FollowRequest, MessageReadStatus
+from common.serializers import PrimingListSerializer
+from .history import history_page
+from .models import ChatRoom, Message, FollowRequest, ReadWatermark
 from auth_app.serializers import UserSerializer
 
 
@@ -13,6 +15,19 @@ class MessageSerializer(serializers.ModelSerializer):
             'is_read', 'created_at', 'updated_at'
         ]
         read_only_fields = ['sender', 'created_at', 'updated_at']
+        list_serializer_class = PrimingListSerializer
+
+
+class ChatRoomListSerializer(PrimingListSerializer):
+    """Looks up the presence of every participant and last sender in the list at once"""
+    
+    def prime(self, items):
+        users = [room.last_message_sender for room in items if room.last_message_sender_id]
+        for room in items:
+            if 'participants' in getattr(room, '_prefetched_objects_cache', {}):
+                users.extend(room.participants.all())
+        if users:
+            self.child.fields['participants'].child.prime_instances(users)
 
 
 class ChatRoomSerializer(serializers.ModelSerializer):
@@ -29,37 +44,55 @@ class ChatRoomSerializer(serializers.ModelSerializer):
             'unread_count', 'other_participant', 'other_participant_status',
             'created_at', 'updated_at'
         ]
+        list_serializer_class = ChatRoomListSerializer
     
     def get_last_message(self, obj):
-        last_message = obj.messages.last()
-        if last_message:
-            return MessageSerializer(last_message).data
-        return None
+        # Snapshot kept on the room by chat.inbox.record_messages
+        if obj.last_message_id is None:
+            return None
+        sender = obj.last_message_sender
+        return {
+            'id': obj.last_message_id,
+            'sender': UserSerializer(sender, context=self.context).data if sender else None,
+            'message_type': obj.last_message_type,
+            'content': obj.last_message_content,
+            'created_at': serializers.DateTimeField().to_representation(obj.last_message_at),
+        }
     
     def get_unread_count(self, obj):
         request = self.context.get('request')
         if request and request.user.is_authenticated:
-            return obj.messages.exclude(
-                read_status__user=request.user
-            ).count()
+            if hasattr(obj, 'viewer_unread_count'):
+                return obj.viewer_unread_count or 0
+            return ReadWatermark.objects.filter(room=obj, user=request.user).values_list(
+                'unread_count', flat=True
+            ).first() or 0
         return 0
     
-    def get_other_participant(self, obj):
+    def _other_participant(self, obj):
+        """The other participant of a 1-on-1 chat, from the prefetched participants"""
         request = self.context.get('request')
         if request and request.user.is_authenticated and not obj.is_group:
-            other_user = obj.get_other_participant(request.user)
-            if other_user:
-                return UserSerializer(other_user).data
+            for participant in obj.participants.all():
+                if participant.id != request.user.id:
+                    return participant
         return None
     
+    def _other_participant_data(self, obj):
+        # Serialized once per room for both fields, with the request's presence lookups
+        if getattr(self, '_other_data', (None,))[0] != obj.pk:
+            other_user = self._other_participant(obj)
+            data = UserSerializer(other_user, context=self.context).data if other_user else None
+            self._other_data = (obj.pk, data)
+        return self._other_data[1]
+    
+    def get_other_participant(self, obj):
+        return self._other_participant_data(obj)
+    
     def get_other_participant_status(self, obj):
         """Get the activity status of the other participant"""
-        request = self.context.get('request')
-        if request and request.user.is_authenticated and not obj.is_group:
-            other_user = obj.get_other_participant(request.user)
-            if other_user and hasattr(other_user, 'activity'):
-                return other_user.activity.activity_status
-        return 'offline'
+        data = self._other_participant_data(obj)
+        return data['activity_status'] if data else 'offline'
 
 
 class ChatRoomDetailSerializer(ChatRoomSerializer):
@@ -69,8 +102,8 @@ class ChatRoomDetailSerializer(ChatRoomSerializer):
         fields = ChatRoomSerializer.Meta.fields + ['messages']
     
     def get_messages(self, obj):
-        messages = obj.messages.all()[:50]  # Get last 50 messages
-        return MessageSerializer(messages, many=True).data
+        messages, _ = history_page(obj.pk)  # Get last 50 messages
+        return MessageSerializer(messages, many=True, context=self.context).data
 
 
 class FollowRequestSerializer(serializers.ModelSerializer):
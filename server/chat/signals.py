@@ -0,0 +1,60 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .membership import invalidate
+from .inbox import record_messages
+from .models import ChatRoom, Message, ReadWatermark
+from .watermarks import add_participants, remove_participants
+
+
+def _invalidate_on_commit(room_ids):
+    room_ids = list(room_ids)
+    if room_ids:
+        transaction.on_commit(lambda: invalidate(room_ids))
+
+
+@receiver(m2m_changed, sender=ChatRoom.participants.through)
+def invalidate_room_membership(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Drop cached participant sets of rooms whose members changed
+    """
+    if action == 'pre_clear' and reverse:
+        # clear() does not report which rooms the user left
+        instance._cleared_chat_rooms = list(instance.chat_rooms.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove') and pk_set:
+        _invalidate_on_commit(pk_set if reverse else [instance.pk])
+    elif action == 'post_clear':
+        _invalidate_on_commit(getattr(instance, '_cleared_chat_rooms', []) if reverse else [instance.pk])
+
+
+@receiver(m2m_changed, sender=ChatRoom.participants.through)
+def update_read_watermarks(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Give new participants a watermark and drop those of participants who left
+    """
+    if action in ('post_add', 'post_remove') and pk_set:
+        if reverse:
+            pairs = [(room_id, instance.pk) for room_id in pk_set]
+        else:
+            pairs = [(instance.pk, user_id) for user_id in pk_set]
+        if action == 'post_add':
+            add_participants(pairs)
+        else:
+            remove_participants(pairs)
+    elif action == 'post_clear':
+        lookup = {'user_id': instance.pk} if reverse else {'room_id': instance.pk}
+        ReadWatermark.objects.filter(**lookup).delete()
+
+
+@receiver(post_delete, sender=ChatRoom)
+def invalidate_deleted_room_membership(sender, instance, **kwargs):
+    # Deleting a room removes its participant rows without m2m_changed
+    _invalidate_on_commit([instance.pk])
+
+
+@receiver(post_save, sender=Message)
+def update_room_inbox_state(sender, instance, created, **kwargs):
+    # Batches stored by chat.writer call record_messages() themselves
+    if created:
+        record_messages([instance])
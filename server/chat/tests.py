@@ -0,0 +1,700 @@
+import asyncio
+import json
+from unittest.mock import Mock, patch
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+
+from community.models import UserFollow
+from community.presence import LocalPresenceStore, presence
+from notifications.models import Notification
+
+from . import consumers, membership, views
+from .coalescing import RoomEventCoalescer
+from .inbox import record_messages
+from .membership import is_participant
+from .watermarks import unread_count
+from .models import ChatRoom, Message, ReadWatermark
+from .routing import websocket_urlpatterns
+from .writer import COMMIT, DEFERRED, MessageWriter, PendingMessage
+
+User = get_user_model()
+
+
+class ChatClientMixin:
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com', password='pass12345')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com', password='pass12345')
+        self.room = ChatRoom.objects.create()
+        self.room.participants.set([self.alice, self.bob])
+        self.original_writer = consumers.message_writer
+        self.addCleanup(setattr, consumers, 'message_writer', self.original_writer)
+        self.original_room_events = consumers.room_events
+        consumers.room_events = RoomEventCoalescer(debounce=0, batch_window=0)
+        self.addCleanup(setattr, consumers, 'room_events', self.original_room_events)
+        self.original_presence_store = presence._store
+        presence._store = LocalPresenceStore()
+        self.addCleanup(setattr, presence, '_store', self.original_presence_store)
+
+    async def connect(self, user, room=None):
+        room = room or self.room
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{room.pk}/')
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def receive(self, communicator, frame_type):
+        """The next frame of the given type, skipping join and leave notices"""
+        while True:
+            frame = json.loads(await communicator.receive_from())
+            if frame['type'] == frame_type:
+                return frame
+
+
+class MessageWriterTests(ChatClientMixin, TransactionTestCase):
+    def test_deferred_broadcasts_before_storing(self):
+        writer = consumers.message_writer = MessageWriter(durability=DEFERRED, batch_delay=60)
+
+        async def exchange():
+            alice = await self.connect(self.alice)
+            bob = await self.connect(self.bob)
+            await alice.send_to(text_data=json.dumps({'type': 'message', 'message': 'Hello'}))
+            received = (await self.receive(bob, 'message'))['message']
+            stored_before_flush = await Message.objects.acount()
+            await writer.flush()
+            saved = await self.receive(bob, 'message_saved')
+            await alice.disconnect()
+            await bob.disconnect()
+            return received, stored_before_flush, saved
+
+        received, stored_before_flush, saved = async_to_sync(exchange)()
+
+        self.assertIsNone(received['id'])
+        self.assertEqual(received['content'], 'Hello')
+        self.assertEqual(received['sender']['username'], 'alice')
+        self.assertEqual(stored_before_flush, 0)
+
+        message = Message.objects.get()
+        self.assertEqual(saved['messages'], [{
+            'provisional_id': received['provisional_id'],
+            'id': message.id,
+            'created_at': message.created_at.isoformat(),
+        }])
+        self.assertEqual((message.room, message.sender, message.content), (self.room, self.alice, 'Hello'))
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.updated_at, message.created_at)
+
+    def test_commit_broadcasts_stored_id(self):
+        consumers.message_writer = MessageWriter(durability=COMMIT)
+
+        async def exchange():
+            alice = await self.connect(self.alice)
+            bob = await self.connect(self.bob)
+            await alice.send_to(text_data=json.dumps({'type': 'message', 'message': 'Hello'}))
+            received = (await self.receive(bob, 'message'))['message']
+            await alice.disconnect()
+            await bob.disconnect()
+            return received
+
+        received = async_to_sync(exchange)()
+        self.assertEqual(received['id'], Message.objects.get().id)
+
+    def test_messages_for_deleted_rooms_are_reported_failed(self):
+        writer = consumers.message_writer = MessageWriter(durability=DEFERRED, batch_delay=60)
+
+        async def exchange():
+            alice = await self.connect(self.alice)
+            await alice.send_to(text_data=json.dumps({'type': 'message', 'message': 'Hello'}))
+            sent = (await self.receive(alice, 'message'))['message']
+            await ChatRoom.objects.filter(pk=self.room.pk).adelete()
+            await writer.flush()
+            failed = await self.receive(alice, 'message_failed')
+            await alice.disconnect()
+            return sent, failed
+
+        sent, failed = async_to_sync(exchange)()
+        self.assertEqual(failed['provisional_ids'], [sent['provisional_id']])
+        self.assertFalse(Message.objects.exists())
+
+    def test_outsiders_cannot_connect_and_read_frames_use_the_connection_check(self):
+        carol = User.objects.create_user(username='carol', email='carol@example.com', password='pass12345')
+        message = Message.objects.create(room=self.room, sender=self.alice, content='Hello')
+
+        async def exchange():
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{self.room.pk}/')
+            communicator.scope['user'] = carol
+            connected, _ = await communicator.connect()
+            bob = await self.connect(self.bob)
+            await bob.send_to(text_data=json.dumps({'type': 'read_message', 'message_id': message.pk}))
+            await bob.disconnect()
+            return connected
+
+        with patch.object(membership, 'participant_ids', wraps=membership.participant_ids) as lookup:
+            self.assertFalse(async_to_sync(exchange)())
+        # One membership check per connection attempt, none for the read frame
+        self.assertEqual(lookup.call_count, 2)
+        self.assertEqual(ReadWatermark.objects.get(room=self.room, user=self.bob).last_read_message_id, message.pk)
+
+    def test_sync_frame_returns_missed_messages(self):
+        messages = Message.objects.bulk_create([
+            Message(room=self.room, sender=self.alice, content=f'Message {i}') for i in range(5)
+        ])
+
+        async def exchange():
+            bob = await self.connect(self.bob)
+            await bob.send_to(text_data=json.dumps({'type': 'sync', 'after': messages[1].pk, 'limit': 2}))
+            first = await self.receive(bob, 'sync')
+            await bob.send_to(text_data=json.dumps({'type': 'sync', 'after': first['nextCursor']}))
+            second = await self.receive(bob, 'sync')
+            await bob.send_to(text_data=json.dumps({'type': 'sync', 'after': 'latest'}))
+            error = await self.receive(bob, 'error')
+            await bob.disconnect()
+            return first, second, error
+
+        first, second, error = async_to_sync(exchange)()
+        self.assertEqual([m['content'] for m in first['messages']], ['Message 2', 'Message 3'])
+        self.assertTrue(first['isNext'])
+        self.assertEqual([m['content'] for m in second['messages']], ['Message 4'])
+        self.assertFalse(second['isNext'])
+        self.assertIsNone(second['nextCursor'])
+        self.assertEqual(error['error'], 'after must be a message ID')
+
+
+class PresenceFrameTests(ChatClientMixin, TransactionTestCase):
+    def test_followers_see_connections_come_and_go(self):
+        UserFollow.objects.create(follower=self.bob, following=self.alice)
+
+        async def exchange():
+            bob = await self.connect(self.bob)
+            alice = await self.connect(self.alice)
+            # The join and presence frames may arrive in either order
+            frames = {}
+            while len(frames) < 2:
+                frame = json.loads(await bob.receive_from())
+                frames[frame['type']] = frame
+            online = frames['presence']
+            await alice.send_to(text_data=json.dumps({'type': 'typing', 'is_typing': True}))
+            changes = [frames['events'], await self.receive(bob, 'events')]
+            await alice.send_to(text_data=json.dumps({'type': 'heartbeat'}))
+            await alice.disconnect()
+            offline = await self.receive(bob, 'presence')
+            await bob.disconnect()
+            return online, changes, offline
+
+        online, changes, offline = async_to_sync(exchange)()
+        self.assertEqual(
+            [(change['type'], change['user_id']) for frame in changes for change in frame['events']],
+            [('user_joined', self.alice.id), ('typing', self.alice.id)],
+        )
+        self.assertEqual(changes[0]['room_id'], self.room.pk)
+        self.assertEqual(online['changes'], [{'user_id': self.alice.id, 'status': 'online'}])
+        self.assertEqual(offline['changes'], [{'user_id': self.alice.id, 'status': 'offline'}])
+        self.assertFalse(presence.is_online(self.alice.id))
+
+
+class UserChatConsumerTests(ChatClientMixin, TransactionTestCase):
+    async def connect_user(self, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/chat/')
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def send(self, communicator, **frame):
+        await communicator.send_to(text_data=json.dumps(frame))
+
+    def test_one_connection_carries_every_subscribed_room(self):
+        carol = User.objects.create_user(username='carol', email='carol@example.com', password='pass12345')
+        second = ChatRoom.objects.create()
+        second.participants.set([self.alice, carol])
+        foreign = ChatRoom.objects.create()
+        foreign.participants.set([self.bob, carol])
+        consumers.message_writer = MessageWriter(durability=DEFERRED, batch_delay=60)
+
+        async def exchange():
+            alice = await self.connect_user(self.alice)
+            await self.send(alice, type='subscribe', room_ids=[self.room.pk, second.pk, foreign.pk])
+            subscribed = await self.receive(alice, 'subscribed')
+
+            bob = await self.connect(self.bob)
+            carol_socket = await self.connect(carol, second)
+            await self.send(bob, type='message', message='From bob')
+            await self.send(carol_socket, type='message', message='From carol')
+            received = [await self.receive(alice, 'message'), await self.receive(alice, 'message')]
+            await self.receive(carol_socket, 'message')
+
+            await self.send(alice, type='message', room_id=second.pk, message='To carol')
+            sent = await self.receive(carol_socket, 'message')
+            await self.send(alice, type='typing', room_id=foreign.pk, is_typing=True)
+            error = await self.receive(alice, 'error')
+
+            await self.send(alice, type='unsubscribe', room_ids=[self.room.pk])
+            unsubscribed = await self.receive(alice, 'unsubscribed')
+            await self.send(bob, type='message', message='Unheard')
+            await self.receive(bob, 'message')
+            quiet = await alice.receive_nothing()
+
+            for communicator in (alice, bob, carol_socket):
+                await communicator.disconnect()
+            return subscribed, received, sent, error, unsubscribed, quiet
+
+        subscribed, received, sent, error, unsubscribed, quiet = async_to_sync(exchange)()
+        self.assertEqual(subscribed['room_ids'], sorted([self.room.pk, second.pk]))
+        self.assertEqual(subscribed['denied'], [foreign.pk])
+        self.assertEqual(
+            sorted((frame['room_id'], frame['message']['content']) for frame in received),
+            sorted([(self.room.pk, 'From bob'), (second.pk, 'From carol')]),
+        )
+        self.assertEqual((sent['room_id'], sent['message']['content']), (second.pk, 'To carol'))
+        self.assertEqual(error['error'], 'Not subscribed to this room')
+        self.assertEqual(unsubscribed['room_ids'], [self.room.pk])
+        self.assertTrue(quiet)
+
+    def test_subscriptions_are_checked_together(self):
+        rooms = [ChatRoom.objects.create() for _ in range(10)]
+        for room in rooms:
+            room.participants.set([self.alice])
+        membership.participant_ids(rooms[0].pk)
+
+        with self.assertNumQueries(1):
+            allowed = membership.accessible_rooms([room.pk for room in rooms], self.alice.id)
+        self.assertEqual(allowed, {room.pk for room in rooms})
+        self.assertEqual(membership.accessible_rooms([rooms[0].pk], self.bob.id), set())
+
+    def test_notifications_are_pushed_to_the_connection(self):
+        async def exchange():
+            alice = await self.connect_user(self.alice)
+            await Notification.objects.acreate(
+                recipient=self.alice, sender=self.bob, notification_type='user_followed',
+                title='New follower', message='bob followed you'
+            )
+            frame = await self.receive(alice, 'notification')
+            await alice.disconnect()
+            return frame
+
+        frame = async_to_sync(exchange)()
+        self.assertEqual(frame['notification']['title'], 'New follower')
+        self.assertEqual(frame['notification']['sender']['username'], 'bob')
+
+
+class RoomEventCoalescerTests(TestCase):
+    async def listen(self, room_id):
+        channel_layer = get_channel_layer()
+        channel = await channel_layer.new_channel()
+        await channel_layer.group_add(f'chat_{room_id}', channel)
+        return channel_layer, channel
+
+    def test_typing_broadcasts_only_state_changes_per_interval(self):
+        events = RoomEventCoalescer(typing_interval=60, batch_window=60)
+
+        async def exchange():
+            channel_layer, channel = await self.listen(1)
+            await events.typing(1, 10, 'alice', True)
+            await events.typing(1, 10, 'alice', True)
+            # Stopping within the interval waits, and typing again cancels it
+            await events.typing(1, 10, 'alice', False)
+            await events.typing(1, 10, 'alice', True)
+            await events.flush()
+            return await channel_layer.receive(channel)
+
+        sent = async_to_sync(exchange)()
+        self.assertEqual(sent['events'], [{'type': 'typing', 'user': 'alice', 'user_id': 10, 'is_typing': True}])
+        self.assertEqual(events.counters['typing_received'], 4)
+        self.assertEqual(events.counters['typing_broadcast'], 1)
+        self.assertEqual(events.stats()['suppressed'], 3)
+
+    def test_changes_after_the_interval_share_one_event(self):
+        events = RoomEventCoalescer(typing_interval=0.05, batch_window=60)
+
+        async def exchange():
+            channel_layer, channel = await self.listen(1)
+            await events.typing(1, 10, 'alice', True)
+            await events.typing(1, 20, 'bob', True)
+            await events.typing(1, 10, 'alice', False)
+            await asyncio.sleep(0.1)
+            await events.flush(1)
+            return await channel_layer.receive(channel)
+
+        sent = async_to_sync(exchange)()
+        self.assertEqual(
+            [(event['user_id'], event['is_typing']) for event in sent['events']],
+            [(10, True), (20, True), (10, False)],
+        )
+        self.assertEqual(events.counters['frames_sent'], 1)
+
+    def test_reconnects_and_extra_connections_are_not_announced(self):
+        events = RoomEventCoalescer(debounce=60, batch_window=60)
+
+        async def exchange():
+            channel_layer, channel = await self.listen(1)
+            await events.joined(1, 10, 'alice')
+            await events.joined(1, 10, 'alice')
+            await events.left(1, 10, 'alice')
+            await events.left(1, 10, 'alice')
+            await events.joined(1, 10, 'alice')
+            await events.flush()
+            return await channel_layer.receive(channel)
+
+        sent = async_to_sync(exchange)()
+        self.assertEqual(sent['events'], [{'type': 'user_joined', 'user': 'alice', 'user_id': 10}])
+        self.assertEqual(events.counters['joins_suppressed'], 2)
+        self.assertEqual(events.counters['leaves_suppressed'], 2)
+
+    def test_full_batches_are_sent_at_once(self):
+        events = RoomEventCoalescer(debounce=0, batch_window=60, batch_size=2)
+
+        async def exchange():
+            channel_layer, channel = await self.listen(1)
+            await events.joined(1, 10, 'alice')
+            await events.left(1, 10, 'alice')
+            await asyncio.sleep(0.01)
+            return await channel_layer.receive(channel)
+
+        sent = async_to_sync(exchange)()
+        self.assertEqual([event['type'] for event in sent['events']], ['user_joined', 'user_left'])
+
+    def test_stats_are_for_staff(self):
+        events = RoomEventCoalescer()
+        events.counters.update(typing_received=5, typing_broadcast=2, typing_suppressed=3)
+        staff = User.objects.create_user(
+            username='staff', email='staff@example.com', password='pass12345', is_staff=True
+        )
+        member = User.objects.create_user(username='member', email='member@example.com', password='pass12345')
+
+        client = APIClient()
+        with patch.object(views, 'room_events', events):
+            client.force_authenticate(member)
+            self.assertEqual(client.get('/api/chat/events/stats/').status_code, status.HTTP_403_FORBIDDEN)
+            client.force_authenticate(staff)
+            response = client.get('/api/chat/events/stats/')
+        self.assertEqual(response.data['typing_suppressed'], 3)
+        self.assertEqual(response.data['suppressed'], 3)
+
+
+class MessageBatchTests(TestCase):
+    def test_batch_is_one_insert_and_two_updates_per_room(self):
+        alice = User.objects.create_user(username='alice', email='alice@example.com', password='pass12345')
+        bob = User.objects.create_user(username='bob', email='bob@example.com', password='pass12345')
+        rooms = [ChatRoom.objects.create() for _ in range(2)]
+        for room in rooms:
+            room.participants.set([alice, bob])
+        batch = [
+            PendingMessage(f'p-{i}', rooms[i % 2].pk, (alice, bob)[i % 3 == 0].pk, f'Message {i}', 'text', None)
+            for i in range(10)
+        ]
+        # Savepoint, room check, INSERT, snapshot and counter UPDATEs per room, release
+        with self.assertNumQueries(8):
+            stored = MessageWriter().store(batch)
+
+        self.assertEqual(len(stored), 10)
+        self.assertEqual(Message.objects.count(), 10)
+        for room in rooms:
+            room.refresh_from_db()
+            latest = room.messages.latest('id')
+            self.assertEqual(room.updated_at, latest.created_at)
+            self.assertEqual((room.last_message_id, room.last_message_content), (latest.id, latest.content))
+            for user in (alice, bob):
+                watermark = ReadWatermark.objects.get(room=room, user=user)
+                self.assertEqual(watermark.unread_count, unread_count(room.pk, user.pk))
+
+    def test_stored_ids_are_real_without_bulk_insert_ids(self):
+        alice = User.objects.create_user(username='alice', email='alice@example.com', password='pass12345')
+        bob = User.objects.create_user(username='bob', email='bob@example.com', password='pass12345')
+        room = ChatRoom.objects.create()
+        room.participants.set([alice, bob])
+        small = [PendingMessage(f'p-{i}', room.pk, alice.pk, f'Message {i}', 'text', None) for i in range(3)]
+        large = [PendingMessage(f'q-{i}', room.pk, bob.pk, 'Same text', 'text', None) for i in range(10)]
+        # As on MySQL
+        with patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            with CaptureQueriesContext(connection) as small_queries:
+                stored = MessageWriter().store(small)
+            with CaptureQueriesContext(connection) as large_queries:
+                stored.update(MessageWriter().store(large))
+
+        # Batches are inserted and read back whole, not row by row
+        self.assertEqual(len(small_queries), len(large_queries))
+        for i in range(3):
+            self.assertEqual(Message.objects.get(pk=stored[f'p-{i}'][0]).content, f'Message {i}')
+        self.assertEqual(
+            sorted(stored[f'q-{i}'][0] for i in range(10)),
+            list(Message.objects.filter(sender=bob).order_by('id').values_list('id', flat=True))
+        )
+        room.refresh_from_db()
+        self.assertEqual(room.last_message_id, stored['q-9'][0])
+        self.assertEqual(ReadWatermark.objects.get(room=room, user=bob).unread_count, 3)
+        self.assertEqual(ReadWatermark.objects.get(room=room, user=alice).unread_count, 10)
+
+    def test_recording_messages_without_ids_uses_stored_ones(self):
+        alice = User.objects.create_user(username='alice', email='alice@example.com', password='pass12345')
+        bob = User.objects.create_user(username='bob', email='bob@example.com', password='pass12345')
+        room = ChatRoom.objects.create()
+        room.participants.set([alice, bob])
+        with patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            rows = Message.objects.bulk_create([Message(room=room, sender=alice, content=f'Message {i}') for i in range(2)])
+            record_messages(rows)
+
+        room.refresh_from_db()
+        latest = room.messages.latest('id')
+        self.assertEqual((room.last_message_id, room.last_message_content), (latest.id, latest.content))
+        self.assertEqual(ReadWatermark.objects.get(room=room, user=bob).unread_count, 2)
+
+
+class RoomMembershipTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com', password='pass12345')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com', password='pass12345')
+        self.carol = User.objects.create_user(username='carol', email='carol@example.com', password='pass12345')
+        self.room = ChatRoom.objects.create(is_group=True)
+        self.room.participants.set([self.alice, self.bob])
+
+    def test_membership_is_loaded_once(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(is_participant(self.room.pk, self.alice.pk))
+        with self.assertNumQueries(0):
+            self.assertTrue(self.room.can_user_access(self.bob))
+            self.assertFalse(is_participant(self.room.pk, self.carol.pk))
+
+    def test_participant_changes_invalidate_on_commit(self):
+        self.assertFalse(is_participant(self.room.pk, self.carol.pk))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.room.participants.add(self.carol)
+        self.assertTrue(is_participant(self.room.pk, self.carol.pk))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice.chat_rooms.remove(self.room)
+        self.assertFalse(is_participant(self.room.pk, self.alice.pk))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bob.chat_rooms.clear()
+        self.assertFalse(is_participant(self.room.pk, self.bob.pk))
+
+        room_id = self.room.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            self.room.delete()
+        self.assertFalse(is_participant(room_id, self.carol.pk))
+
+    def test_fill_racing_a_change_is_not_served(self):
+        load = membership.ChatRoom.objects.filter
+
+        def load_then_commit(*args, **kwargs):
+            rows = list(load(*args, **kwargs).values_list('participants', flat=True))
+            # Carol joins, and the change commits, after the participants were loaded
+            self.room.participants.add(self.carol)
+            membership.invalidate([self.room.pk])
+            return Mock(values_list=Mock(return_value=rows))
+
+        with patch.object(membership.ChatRoom.objects, 'filter', side_effect=load_then_commit):
+            self.assertFalse(is_participant(self.room.pk, self.carol.pk))
+        self.assertTrue(is_participant(self.room.pk, self.carol.pk))
+        self.assertEqual(membership.accessible_rooms([self.room.pk], self.carol.pk), {self.room.pk})
+
+    def test_invalidation_survives_cache_errors(self):
+        with patch.object(membership.cache, 'set_many', side_effect=ConnectionError):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.room.participants.add(self.carol)
+        self.assertTrue(ChatRoom.objects.filter(pk=self.room.pk, participants=self.carol).exists())
+
+    def test_large_rooms_fall_back_to_exists(self):
+        with patch.object(membership, 'MAX_CACHED_PARTICIPANTS', 1):
+            self.assertTrue(is_participant(self.room.pk, self.alice.pk))
+            with self.assertNumQueries(1):
+                self.assertFalse(is_participant(self.room.pk, self.carol.pk))
+
+    def test_mark_message_read(self):
+        message = Message.objects.create(room=self.room, sender=self.alice, content='Hello')
+        url = f'/api/chat/messages/{message.pk}/read/'
+
+        self.client.force_authenticate(self.carol)
+        self.assertEqual(self.client.post(url).status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(self.bob)
+        self.assertEqual(self.client.post(url).status_code, status.HTTP_200_OK)
+        self.assertEqual(ReadWatermark.objects.get(room=self.room, user=self.bob).last_read_message_id, message.pk)
+
+
+class ChatHistoryTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com', password='pass12345')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com', password='pass12345')
+        self.room = ChatRoom.objects.create()
+        self.room.participants.set([self.alice, self.bob])
+        self.messages = Message.objects.bulk_create([
+            Message(room=self.room, sender=self.alice, content=f'Message {i}') for i in range(120)
+        ])
+        self.url = f'/api/chat/rooms/{self.room.pk}/messages/'
+        self.client.force_authenticate(self.bob)
+
+    def contents(self, response):
+        return [message['content'] for message in response.data['results']]
+
+    def test_pages_back_from_the_newest_messages(self):
+        with self.assertNumQueries(2):  # membership, one page with senders
+            response = self.client.get(self.url)
+        self.assertEqual(self.contents(response), [f'Message {i}' for i in range(70, 120)])
+        self.assertTrue(response.data['isNext'])
+        self.assertEqual(response.data['nextCursor'], self.messages[70].pk)
+
+        response = self.client.get(self.url, {'before': response.data['nextCursor'], 'limit': 60})
+        self.assertEqual(self.contents(response), [f'Message {i}' for i in range(10, 70)])
+
+        response = self.client.get(self.url, {'before': response.data['nextCursor']})
+        self.assertEqual(self.contents(response), [f'Message {i}' for i in range(10)])
+        self.assertFalse(response.data['isNext'])
+        self.assertIsNone(response.data['nextCursor'])
+
+    def test_after_returns_missed_messages_oldest_first(self):
+        response = self.client.get(self.url, {'after': self.messages[99].pk, 'limit': 15})
+        self.assertEqual(self.contents(response), [f'Message {i}' for i in range(100, 115)])
+        self.assertEqual(response.data['nextCursor'], self.messages[114].pk)
+
+        response = self.client.get(self.url, {'after': response.data['nextCursor'], 'limit': 15})
+        self.assertEqual(self.contents(response), [f'Message {i}' for i in range(115, 120)])
+        self.assertFalse(response.data['isNext'])
+
+    def test_invalid_parameters_and_outsiders(self):
+        self.assertEqual(self.client.get(self.url, {'before': 'x'}).status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.url, {'before': 5, 'after': 1})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        carol = User.objects.create_user(username='carol', email='carol@example.com', password='pass12345')
+        self.client.force_authenticate(carol)
+        self.assertEqual(self.client.get(self.url).data['results'], [])
+
+    def test_room_detail_includes_the_newest_messages(self):
+        response = self.client.get(f'/api/chat/rooms/{self.room.pk}/')
+        contents = [message['content'] for message in response.data['messages']]
+        self.assertEqual(contents, [f'Message {i}' for i in range(70, 120)])
+
+
+class ReadWatermarkTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com', password='pass12345')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com', password='pass12345')
+        self.room = ChatRoom.objects.create()
+        self.room.participants.set([self.alice, self.bob])
+        self.messages = Message.objects.bulk_create([
+            Message(room=self.room, sender=self.alice if i % 2 else self.bob, content=f'Message {i}')
+            for i in range(10)
+        ])
+        self.client.force_authenticate(self.bob)
+
+    def watermark(self, user):
+        return ReadWatermark.objects.get(room=self.room, user=user).last_read_message_id
+
+    def test_participants_get_watermarks_from_their_join(self):
+        self.assertEqual(self.watermark(self.bob), 0)
+        carol = User.objects.create_user(username='carol', email='carol@example.com', password='pass12345')
+        self.room.participants.add(carol)
+        self.assertEqual(self.watermark(carol), self.messages[-1].pk)
+        self.assertEqual(unread_count(self.room.pk, carol.pk), 0)
+
+        carol.chat_rooms.remove(self.room)
+        self.assertFalse(ReadWatermark.objects.filter(user=carol).exists())
+        self.room.participants.clear()
+        self.assertFalse(ReadWatermark.objects.exists())
+
+    def test_mark_room_read_is_one_conditional_update(self):
+        # Alice sent the five odd-numbered messages
+        self.assertEqual(unread_count(self.room.pk, self.bob.pk), 5)
+        with self.assertNumQueries(3):  # membership, latest message, UPDATE
+            response = self.client.post(f'/api/chat/rooms/{self.room.pk}/mark_read/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.watermark(self.bob), self.messages[-1].pk)
+        self.assertEqual(unread_count(self.room.pk, self.bob.pk), 0)
+
+        Message.objects.create(room=self.room, sender=self.alice, content='New')
+        self.assertEqual(unread_count(self.room.pk, self.bob.pk), 1)
+
+    def test_reading_an_older_message_never_moves_the_watermark_back(self):
+        self.client.post(f'/api/chat/messages/{self.messages[7].pk}/read/')
+        self.assertEqual(self.watermark(self.bob), self.messages[7].pk)
+        self.assertEqual(unread_count(self.room.pk, self.bob.pk), 1)
+
+        self.client.post(f'/api/chat/messages/{self.messages[3].pk}/read/')
+        self.assertEqual(self.watermark(self.bob), self.messages[7].pk)
+
+    def test_missing_watermarks_are_created_on_read(self):
+        ReadWatermark.objects.all().delete()
+        self.client.post(f'/api/chat/messages/{self.messages[5].pk}/read/')
+        self.assertEqual(self.watermark(self.bob), self.messages[5].pk)
+
+    def test_unread_counter_follows_new_messages_and_reads(self):
+        watermark = ReadWatermark.objects.get(room=self.room, user=self.bob)
+        self.assertEqual(watermark.unread_count, 0)  # bulk_create bypasses the counters
+
+        self.client.post(f'/api/chat/messages/{self.messages[3].pk}/read/')
+        watermark.refresh_from_db()
+        self.assertEqual(watermark.unread_count, 3)
+
+        Message.objects.create(room=self.room, sender=self.alice, content='New')
+        Message.objects.create(room=self.room, sender=self.bob, content='Reply')
+        watermark.refresh_from_db()
+        self.assertEqual(watermark.unread_count, 4)
+        self.assertEqual(ReadWatermark.objects.get(room=self.room, user=self.alice).unread_count, 1)
+
+
+class InboxTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.original_presence_store = presence._store
+        presence._store = LocalPresenceStore()
+        self.addCleanup(setattr, presence, '_store', self.original_presence_store)
+        self.user = User.objects.create_user(username='reader', email='reader@example.com', password='pass12345')
+        self.client.force_authenticate(self.user)
+
+    def create_rooms(self, count):
+        start = ChatRoom.objects.count()
+        for i in range(start, start + count):
+            friend = User.objects.create_user(
+                username=f'friend{i}', email=f'friend{i}@example.com', password='pass12345'
+            )
+            room = ChatRoom.objects.create()
+            room.participants.set([self.user, friend])
+            Message.objects.create(room=room, sender=friend, content=f'Hi {i}')
+            Message.objects.create(room=room, sender=friend, content=f'Still there {i}?')
+
+    def test_room_list_has_a_fixed_query_budget(self):
+        self.create_rooms(5)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get('/api/chat/rooms/')
+        self.create_rooms(45)
+        # Rooms with snapshot senders and counters, participants with activity
+        presence.store.touch(User.objects.get(username='friend49').id, 'friend49-1', ttl=60)
+        with self.assertNumQueries(2), patch.object(presence.store, 'online', wraps=presence.store.online) as online:
+            response = self.client.get('/api/chat/rooms/')
+        self.assertEqual(len(few.captured_queries), 2)
+        # Participants and last senders of every room in one presence lookup
+        self.assertEqual(online.call_count, 1)
+
+        self.assertEqual(len(response.data), 50)
+        room = response.data[0]
+        self.assertEqual(room['last_message']['content'], 'Still there 49?')
+        self.assertEqual(room['last_message']['sender']['username'], 'friend49')
+        self.assertEqual(room['unread_count'], 2)
+        self.assertEqual(room['other_participant']['username'], 'friend49')
+        # The same status as the participant list, from the presence store
+        self.assertEqual(room['other_participant_status'], 'online')
+        participant = next(user for user in room['participants'] if user['username'] == 'friend49')
+        self.assertEqual(participant['activity_status'], 'online')
+
+    def test_reading_a_room_clears_its_counter(self):
+        self.create_rooms(1)
+        room_id = ChatRoom.objects.get().pk
+        self.client.post(f'/api/chat/rooms/{room_id}/mark_read/')
+        response = self.client.get('/api/chat/rooms/')
+        self.assertEqual(response.data[0]['unread_count'], 0)
+        self.assertEqual(response.data[0]['last_message']['content'], 'Still there 0?')
@@ -17,4 +17,7 @@ urlpatterns = [
     
     # Messages
     path('messages/<int:message_id>/read/', views.MarkMessageReadView.as_view(), name='mark-message-read'),
+    
+    # Coalesced room events
+    path('events/stats/', views.ChatEventStatsView.as_view(), name='chat-event-stats'),
 ]
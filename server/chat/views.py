@@ -4,7 +4,12 @@ from rest_framework.views import APIView
 from rest_framework.exceptions import ValidationError
 from django.contrib.auth import get_user_model
 from django.db.models import Q
-from .models import ChatRoom, Message, FollowRequest, MessageReadStatus
+from .coalescing import room_events
+from .history import history_page, history_params, next_cursor
+from .inbox import inbox
+from .membership import is_participant
+from .watermarks import advance, mark_room_read
+from .models import ChatRoom, Message, FollowRequest
 from .serializers import (
     ChatRoomSerializer, ChatRoomDetailSerializer, MessageSerializer,
     FollowRequestSerializer
@@ -20,9 +25,7 @@ class ChatRoomListView(generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
-        return ChatRoom.objects.filter(
-            participants=self.request.user
-        ).order_by('-updated_at')
+        return inbox(self.request.user).order_by('-updated_at')
 
 
 class ChatRoomDetailView(generics.RetrieveAPIView):
@@ -33,7 +36,7 @@ class ChatRoomDetailView(generics.RetrieveAPIView):
     lookup_url_kwarg = 'room_id'
     
     def get_queryset(self):
-        return ChatRoom.objects.filter(participants=self.request.user)
+        return inbox(self.request.user)
 
 
 class CreateChatRoomView(APIView):
@@ -118,13 +121,23 @@ class MessageListCreateView(generics.ListCreateAPIView):
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated]
     
-    def get_queryset(self):
-        room_id = self.kwargs['room_id']
+    def list(self, request, room_id):
+        """One page of history: the newest messages, ?before=<id> or ?after=<id>"""
         try:
-            room = ChatRoom.objects.get(id=room_id, participants=self.request.user)
-            return room.messages.all().order_by('created_at')
-        except ChatRoom.DoesNotExist:
-            return Message.objects.none()
+            before, after, limit = history_params(request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if not is_participant(room_id, request.user.id):
+            return Response({'results': [], 'isNext': False, 'nextCursor': None})
+        
+        page, has_more = history_page(room_id, before, after, limit)
+        serializer = self.get_serializer(page, many=True)
+        return Response({
+            'results': serializer.data,
+            'isNext': has_more,
+            'nextCursor': next_cursor(page, has_more, after),
+        })
     
     def perform_create(self, serializer):
         room_id = self.kwargs['room_id']
@@ -264,24 +277,14 @@ class MarkChatRoomReadView(APIView):
     permission_classes = [permissions.IsAuthenticated]
     
     def post(self, request, room_id):
-        try:
-            chat_room = ChatRoom.objects.get(
-                id=room_id,
-                participants=request.user
-            )
-        except ChatRoom.DoesNotExist:
+        if not is_participant(room_id, request.user.id):
             return Response(
                 {'error': 'Chat room not found'},
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        # Mark all unread messages as read
-        unread_messages = chat_room.messages.exclude(sender=request.user)
-        for message in unread_messages:
-            MessageReadStatus.objects.get_or_create(
-                message=message,
-                user=request.user
-            )
+        # Move the read watermark to the latest message
+        mark_room_read(room_id, request.user.id)
         
         return Response({'message': 'Messages marked as read'})
 
@@ -292,19 +295,16 @@ class MarkMessageReadView(APIView):
     
     def post(self, request, message_id):
         try:
-            message = Message.objects.get(id=message_id)
+            message = Message.objects.only('id', 'room_id').get(id=message_id)
             # Check if user has access to this message
-            if not message.room.can_user_access(request.user):
+            if not is_participant(message.room_id, request.user.id):
                 return Response(
                     {'error': 'Access denied'},
                     status=status.HTTP_403_FORBIDDEN
                 )
             
-            # Mark as read
-            MessageReadStatus.objects.get_or_create(
-                message=message,
-                user=request.user
-            )
+            # Mark as read, along with everything before it
+            advance(message.room_id, request.user.id, message.id)
             
             return Response({'message': 'Message marked as read'})
             
@@ -313,3 +313,11 @@ class MarkMessageReadView(APIView):
                 {'error': 'Message not found'},
                 status=status.HTTP_404_NOT_FOUND
             )
+
+
+class ChatEventStatsView(APIView):
+    """Typing and join/leave events received, broadcast and suppressed by this process"""
+    permission_classes = [permissions.IsAdminUser]
+    
+    def get(self, request):
+        return Response(room_events.stats())
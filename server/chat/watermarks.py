@@ -0,0 +1,93 @@
+"""
+Read watermarks for chat rooms.
+
+Instead of one row per (message, reader), each participant has a single
+ReadWatermark per room holding the ID of the last message they have read.
+Reading a message moves the watermark forward with one conditional UPDATE,
+which never moves it back, and a room's unread count is the number of
+messages from others above the watermark: a range count over the
+(room, id) index. That count is stored on the watermark when it moves and
+kept current by chat.inbox.record_messages as messages arrive.
+
+Watermark rows are created when participants join a room, starting at the
+room's latest message so joining a group does not mark its history unread.
+"""
+from django.db.models import Count, Max, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Message, ReadWatermark
+
+
+def latest_message_id(room_id):
+    return Message.objects.filter(room_id=room_id).aggregate(latest=Max('id'))['latest'] or 0
+
+
+def _unread_above(room_id, user_id, message_id):
+    """The unread count a watermark at message_id should carry"""
+    return Coalesce(Subquery(
+        Message.objects.filter(room_id=room_id, id__gt=message_id)
+        .exclude(sender_id=user_id)
+        .order_by()
+        .values('room_id')
+        .annotate(total=Count('id'))
+        .values('total')
+    ), 0)
+
+
+def advance(room_id, user_id, message_id):
+    """Move the user's watermark up to message_id; returns False if it was already there"""
+    updated = ReadWatermark.objects.filter(
+        room_id=room_id, user_id=user_id, last_read_message_id__lt=message_id
+    ).update(
+        last_read_message_id=message_id,
+        unread_count=_unread_above(room_id, user_id, message_id),
+        updated_at=timezone.now(),
+    )
+    if updated:
+        return True
+    # Rooms joined before watermarks existed may lack a row
+    watermark, _ = ReadWatermark.objects.get_or_create(room_id=room_id, user_id=user_id)
+    if watermark.last_read_message_id < message_id:
+        return advance(room_id, user_id, message_id)
+    return False
+
+
+def mark_room_read(room_id, user_id):
+    latest = latest_message_id(room_id)
+    return advance(room_id, user_id, latest) if latest else False
+
+
+def unread_count(room_id, user_id):
+    """Messages from others above the user's watermark, counted from the messages"""
+    watermark = ReadWatermark.objects.filter(room_id=room_id, user_id=user_id).values('last_read_message_id')
+    return (
+        Message.objects.filter(room_id=room_id, id__gt=Coalesce(Subquery(watermark), 0))
+        .exclude(sender_id=user_id)
+        .count()
+    )
+
+
+def add_participants(pairs):
+    """Create watermarks for (room_id, user_id) pairs, starting at each room's latest message"""
+    latest = dict(
+        Message.objects.filter(room_id__in={room_id for room_id, _ in pairs})
+        .order_by()
+        .values('room_id')
+        .annotate(latest=Max('id'))
+        .values_list('room_id', 'latest')
+    )
+    ReadWatermark.objects.bulk_create(
+        [
+            ReadWatermark(room_id=room_id, user_id=user_id, last_read_message_id=latest.get(room_id, 0))
+            for room_id, user_id in pairs
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def remove_participants(pairs):
+    condition = Q(pk__in=[])
+    for room_id, user_id in pairs:
+        condition |= Q(room_id=room_id, user_id=user_id)
+    ReadWatermark.objects.filter(condition).delete()
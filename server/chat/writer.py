@@ -0,0 +1,254 @@
+"""
+Write-behind persistence for chat messages.
+
+ChatConsumer hands each incoming message to the process-wide message_writer
+instead of inserting it on the spot. The writer buffers messages on the
+event loop and stores them in micro-batches: one bulk INSERT for the batch
+and, per room, one UPDATE of the room's snapshot and one of its unread
+counters (chat.inbox.record_messages), in a single transaction. Databases
+that report no IDs for bulk inserts (MySQL) get them back with one more
+query: the batch's rows are the ones above the table's highest ID read
+just before the INSERT, matched to the batch in ID order (see read_ids).
+Only one batch is written at a time; messages arriving meanwhile wait for
+the next one, and no batch holds more than CHAT_MESSAGE_BATCH_SIZE
+messages.
+
+CHAT_MESSAGE_DURABILITY decides what a sender waits for:
+
+* ``'deferred'``: the message is broadcast at once under a provisional ID
+  and written CHAT_MESSAGE_BATCH_DELAY seconds after the first message of
+  its batch, or sooner if the batch fills up. When its batch commits, the room receives a ``message_saved`` event
+  mapping provisional IDs to stored ones (or ``message_failed`` if the
+  write failed). Messages still buffered when the process dies are lost,
+  so at most BATCH_DELAY seconds of traffic is at risk.
+* ``'commit'``: the message is broadcast only after its batch commits, with
+  its stored ID. Writes start without waiting for the delay: an idle writer
+  stores a message right away, and under load everything sent during one
+  write shares the next (group commit).
+"""
+import asyncio
+import itertools
+import logging
+import uuid
+from collections import namedtuple
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max
+
+from .inbox import record_messages
+from .models import ChatRoom, Message
+
+logger = logging.getLogger(__name__)
+
+DEFERRED = 'deferred'
+COMMIT = 'commit'
+DURABILITY_MODES = (DEFERRED, COMMIT)
+
+DEFAULT_DURABILITY = DEFERRED
+DEFAULT_BATCH_DELAY = 0.05  # seconds
+DEFAULT_BATCH_SIZE = 200
+
+PendingMessage = namedtuple(
+    'PendingMessage',
+    ['provisional_id', 'room_id', 'sender_id', 'content', 'message_type', 'future'],
+)
+
+
+def room_group_name(room_id):
+    return f'chat_{room_id}'
+
+
+def read_ids(rows, last_id):
+    """
+    Set the IDs and creation times of rows just bulk inserted, in one query.
+
+    Auto-increment IDs of one INSERT follow its row order, and every row of
+    the batch gets an ID above last_id. Rows other writers committed in
+    between also can, so candidates are matched to the batch in order;
+    only a row identical to one of ours could be taken for it.
+    """
+    rooms = {row.room_id for row in rows}
+    senders = {row.sender_id for row in rows}
+    candidates = (
+        Message.objects.filter(id__gt=last_id, room_id__in=rooms, sender_id__in=senders)
+        .order_by('id')
+        .values_list('id', 'room_id', 'sender_id', 'content', 'message_type', 'created_at')
+    )
+    pending = iter(rows)
+    row = next(pending, None)
+    for message_id, room_id, sender_id, content, message_type, created_at in candidates:
+        if row is None:
+            break
+        if (room_id, sender_id, content, message_type) == (row.room_id, row.sender_id, row.content, row.message_type):
+            row.id, row.created_at = message_id, created_at
+            row = next(pending, None)
+    if row is not None:
+        raise RuntimeError('Could not read back the IDs of stored chat messages')
+
+
+class MessageWriter:
+    """Per-process buffer of chat messages waiting to be stored"""
+
+    def __init__(self, durability=None, batch_delay=None, batch_size=None):
+        self._durability = durability
+        self._batch_delay = batch_delay
+        self._batch_size = batch_size
+        self._prefix = uuid.uuid4().hex[:8]
+        self._sequence = itertools.count(1)
+        self._loop = None
+        self._pending = []
+        self._timer = None
+        self._writing = None
+
+    @property
+    def durability(self):
+        durability = self._durability or getattr(settings, 'CHAT_MESSAGE_DURABILITY', DEFAULT_DURABILITY)
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f'CHAT_MESSAGE_DURABILITY must be one of {DURABILITY_MODES}')
+        return durability
+
+    @property
+    def batch_delay(self):
+        if self._batch_delay is not None:
+            return self._batch_delay
+        return getattr(settings, 'CHAT_MESSAGE_BATCH_DELAY', DEFAULT_BATCH_DELAY)
+
+    @property
+    def batch_size(self):
+        if self._batch_size is not None:
+            return self._batch_size
+        return getattr(settings, 'CHAT_MESSAGE_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+
+    def _bind(self):
+        """Attach to the running event loop, starting afresh if it changed"""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._pending = []
+            self._timer = None
+            self._writing = None
+        return loop
+
+    def submit(self, room_id, sender_id, content, message_type='text'):
+        """Queue a message; returns its provisional ID and a future for (id, created_at)"""
+        loop = self._bind()
+        message = PendingMessage(
+            f'{self._prefix}-{next(self._sequence)}',
+            room_id, sender_id, content, message_type, loop.create_future(),
+        )
+        self._pending.append(message)
+        self._schedule()
+        return message.provisional_id, message.future
+
+    def _schedule(self):
+        if self._writing is not None or not self._pending:
+            return
+        if self.durability == COMMIT or len(self._pending) >= self.batch_size:
+            self._start_write()
+        elif self._timer is None:
+            self._timer = self._loop.call_later(self.batch_delay, self._start_write)
+
+    def _start_write(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._writing is not None or not self._pending:
+            return
+        batch = self._pending[:self.batch_size]
+        del self._pending[:self.batch_size]
+        self._writing = self._loop.create_task(self._write(batch))
+
+    async def flush(self):
+        """Write everything buffered so far and wait for it to be stored"""
+        if self._loop is not asyncio.get_running_loop():
+            return
+        while self._pending or self._writing is not None:
+            self._start_write()
+            await asyncio.shield(self._writing)
+
+    def pending_messages(self):
+        return len(self._pending)
+
+    async def _write(self, batch):
+        error = None
+        try:
+            stored = await database_sync_to_async(self.store)(batch)
+        except Exception as exc:
+            logger.exception('Could not store %d chat messages', len(batch))
+            stored, error = {}, exc
+        finally:
+            # One batch at a time, so each room sees its batches in order
+            self._writing = None
+            self._schedule()
+        for message in batch:
+            result = stored.get(message.provisional_id)
+            if result is not None:
+                message.future.set_result(result)
+            else:
+                message.future.set_exception(error or ChatRoom.DoesNotExist())
+                # Deferred senders never await their futures; don't log them as lost
+                message.future.exception()
+        if self.durability == DEFERRED:
+            await self._announce(batch, stored)
+
+    def store(self, batch):
+        """Insert a batch; returns {provisional_id: (id, created_at)} for stored messages"""
+        with transaction.atomic():
+            # Rooms deleted since the sender joined would fail the whole INSERT
+            rooms = set(
+                ChatRoom.objects.filter(pk__in={message.room_id for message in batch})
+                .values_list('pk', flat=True)
+            )
+            batch = [message for message in batch if message.room_id in rooms]
+            rows = [
+                Message(
+                    room_id=message.room_id,
+                    sender_id=message.sender_id,
+                    content=message.content,
+                    message_type=message.message_type,
+                )
+                for message in batch
+            ]
+            if connection.features.can_return_rows_from_bulk_insert:
+                Message.objects.bulk_create(rows)
+            else:
+                # bulk_create leaves the IDs unset here
+                last_id = Message.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+                Message.objects.bulk_create(rows)
+                read_ids(rows, last_id)
+            record_messages(rows)
+        return {
+            message.provisional_id: (row.id, row.created_at)
+            for message, row in zip(batch, rows)
+        }
+
+    async def _announce(self, batch, stored):
+        """Tell each room which provisional IDs were stored and which were dropped"""
+        channel_layer = get_channel_layer()
+        rooms = {}
+        for message in batch:
+            saved, failed = rooms.setdefault(message.room_id, ([], []))
+            result = stored.get(message.provisional_id)
+            if result is None:
+                failed.append(message.provisional_id)
+            else:
+                saved.append({
+                    'provisional_id': message.provisional_id,
+                    'id': result[0],
+                    'created_at': result[1].isoformat(),
+                })
+        for room_id, (saved, failed) in rooms.items():
+            if saved:
+                await channel_layer.group_send(
+                    room_group_name(room_id), {'type': 'message_saved', 'room_id': room_id, 'messages': saved}
+                )
+            if failed:
+                await channel_layer.group_send(
+                    room_group_name(room_id), {'type': 'message_failed', 'room_id': room_id, 'provisional_ids': failed}
+                )
+
+
+message_writer = MessageWriter()
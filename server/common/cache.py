@@ -0,0 +1,273 @@
+"""
+Two-tier cache for anonymous API responses.
+
+Each cached endpoint has a generation token stored in the shared cache
+(settings.CACHES). Response payloads are stored under the endpoint name,
+its current generation and a digest of the normalized query parameters, in
+the shared cache and in a small per-process LRU in front of it. Model
+signals call invalidate_responses(), which replaces the generation, so
+every stored page of that endpoint is bypassed at once. Processes re-read
+the generation at most every LOCAL_TTL seconds, which bounds how long
+another process can serve a page from before an invalidation.
+
+Entries are fresh for the endpoint's TIMEOUT and may then be served stale
+for STALE_TIMEOUT more seconds while a single request recomputes them.
+"""
+import hashlib
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict, namedtuple
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.response import Response
+
+DEFAULTS = {
+    'ALIAS': 'default',
+    'LOCAL_MAX_ENTRIES': 512,
+    'LOCAL_TTL': 2,  # seconds a process trusts its copy of a generation
+    'TIMEOUT': 60,
+    'STALE_TIMEOUT': 30,
+    'REFRESH_LOCK_TIMEOUT': 10,
+    'STATS_FLUSH_INTERVAL': 10,
+    'ENDPOINTS': {},
+}
+
+EVENTS = ('local_hits', 'shared_hits', 'stale_hits', 'misses', 'invalidations')
+
+CacheEntry = namedtuple('CacheEntry', ['data', 'fresh_until', 'stale_until'])
+
+
+def get_setting(name):
+    return getattr(settings, 'RESPONSE_CACHE', {}).get(name, DEFAULTS[name])
+
+
+class LocalLRU:
+    """Thread-safe, size-bounded in-process cache"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ResponseCache:
+    """Cached responses of one endpoint"""
+
+    def __init__(self, name, local):
+        self.name = name
+        self.local = local
+        self._lock = threading.Lock()
+        self._generation = None
+        self._generation_checked = 0.0
+        self._unflushed = Counter()
+        self._stats_flushed_at = time.monotonic()
+
+    @property
+    def shared(self):
+        return caches[get_setting('ALIAS')]
+
+    def _endpoint_setting(self, name):
+        endpoint = get_setting('ENDPOINTS').get(self.name, {})
+        return endpoint.get(name, get_setting(name))
+
+    @property
+    def timeout(self):
+        return self._endpoint_setting('TIMEOUT')
+
+    @property
+    def stale_timeout(self):
+        return self._endpoint_setting('STALE_TIMEOUT')
+
+    @property
+    def generation_key(self):
+        return f'response:{self.name}:generation'
+
+    def generation(self):
+        now = time.monotonic()
+        if self._generation is not None and now - self._generation_checked < get_setting('LOCAL_TTL'):
+            return self._generation
+        generation = self.shared.get(self.generation_key)
+        if generation is None:
+            self.shared.add(self.generation_key, uuid.uuid4().hex, None)
+            generation = self.shared.get(self.generation_key)
+        self._generation, self._generation_checked = generation, now
+        return generation
+
+    def invalidate(self):
+        """Start a new generation; every stored page of this endpoint becomes unreachable"""
+        generation = uuid.uuid4().hex
+        self.shared.set(self.generation_key, generation, None)
+        self._generation, self._generation_checked = generation, time.monotonic()
+        self.count('invalidations')
+
+    def make_key(self, request, generation, view_kwargs=None):
+        params = sorted(
+            (name, sorted(value for value in values if value != ''))
+            for name, values in request.query_params.lists()
+        )
+        params = [(name, values) for name, values in params if values]
+        params.append(sorted((view_kwargs or {}).items()))
+        digest = hashlib.md5(repr(params).encode()).hexdigest()
+        return f'response:{self.name}:{generation}:{digest}'
+
+    def lookup(self, key):
+        """Return (entry, tier) from the local LRU or the shared cache"""
+        entry = self.local.get(key)
+        if entry is not None:
+            return entry, 'local'
+        entry = self.shared.get(key)
+        if entry is not None:
+            self.local.set(key, entry)
+        return entry, 'shared'
+
+    def store(self, key, data):
+        now = time.time()
+        entry = CacheEntry(data, now + self.timeout, now + self.timeout + self.stale_timeout)
+        self.shared.set(key, entry, self.timeout + self.stale_timeout)
+        self.local.set(key, entry)
+
+    def claim_refresh(self, key):
+        """True for the one request that gets to recompute a stale entry"""
+        return self.shared.add(f'{key}:refresh', 1, get_setting('REFRESH_LOCK_TIMEOUT'))
+
+    def respond(self, request, compute, view_kwargs=None):
+        key = self.make_key(request, self.generation(), view_kwargs)
+        entry, tier = self.lookup(key)
+        if entry is not None:
+            now = time.time()
+            if now < entry.fresh_until:
+                self.count(f'{tier}_hits')
+                return Response(entry.data, headers={'X-Cache': 'HIT'})
+            if now < entry.stale_until and not self.claim_refresh(key):
+                self.count('stale_hits')
+                return Response(entry.data, headers={'X-Cache': 'STALE'})
+
+        self.count('misses')
+        response = compute()
+        if response.status_code == 200:
+            self.store(key, response.data)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def count(self, event):
+        with self._lock:
+            self._unflushed[event] += 1
+            due = time.monotonic() - self._stats_flushed_at >= get_setting('STATS_FLUSH_INTERVAL')
+        if due:
+            self.flush_stats()
+
+    def flush_stats(self):
+        """Add this process's counters to the shared totals"""
+        with self._lock:
+            unflushed, self._unflushed = self._unflushed, Counter()
+            self._stats_flushed_at = time.monotonic()
+        for event, amount in unflushed.items():
+            key = f'response:{self.name}:stats:{event}'
+            if not self.shared.add(key, amount, None):
+                try:
+                    self.shared.incr(key, amount)
+                except ValueError:
+                    self.shared.set(key, amount, None)
+
+    def stats(self):
+        self.flush_stats()
+        keys = {f'response:{self.name}:stats:{event}': event for event in EVENTS}
+        values = self.shared.get_many(keys.keys())
+        stats = {event: values.get(key, 0) for key, event in keys.items()}
+        lookups = sum(stats[event] for event in ('local_hits', 'shared_hits', 'stale_hits', 'misses'))
+        hits = lookups - stats['misses']
+        stats['hit_ratio'] = round(hits / lookups, 4) if lookups else None
+        return stats
+
+    def reset_stats(self):
+        with self._lock:
+            self._unflushed = Counter()
+        self.shared.delete_many([f'response:{self.name}:stats:{event}' for event in EVENTS])
+
+
+_local = None
+_caches = {}
+_registry_lock = threading.Lock()
+
+
+def get_response_cache(name):
+    global _local
+    with _registry_lock:
+        if _local is None:
+            _local = LocalLRU(get_setting('LOCAL_MAX_ENTRIES'))
+        if name not in _caches:
+            _caches[name] = ResponseCache(name, _local)
+        return _caches[name]
+
+
+def response_caches():
+    """All endpoint caches used by this process, plus configured ones"""
+    for name in get_setting('ENDPOINTS'):
+        get_response_cache(name)
+    return dict(_caches)
+
+
+def invalidate_responses(*names):
+    """
+    Invalidate endpoints now and, inside a transaction, again on commit so a
+    page rebuilt from the pre-commit data in between is dropped as well.
+    """
+    def invalidate():
+        for name in names:
+            get_response_cache(name).invalidate()
+    invalidate()
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(invalidate)
+
+
+def clear_response_caches():
+    """Drop this process's local entries, remembered generations and unflushed counters"""
+    for cache in _caches.values():
+        cache._generation = None
+        cache._unflushed = Counter()
+    if _local is not None:
+        _local.clear()
+
+
+def cache_response(name):
+    """
+    Cache a view's anonymous GET responses under endpoint ``name``.
+
+    Wrap function views below @api_view; wrap APIView methods with
+    django.utils.decorators.method_decorator.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+            return get_response_cache(name).respond(
+                request, lambda: view(request, *args, **kwargs), kwargs
+            )
+        return wrapper
+    return decorator
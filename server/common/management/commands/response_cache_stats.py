@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from common.cache import response_caches
+
+
+class Command(BaseCommand):
+    help = 'Show hit and miss counters of the anonymous response cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Reset the counters after printing them'
+        )
+
+    def handle(self, *args, **options):
+        caches = response_caches()
+        if not caches:
+            self.stdout.write('No response caches configured.')
+            return
+        
+        for name, cache in sorted(caches.items()):
+            stats = cache.stats()
+            ratio = 'n/a' if stats['hit_ratio'] is None else f"{stats['hit_ratio']:.1%}"
+            self.stdout.write(
+                f"{name}: local hits {stats['local_hits']}, shared hits {stats['shared_hits']}, "
+                f"stale hits {stats['stale_hits']}, misses {stats['misses']}, "
+                f"invalidations {stats['invalidations']}, hit ratio {ratio}"
+            )
+            if options['reset']:
+                cache.reset_stats()
+        
+        if options['reset']:
+            self.stdout.write(self.style.SUCCESS('Counters reset'))
@@ -0,0 +1,165 @@
+"""
+Keyset (cursor) pagination shared by the question, answer and job listings.
+
+Instead of COUNT(*) + OFFSET, each page is fetched with a WHERE clause that
+continues strictly after the last row of the previous page in the sort
+order. Every ordering ends with a unique tiebreaker (the primary key) so
+rows with equal sort values are never skipped or repeated.
+"""
+import base64
+import binascii
+import hashlib
+import json
+from datetime import datetime
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+
+APPROXIMATE_COUNT_TIMEOUT = 60  # seconds
+
+
+class KeysetPagination:
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    total_query_param = 'total'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self, ordering):
+        """``ordering`` is a list of field names as passed to order_by(); the last must be unique"""
+        self.ordering = list(ordering)
+        self.has_next = False
+        self.next_cursor = None
+        self.total = None
+
+    @classmethod
+    def is_requested(cls, request):
+        """Cursor mode is used whenever the client sends a cursor parameter, even an empty one"""
+        return cls.cursor_query_param in request.query_params
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def paginate_queryset(self, queryset, request):
+        page_size = self.get_page_size(request)
+        if request.query_params.get(self.total_query_param) == 'approx':
+            self.total = approximate_count(queryset)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(self._after(self.decode_cursor(cursor)))
+
+        rows = list(queryset.order_by(*self.ordering)[:page_size + 1])
+        self.has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        if self.has_next:
+            self.next_cursor = self.encode_cursor(rows[-1])
+        return rows
+
+    def get_paginated_response(self, data):
+        response = {
+            'results': data,
+            'isNext': self.has_next,
+            'nextCursor': self.next_cursor,
+        }
+        if self.total is not None:
+            response['count'] = self.total
+        return Response(response)
+
+    def _fields(self):
+        return [(name.lstrip('-'), name.startswith('-')) for name in self.ordering]
+
+    def _signature(self):
+        return hashlib.md5(','.join(self.ordering).encode()).hexdigest()[:8]
+
+    def _after(self, values):
+        """Lexicographic "strictly after" condition for the decoded cursor values"""
+        fields = self._fields()
+        condition = Q(pk__in=[])
+        for i, (name, descending) in enumerate(fields):
+            lookup = 'lt' if descending else 'gt'
+            step = Q(**{f'{name}__{lookup}': values[i]})
+            for j, (previous, _) in enumerate(fields[:i]):
+                step &= Q(**{previous: values[j]})
+            condition |= step
+        return condition
+
+    def encode_cursor(self, obj):
+        values = []
+        for name, _ in self._fields():
+            value = getattr(obj, name)
+            if isinstance(value, datetime):
+                value = {'dt': value.isoformat()}
+            values.append(value)
+        payload = json.dumps({'o': self._signature(), 'v': values}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+            values = payload['v']
+            if payload['o'] != self._signature() or len(values) != len(self.ordering):
+                raise ValueError
+        except (TypeError, ValueError, KeyError, binascii.Error, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+        decoded = []
+        for value in values:
+            if isinstance(value, dict):
+                value = parse_datetime(value.get('dt') or '')
+                if value is None:
+                    raise NotFound(self.invalid_cursor_message)
+            decoded.append(value)
+        return decoded
+
+
+def approximate_count(queryset):
+    """
+    Cheap row count for showing a total next to cursor pages.
+
+    Unfiltered tables use the database's own row estimate; anything else
+    falls back to an exact count that is cached for a short while.
+    """
+    model = queryset.model
+    if not queryset.query.where and not queryset.query.combinator:
+        estimate = _table_estimate(model._meta.db_table)
+        if estimate is not None:
+            return estimate
+
+    sql, params = queryset.values('pk').query.sql_with_params()
+    key = 'approximate_count:' + hashlib.md5(f'{sql}{params}'.encode()).hexdigest()
+    total = cache.get(key)
+    if total is None:
+        total = queryset.order_by().values('pk').distinct().count()
+        cache.set(key, total, APPROXIMATE_COUNT_TIMEOUT)
+    return total
+
+
+def _table_estimate(table):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT TABLE_ROWS FROM information_schema.TABLES '
+                'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s',
+                [table]
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
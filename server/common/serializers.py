@@ -0,0 +1,170 @@
+"""
+Batched loading of the current user's relations to serialized objects.
+
+Serializers such as QuestionListSerializer show per-viewer state (vote,
+bookmark, follow, application). Looking that up per object costs one query
+per row. Serializers using ViewerStateMixin declare the relations they read
+and, when serialized with many=True, ViewerStateListSerializer fetches the
+viewer's rows for the whole page (and nested lists) in one query per
+relation. The results are cached on the request.
+
+Nested serializers can batch their own lookups the same way: a serializer
+class defining ``prime_instances(instances)`` is handed the related objects
+of every item on the page at once, e.g. every author, before serializing
+(see prime_nested). PrimingListSerializer does only that part.
+"""
+from django.db import models
+from rest_framework import serializers
+
+
+class ViewerRelation:
+    """A model linking the viewer to an object, e.g. QuestionBookmark(user, question)"""
+
+    def __init__(self, model, field, value=None, user_field='user'):
+        self.model = model
+        self.field = field
+        self.value = value
+        self.user_field = user_field
+
+    @property
+    def key(self):
+        return (self.model._meta.label, self.field)
+
+    def fetch(self, user, ids):
+        """Return {object_id: value} for the given object IDs in one query"""
+        rows = self.model.objects.filter(
+            **{self.user_field: user, f'{self.field}_id__in': ids}
+        ).values_list(f'{self.field}_id', self.value or 'pk')
+        return dict(rows)
+
+
+class ViewerState:
+    """Request-scoped store of viewer relation lookups"""
+
+    def __init__(self, user):
+        self.user = user
+        self._loaded = {}
+
+    @classmethod
+    def for_context(cls, context):
+        request = context.get('request')
+        if request is None:
+            return None
+        state = getattr(request, '_viewer_state', None)
+        if state is None:
+            state = cls(request.user)
+            request._viewer_state = state
+        return state
+
+    @property
+    def is_anonymous(self):
+        return not (self.user and self.user.is_authenticated)
+
+    def load(self, relation, ids):
+        """Fetch the viewer's rows for any IDs not loaded yet"""
+        if self.is_anonymous:
+            return
+        loaded = self._loaded.setdefault(relation.key, {})
+        missing = {pk for pk in ids if pk not in loaded}
+        if not missing:
+            return
+        found = relation.fetch(self.user, missing)
+        for pk in missing:
+            loaded[pk] = found.get(pk)
+
+    def get(self, relation, pk):
+        if self.is_anonymous:
+            return None
+        loaded = self._loaded.get(relation.key, {})
+        if pk not in loaded:
+            self.load(relation, [pk])
+            loaded = self._loaded[relation.key]
+        return loaded[pk]
+
+
+def _prefetched(item, field):
+    return field.source in getattr(item, '_prefetched_objects_cache', {})
+
+
+def prime_nested(serializer, items):
+    """
+    Hand the related objects of every item to the nested serializers that
+    define prime_instances(), one call per serializer class
+    """
+    groups = {}  # prime_instances function -> (nested serializer, instances)
+    for field in serializer.fields.values():
+        many = isinstance(field, serializers.ListSerializer)
+        nested = field.child if many else field
+        prime = getattr(type(nested), 'prime_instances', None)
+        if prime is None or field.write_only or field.source == '*' or '.' in field.source:
+            continue
+        # Unprefetched relations would cost a query per item here
+        if many and not all(_prefetched(item, field) for item in items):
+            continue
+        instances = groups.setdefault(prime, (nested, []))[1]
+        for item in items:
+            value = getattr(item, field.source, None)
+            if value is None:
+                continue
+            if many:
+                instances.extend(value.all())
+            else:
+                instances.append(value)
+    for nested, instances in groups.values():
+        if instances:
+            nested.prime_instances(instances)
+
+
+class PrimingListSerializer(serializers.ListSerializer):
+    """Lets nested serializers load what they need for the whole list at once"""
+
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        if items:
+            self.prime(items)
+        return super().to_representation(items)
+
+    def prime(self, items):
+        prime_nested(self.child, items)
+
+
+class ViewerStateListSerializer(PrimingListSerializer):
+    """Primes viewer relations for every object in the list before serializing"""
+
+    def prime(self, items):
+        super().prime(items)
+
+        # Prime prefetched nested lists too, e.g. the tags of every question on the page
+        for field in self.child.fields.values():
+            if not isinstance(field, ViewerStateListSerializer) or field.write_only:
+                continue
+            if not all(_prefetched(item, field) for item in items):
+                continue
+            nested = []
+            for item in items:
+                nested.extend(getattr(item, field.source).all())
+            if nested:
+                field.prime(nested)
+
+        state = ViewerState.for_context(self.context)
+        if state is None or state.is_anonymous:
+            return
+        ids = [item.pk for item in items]
+        for relation in self.child.viewer_relations.values():
+            state.load(relation, ids)
+
+
+class ViewerStateMixin:
+    """
+    Serializer mixin for per-viewer fields.
+
+    Declare ``viewer_relations = {'name': ViewerRelation(...)}`` and set
+    ``list_serializer_class = ViewerStateListSerializer`` in Meta.
+    """
+    viewer_relations = {}
+
+    def viewer_value(self, name, obj):
+        state = ViewerState.for_context(self.context)
+        if state is None:
+            return None
+        return state.get(self.viewer_relations[name], obj.pk)
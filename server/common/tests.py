@@ -1,3 +1,78 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 # Create your tests here.
+from rest_framework.test import APITestCase
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.urls import reverse
+from io import StringIO
+
+from tags.models import Tag
+from .cache import LocalLRU, clear_response_caches
+
+User = get_user_model()
+
+
+class ResponseCacheTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        clear_response_caches()
+        Tag.objects.create(name='python', slug='python')
+        self.url = reverse('tag-list-create')
+
+    def test_repeat_requests_hit_the_local_tier(self):
+        self.assertEqual(self.client.get(self.url)['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual([tag['name'] for tag in response.data['tags']], ['python'])
+
+    def test_query_params_are_normalized(self):
+        self.client.get(self.url + '?sort=name&search=&limit=5')
+        response = self.client.get(self.url + '?limit=5&sort=name')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        response = self.client.get(self.url + '?limit=6&sort=name')
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+    def test_model_signals_invalidate(self):
+        self.client.get(self.url)
+        Tag.objects.create(name='django', slug='django')
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(len(response.data['tags']), 2)
+
+    def test_authenticated_requests_bypass_cache(self):
+        user = User.objects.create_user(username='member', email='member@example.com', password='password123')
+        self.client.force_authenticate(user)
+        self.client.get(self.url)
+        self.assertNotIn('X-Cache', self.client.get(self.url))
+
+    @override_settings(RESPONSE_CACHE={'ENDPOINTS': {'tags': {'TIMEOUT': 0, 'STALE_TIMEOUT': 60}}})
+    def test_stale_entry_is_served_while_one_request_rebuilds(self):
+        self.client.get(self.url)
+        # The first request to see the stale page rebuilds it...
+        self.assertEqual(self.client.get(self.url)['X-Cache'], 'MISS')
+        # ...everyone else keeps getting the stale copy meanwhile
+        self.assertEqual(self.client.get(self.url)['X-Cache'], 'STALE')
+
+    def test_stats_command_reports_counters(self):
+        self.client.get(self.url)
+        self.client.get(self.url)
+        out = StringIO()
+        call_command('response_cache_stats', reset=True, stdout=out)
+        self.assertIn('tags: local hits 1, shared hits 0, stale hits 0, misses 1', out.getvalue())
+        self.assertIn('hit ratio 50.0%', out.getvalue())
+
+
+class LocalLRUTests(TestCase):
+
+    def test_evicts_least_recently_used(self):
+        lru = LocalLRU(2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual((lru.get('a'), lru.get('c')), (1, 3))
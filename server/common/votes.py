@@ -0,0 +1,91 @@
+"""
+Atomic up/down voting for questions and answers.
+
+The vote table (one row per user and target) is the ledger of who voted
+what. Casting a vote locks the user's ledger row, applies the toggle/flip
+rules to it and moves the target's counters with a single F() UPDATE on the
+counter columns only, all in one transaction. Concurrent voters therefore
+never overwrite each other's counts, and the large text columns of the
+question or answer are never rewritten.
+"""
+from collections import namedtuple
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.dispatch import Signal
+
+VoteResult = namedtuple('VoteResult', ['upvotes', 'downvotes', 'user_vote'])
+
+# Sent with sender=vote model and target_id, result and deltas ({'up': n,
+# 'down': n}) after every cast; flips and removals bypass the vote model's
+# save/delete signals.
+vote_cast = Signal()
+
+
+class VoteEngine:
+
+    def __init__(self, vote_model, target_field):
+        self.vote_model = vote_model
+        self.target_field = target_field
+        self.target_model = vote_model._meta.get_field(target_field).related_model
+
+    def cast(self, target_id, user, vote_type):
+        """
+        Apply ``vote_type`` ('up' or 'down') from ``user`` to a target.
+
+        Voting the same way twice removes the vote; voting the other way
+        flips it. Returns the target's new counts and the user's vote.
+        """
+        try:
+            return self._cast(target_id, user, vote_type)
+        except IntegrityError:
+            # Another request from the same user inserted the ledger row
+            # first; retrying sees it and applies toggle/flip semantics.
+            return self._cast(target_id, user, vote_type)
+
+    @transaction.atomic
+    def _cast(self, target_id, user, vote_type):
+        lookup = {f'{self.target_field}_id': target_id, 'user': user}
+        existing = (
+            self.vote_model.objects.select_for_update()
+            .filter(**lookup)
+            .values_list('pk', 'vote_type')
+            .first()
+        )
+
+        deltas = {'up': 0, 'down': 0}
+        if existing is None:
+            with transaction.atomic():
+                self.vote_model.objects.create(vote_type=vote_type, **lookup)
+            deltas[vote_type] += 1
+            user_vote = vote_type
+        else:
+            pk, old_vote_type = existing
+            deltas[old_vote_type] -= 1
+            if old_vote_type == vote_type:
+                self.vote_model.objects.filter(pk=pk).delete()
+                user_vote = None
+            else:
+                self.vote_model.objects.filter(pk=pk).update(vote_type=vote_type)
+                deltas[vote_type] += 1
+                user_vote = vote_type
+
+        targets = self.target_model.objects.filter(pk=target_id)
+        targets.update(
+            upvotes=F('upvotes') + deltas['up'],
+            downvotes=F('downvotes') + deltas['down'],
+            **self.extra_updates(deltas)
+        )
+        # Our UPDATE holds the row lock, so this read sees exactly our result
+        upvotes, downvotes = targets.values_list('upvotes', 'downvotes').get()
+        self.after_vote(target_id, upvotes, downvotes)
+        result = VoteResult(upvotes, downvotes, user_vote)
+        vote_cast.send(sender=self.vote_model, target_id=target_id, result=result, deltas=deltas)
+        return result
+
+    def extra_updates(self, deltas):
+        """Additional column updates to apply with the counter UPDATE"""
+        return {}
+
+    def after_vote(self, target_id, upvotes, downvotes):
+        """Hook run inside the transaction once the new counts are known"""
@@ -33,18 +33,22 @@ class UserActivity(models.Model):
         time_threshold = timezone.now() - timezone.timedelta(minutes=minutes)
         return self.last_activity >= time_threshold
     
-    @property
-    def activity_status(self):
-        """Get user's activity status"""
-        if self.is_online:
-            return 'online'
-        elif self.is_recently_active(5):
+    def recency_status(self):
+        """'active', 'away' or 'offline' from the last activity alone"""
+        if self.is_recently_active(5):
             return 'active'
         elif self.is_recently_active(60):
             return 'away'
         else:
             return 'offline'
     
+    @property
+    def activity_status(self):
+        """Get user's activity status"""
+        if self.is_online:
+            return 'online'
+        return self.recency_status()
+    
     @property
     def is_active_now(self):
         """Check if user is currently active (online or recently active)"""
@@ -0,0 +1,353 @@
+"""
+Presence fed by WebSocket connections.
+
+ChatConsumer reports every connection, heartbeat frame and disconnect to
+the process-wide ``presence`` service. A store keeps each user's open
+connections with an expiry TTL seconds after their last sign of life, so a
+user is online while any connection is live and a connection that stops
+sending heartbeats lapses on its own. Users online through several tabs or
+rooms count once per connection and go offline with the last one.
+
+When a user comes online or goes offline the change is pushed at once to
+the ``user_<id>`` group of each follower. The database is written lazily:
+every FLUSH_INTERVAL seconds a single UPDATE stores the online flags that
+changed and the latest activity of everyone seen, which is also when lapsed
+connections are swept.
+
+Stores, chosen with PRESENCE['BACKEND']:
+
+* RedisPresenceStore (the default) keeps connections in Redis, at
+  PRESENCE['LOCATION'], so every process sees every connection and any
+  process's sweep reports users whose connections lapsed, each once. Its
+  calls run in a worker thread, off the event loop.
+* LocalPresenceStore keeps connections in process memory. It suits tests,
+  development and single-process servers; other processes do not see them.
+
+If the store cannot be reached, changes are dropped and everyone reads as
+offline until it is back.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db.models import BooleanField, Case, DateTimeField, F, Value, When
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import UserActivity, UserFollow
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BACKEND': 'community.presence.RedisPresenceStore',
+    'LOCATION': 'redis://127.0.0.1:6379/2',
+    'KEY_PREFIX': 'presence',
+    'TTL': 75,  # seconds a connection stays live without a heartbeat
+    'FLUSH_INTERVAL': 30,  # seconds between database writes and sweeps
+}
+
+ONLINE = 'online'
+OFFLINE = 'offline'
+
+
+def get_setting(name):
+    return getattr(settings, 'PRESENCE', {}).get(name, DEFAULTS[name])
+
+
+def user_group_name(user_id):
+    return f'user_{user_id}'
+
+
+class LocalPresenceStore:
+    """Connections of this process, in memory"""
+    blocking = False
+
+    def __init__(self):
+        self._connections = defaultdict(dict)  # user_id -> {connection: expires_at}
+        self._lock = threading.Lock()
+
+    def _live(self, user_id, now):
+        connections = self._connections.get(user_id)
+        return bool(connections) and any(expires_at > now for expires_at in connections.values())
+
+    def touch(self, user_id, connection, ttl):
+        """Register or refresh a connection; returns True if the user came online"""
+        now = time.monotonic()
+        with self._lock:
+            was_online = self._live(user_id, now)
+            self._connections[user_id][connection] = now + ttl
+        return not was_online
+
+    def disconnect(self, user_id, connection):
+        """Forget a connection; returns True if the user went offline"""
+        now = time.monotonic()
+        with self._lock:
+            was_online = self._live(user_id, now)
+            connections = self._connections.get(user_id, {})
+            connections.pop(connection, None)
+            if not connections:
+                self._connections.pop(user_id, None)
+            return was_online and not self._live(user_id, now)
+
+    def expire(self):
+        """Drop lapsed connections; returns the users left without any"""
+        now = time.monotonic()
+        offline = []
+        with self._lock:
+            for user_id in list(self._connections):
+                connections = self._connections[user_id]
+                for connection, expires_at in list(connections.items()):
+                    if expires_at <= now:
+                        del connections[connection]
+                if not connections:
+                    del self._connections[user_id]
+                    offline.append(user_id)
+        return offline
+
+    def online(self, user_ids):
+        now = time.monotonic()
+        with self._lock:
+            return {user_id for user_id in user_ids if self._live(user_id, now)}
+
+    def has_connections(self):
+        return bool(self._connections)
+
+
+class RedisPresenceStore:
+    """
+    Connections of every process, in Redis.
+
+    Each user has a sorted set of connections scored by expiry time, which
+    itself expires with the last of them, and an index sorted set scores
+    every online user by their latest expiry. Changes run as Lua scripts,
+    so two processes touching one user cannot lose a connection, and a
+    sweep claims each lapsed user exactly once.
+    """
+    blocking = True
+    SWEEP_BATCH = 1000
+
+    TOUCH = """
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+    local was_online = redis.call('ZCARD', KEYS[1]) > 0
+    redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+    local last = redis.call('ZRANGE', KEYS[1], -1, -1, 'WITHSCORES')
+    redis.call('EXPIREAT', KEYS[1], math.ceil(tonumber(last[2])))
+    redis.call('ZADD', KEYS[2], last[2], ARGV[4])
+    if was_online then return 0 end
+    return 1
+    """
+
+    DISCONNECT = """
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+    local was_online = redis.call('ZCARD', KEYS[1]) > 0
+    redis.call('ZREM', KEYS[1], ARGV[1])
+    local last = redis.call('ZRANGE', KEYS[1], -1, -1, 'WITHSCORES')
+    if #last > 0 then
+        redis.call('ZADD', KEYS[2], last[2], ARGV[3])
+        return 0
+    end
+    redis.call('DEL', KEYS[1])
+    redis.call('ZREM', KEYS[2], ARGV[3])
+    if was_online then return 1 end
+    return 0
+    """
+
+    # Users whose latest expiry has passed have no live connection left
+    SWEEP = """
+    local users = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+    for _, user_id in ipairs(users) do
+        redis.call('ZREM', KEYS[1], user_id)
+        redis.call('DEL', ARGV[3] .. user_id)
+    end
+    return users
+    """
+
+    def __init__(self, location=None, key_prefix=None):
+        # Imported here so processes using LocalPresenceStore need no Redis client
+        import redis
+
+        self.client = redis.Redis.from_url(location or get_setting('LOCATION'))
+        self.prefix = key_prefix or get_setting('KEY_PREFIX')
+        self._touch = self.client.register_script(self.TOUCH)
+        self._disconnect = self.client.register_script(self.DISCONNECT)
+        self._sweep = self.client.register_script(self.SWEEP)
+
+    @property
+    def index_key(self):
+        return f'{self.prefix}:users'
+
+    def key(self, user_id):
+        return f'{self.prefix}:user:{user_id}'
+
+    def touch(self, user_id, connection, ttl):
+        now = time.time()
+        keys = [self.key(user_id), self.index_key]
+        return bool(self._touch(keys=keys, args=[connection, now, now + ttl, user_id]))
+
+    def disconnect(self, user_id, connection):
+        keys = [self.key(user_id), self.index_key]
+        return bool(self._disconnect(keys=keys, args=[connection, time.time(), user_id]))
+
+    def expire(self):
+        now = time.time()
+        offline = []
+        while True:
+            users = self._sweep(keys=[self.index_key], args=[now, self.SWEEP_BATCH, self.key('')])
+            offline.extend(int(user_id) for user_id in users)
+            if len(users) < self.SWEEP_BATCH:
+                return offline
+
+    def online(self, user_ids):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return set()
+        now = time.time()
+        pipeline = self.client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipeline.zscore(self.index_key, user_id)
+        return {
+            user_id for user_id, expires_at in zip(user_ids, pipeline.execute())
+            if expires_at is not None and expires_at > now
+        }
+
+    def has_connections(self):
+        return self.client.zcard(self.index_key) > 0
+
+
+class Presence:
+    """Per-process presence service"""
+
+    def __init__(self, store=None, ttl=None, flush_interval=None):
+        self._store = store
+        self._ttl = ttl
+        self._flush_interval = flush_interval
+        self._loop = None
+        self._timer = None
+        self._last_activity = {}  # user_id -> datetime, not yet written
+        self._online = {}  # user_id -> bool, not yet written
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = import_string(get_setting('BACKEND'))()
+        return self._store
+
+    @property
+    def ttl(self):
+        return self._ttl if self._ttl is not None else get_setting('TTL')
+
+    @property
+    def flush_interval(self):
+        return self._flush_interval if self._flush_interval is not None else get_setting('FLUSH_INTERVAL')
+
+    def is_online(self, user_id):
+        return user_id in self.online([user_id])
+
+    def online(self, user_ids):
+        try:
+            return self.store.online(list(user_ids))
+        except Exception:
+            logger.warning('Presence store unavailable', exc_info=True)
+            return set()
+
+    async def _call(self, method, *args, default=None):
+        """Run a store method, in a worker thread if the store does I/O"""
+        try:
+            if self.store.blocking:
+                return await sync_to_async(method, thread_sensitive=False)(*args)
+            return method(*args)
+        except Exception:
+            logger.warning('Presence store unavailable', exc_info=True)
+            return default
+
+    async def connect(self, user_id, connection):
+        await self.heartbeat(user_id, connection)
+
+    async def heartbeat(self, user_id, connection):
+        self._seen(user_id)
+        if await self._call(self.store.touch, user_id, connection, self.ttl, default=False):
+            await self._changed({user_id: ONLINE})
+
+    async def disconnect(self, user_id, connection):
+        self._seen(user_id)
+        if await self._call(self.store.disconnect, user_id, connection, default=False):
+            await self._changed({user_id: OFFLINE})
+
+    def _seen(self, user_id):
+        self._last_activity[user_id] = timezone.now()
+        self._schedule()
+
+    def _schedule(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._timer = None
+        if self._timer is None:
+            self._timer = loop.call_later(self.flush_interval, self._tick)
+
+    def _tick(self):
+        self._timer = None
+        self._loop.create_task(self.tick())
+
+    async def tick(self):
+        """Sweep lapsed connections and write pending state to the database"""
+        expired = await self._call(self.store.expire, default=[])
+        if expired:
+            await self._changed({user_id: OFFLINE for user_id in expired})
+        await self.flush()
+        if await self._call(self.store.has_connections, default=True):
+            self._schedule()
+
+    async def _changed(self, changes):
+        """Record status changes and push them to the users' followers"""
+        for user_id, status in changes.items():
+            self._online[user_id] = status == ONLINE
+        self._schedule()
+
+        followers = await database_sync_to_async(self.followers)(list(changes))
+        channel_layer = get_channel_layer()
+        for follower_id, user_ids in followers.items():
+            await channel_layer.group_send(user_group_name(follower_id), {
+                'type': 'presence_changed',
+                'changes': [{'user_id': user_id, 'status': changes[user_id]} for user_id in user_ids],
+            })
+
+    def followers(self, user_ids):
+        """{follower_id: [followed user IDs among user_ids]}"""
+        followers = defaultdict(list)
+        rows = UserFollow.objects.filter(following_id__in=user_ids).values_list('follower_id', 'following_id')
+        for follower_id, user_id in rows:
+            followers[follower_id].append(user_id)
+        return followers
+
+    async def flush(self):
+        last_activity, self._last_activity = self._last_activity, {}
+        online, self._online = self._online, {}
+        if last_activity or online:
+            await database_sync_to_async(self.write)(last_activity, online)
+
+    def write(self, last_activity, online):
+        """One UPDATE for the online flags and activity times of every user touched"""
+        updates = {}
+        if last_activity:
+            updates['last_activity'] = Case(
+                *[When(user_id=user_id, then=Value(seen)) for user_id, seen in last_activity.items()],
+                default=F('last_activity'),
+                output_field=DateTimeField(),
+            )
+        if online:
+            updates['is_online'] = Case(
+                *[When(user_id=user_id, then=Value(is_online)) for user_id, is_online in online.items()],
+                default=F('is_online'),
+                output_field=BooleanField(),
+            )
+        return UserActivity.objects.filter(user_id__in=set(last_activity) | set(online)).update(**updates)
+
+
+presence = Presence()
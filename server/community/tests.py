@@ -1,3 +1,208 @@
 from django.test import TestCase
 
 # Create your tests here.
+import threading
+import time
+import unittest
+import uuid
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.auth import get_user_model
+from django.test import TransactionTestCase
+from rest_framework.test import APITestCase
+
+from auth_app.serializers import UserSerializer
+from questions.models import Question
+from . import presence as presence_module
+from .models import UserActivity, UserFollow
+from .presence import (
+    OFFLINE, ONLINE, LocalPresenceStore, Presence, RedisPresenceStore, get_setting, presence, user_group_name
+)
+
+User = get_user_model()
+
+
+class LocalPresenceStoreTests(TestCase):
+    def test_users_stay_online_until_their_last_connection_closes(self):
+        store = LocalPresenceStore()
+        self.assertTrue(store.touch(1, 'tab-1', ttl=60))
+        self.assertFalse(store.touch(1, 'tab-2', ttl=60))
+        self.assertFalse(store.disconnect(1, 'tab-1'))
+        self.assertEqual(store.online([1, 2]), {1})
+        self.assertTrue(store.disconnect(1, 'tab-2'))
+        self.assertEqual(store.online([1]), set())
+        self.assertFalse(store.disconnect(1, 'tab-2'))
+
+    def test_connections_lapse_without_heartbeats(self):
+        store = LocalPresenceStore()
+        with patch.object(presence_module.time, 'monotonic', return_value=1000.0):
+            store.touch(1, 'tab-1', ttl=60)
+            store.touch(2, 'tab-1', ttl=60)
+        with patch.object(presence_module.time, 'monotonic', return_value=1050.0):
+            store.touch(2, 'tab-1', ttl=60)
+        with patch.object(presence_module.time, 'monotonic', return_value=1070.0):
+            self.assertEqual(store.online([1, 2]), {2})
+            self.assertEqual(store.expire(), [1])
+            # A heartbeat after lapsing brings the user back online
+            self.assertTrue(store.touch(1, 'tab-1', ttl=60))
+
+
+def redis_available():
+    try:
+        import redis
+        return redis.Redis.from_url(get_setting('LOCATION')).ping()
+    except Exception:
+        return False
+
+
+@unittest.skipUnless(redis_available(), 'no Redis server at PRESENCE LOCATION')
+class RedisPresenceStoreTests(TestCase):
+    def setUp(self):
+        self.store = RedisPresenceStore(key_prefix=f'test-presence-{uuid.uuid4().hex}')
+        self.addCleanup(lambda: self.store.client.delete(
+            self.store.index_key, *[self.store.key(user_id) for user_id in (1, 2)]
+        ))
+
+    def test_users_stay_online_until_their_last_connection_closes(self):
+        self.assertTrue(self.store.touch(1, 'tab-1', ttl=60))
+        self.assertFalse(self.store.touch(1, 'tab-2', ttl=60))
+        self.assertFalse(self.store.disconnect(1, 'tab-1'))
+        self.assertEqual(self.store.online([1, 2]), {1})
+        self.assertTrue(self.store.disconnect(1, 'tab-2'))
+        self.assertEqual(self.store.online([1]), set())
+        self.assertFalse(self.store.has_connections())
+
+    def test_lapsed_users_are_swept_once(self):
+        self.store.touch(1, 'tab-1', ttl=1)
+        self.store.touch(2, 'tab-1', ttl=60)
+        time.sleep(1.1)
+        self.assertEqual(self.store.online([1, 2]), {2})
+        self.assertEqual(self.store.expire(), [1])
+        self.assertEqual(self.store.expire(), [])
+        self.assertTrue(self.store.touch(1, 'tab-1', ttl=60))
+
+
+class PresenceServiceTests(TransactionTestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com', password='pass12345')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com', password='pass12345')
+        UserFollow.objects.create(follower=self.bob, following=self.alice)
+        self.presence = Presence(store=LocalPresenceStore(), ttl=60, flush_interval=3600)
+
+    def test_followers_receive_changes_and_activity_is_flushed_once(self):
+        async def session():
+            channel_layer = get_channel_layer()
+            channel = await channel_layer.new_channel()
+            await channel_layer.group_add(user_group_name(self.bob.id), channel)
+            await self.presence.connect(self.alice.id, 'alice-1')
+            await self.presence.connect(self.alice.id, 'alice-2')
+            await self.presence.heartbeat(self.alice.id, 'alice-1')
+            online = await channel_layer.receive(channel)
+            await self.presence.disconnect(self.alice.id, 'alice-1')
+            still_online = self.presence.is_online(self.alice.id)
+            await self.presence.disconnect(self.alice.id, 'alice-2')
+            offline = await channel_layer.receive(channel)
+            await self.presence.flush()
+            return online, still_online, offline
+
+        online, still_online, offline = async_to_sync(session)()
+        self.assertEqual(online['changes'], [{'user_id': self.alice.id, 'status': ONLINE}])
+        self.assertTrue(still_online)
+        self.assertEqual(offline['changes'], [{'user_id': self.alice.id, 'status': OFFLINE}])
+
+        activity = UserActivity.objects.get(user=self.alice)
+        self.assertFalse(activity.is_online)
+        self.assertGreater(activity.last_activity, UserActivity.objects.get(user=self.bob).last_activity)
+
+    def test_store_io_runs_off_the_event_loop(self):
+        threads = []
+
+        class BlockingStore(LocalPresenceStore):
+            blocking = True
+
+            def touch(self, *args):
+                threads.append(threading.get_ident())
+                return super().touch(*args)
+
+        self.presence = Presence(store=BlockingStore(), ttl=60, flush_interval=3600)
+
+        async def connect():
+            await self.presence.connect(self.alice.id, 'alice-1')
+            return threading.get_ident()
+
+        loop_thread = async_to_sync(connect)()
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], loop_thread)
+        self.assertTrue(self.presence.is_online(self.alice.id))
+
+    def test_unavailable_store_reads_as_offline(self):
+        store = LocalPresenceStore()
+        self.presence = Presence(store=store, ttl=60, flush_interval=3600)
+        with patch.object(store, 'touch', side_effect=ConnectionError), \
+                patch.object(store, 'online', side_effect=ConnectionError):
+            async_to_sync(self.presence.connect)(self.alice.id, 'alice-1')
+            self.assertFalse(self.presence.is_online(self.alice.id))
+
+    def test_write_is_one_update(self):
+        with self.assertNumQueries(1):
+            self.presence.write(
+                {self.alice.id: self.alice.date_joined, self.bob.id: self.bob.date_joined},
+                {self.alice.id: True},
+            )
+        self.assertTrue(UserActivity.objects.get(user=self.alice).is_online)
+        self.assertFalse(UserActivity.objects.get(user=self.bob).is_online)
+
+
+class OnlineUsersTests(APITestCase):
+    def setUp(self):
+        self.original_store = presence._store
+        presence._store = LocalPresenceStore()
+        self.addCleanup(setattr, presence, '_store', self.original_store)
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com', password='pass12345')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com', password='pass12345')
+        self.carol = User.objects.create_user(username='carol', email='carol@example.com', password='pass12345')
+        UserFollow.objects.create(follower=self.alice, following=self.bob)
+        UserFollow.objects.create(follower=self.alice, following=self.carol)
+
+    def test_online_status_comes_from_presence(self):
+        presence.store.touch(self.bob.id, 'bob-1', ttl=60)
+        # A stale database flag no longer counts
+        UserActivity.objects.filter(user=self.carol).update(is_online=True)
+
+        self.client.force_authenticate(self.alice)
+        response = self.client.get('/api/community/online-users/')
+        self.assertEqual([entry['user']['username'] for entry in response.data], ['bob'])
+
+        self.assertTrue(UserSerializer(self.bob).data['is_online'])
+        self.assertEqual(UserSerializer(self.bob).data['activity_status'], 'online')
+        self.assertFalse(UserSerializer(self.carol).data['is_online'])
+
+    def test_user_lists_look_up_presence_once(self):
+        presence.store.touch(self.bob.id, 'bob-1', ttl=60)
+        with patch.object(presence.store, 'online', wraps=presence.store.online) as online:
+            data = UserSerializer(User.objects.order_by('id'), many=True).data
+        self.assertEqual(online.call_count, 1)
+        self.assertEqual([(user['username'], user['is_online']) for user in data], [
+            ('alice', False), ('bob', True), ('carol', False)
+        ])
+        self.assertEqual(data[1]['activity_status'], 'online')
+
+    def test_nested_users_look_up_presence_once_per_page(self):
+        presence.store.touch(self.bob.id, 'bob-1', ttl=60)
+        for author in (self.alice, self.bob, self.carol):
+            Question.objects.create(title=f'Question by {author.username}', content='Body', author=author)
+        with patch.object(presence.store, 'online', wraps=presence.store.online) as online:
+            response = self.client.get('/api/questions/')
+        self.assertEqual(online.call_count, 1)
+        authors = {question['author']['username']: question['author'] for question in response.data['questions']}
+        self.assertEqual({name: author['is_online'] for name, author in authors.items()}, {
+            'alice': False, 'bob': True, 'carol': False
+        })
+
+    def test_stale_online_flag_does_not_make_users_online(self):
+        UserActivity.objects.filter(user=self.carol).update(is_online=True)
+        data = UserSerializer(User.objects.select_related('activity').get(pk=self.carol.pk)).data
+        self.assertFalse(data['is_online'])
+        self.assertEqual(data['activity_status'], 'active')
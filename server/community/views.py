@@ -5,7 +5,9 @@ from rest_framework.response import Response
 from django.db.models import Q
 from django.shortcuts import get_object_or_404
 from django.contrib.auth import get_user_model
+from common.cache import cache_response
 from .models import UserFollow, UserActivity
+from .presence import presence
 from .serializers import (
     CommunityUserProfileSerializer, UserFollowSerializer, LeaderboardSerializer,
     UserActivitySerializer
@@ -142,6 +144,7 @@ def user_following(request, user_id):
 
 
 @api_view(['GET'])
+@cache_response('leaderboard')
 def leaderboard(request):
     """Get leaderboard of top users"""
     profiles = UserProfile.objects.select_related('user').prefetch_related('user__badges__badge')
@@ -184,10 +187,9 @@ def online_users(request):
         follower=request.user
     ).values_list('following', flat=True)
     
-    # Get online activities for followed users
+    # Online status comes from the presence store, not the database
     online_activities = UserActivity.objects.filter(
-        user__in=following_users,
-        is_online=True
+        user__in=presence.online(following_users)
     ).select_related('user')
     
     # Serialize the data
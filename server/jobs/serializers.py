@@ -2,6 +2,7 @@ from rest_framework import serializers
 from .models import Job, JobCategory, Company, JobApplication, JobBookmark
 from tags.serializers import TagSerializer
 from auth_app.serializers import UserSerializer
+from common.serializers import ViewerRelation, ViewerStateListSerializer, ViewerStateMixin
 
 
 class CompanySerializer(serializers.ModelSerializer):
@@ -19,7 +20,7 @@ class JobCategorySerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'description']
 
 
-class JobSerializer(serializers.ModelSerializer):
+class JobSerializer(ViewerStateMixin, serializers.ModelSerializer):
     company = CompanySerializer(read_only=True)
     category = JobCategorySerializer(read_only=True)
     skills_required = TagSerializer(many=True, read_only=True)
@@ -48,19 +49,18 @@ class JobSerializer(serializers.ModelSerializer):
             'company_id', 'category_id', 'skill_names'
         ]
         read_only_fields = ['posted_by']
+        list_serializer_class = ViewerStateListSerializer
+    
+    viewer_relations = {
+        'bookmark': ViewerRelation(JobBookmark, 'job'),
+        'application': ViewerRelation(JobApplication, 'job', value='status', user_field='applicant'),
+    }
     
     def get_is_bookmarked(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return JobBookmark.objects.filter(job=obj, user=request.user).exists()
-        return False
+        return self.viewer_value('bookmark', obj) is not None
     
     def get_application_status(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            application = JobApplication.objects.filter(job=obj, applicant=request.user).first()
-            return application.status if application else None
-        return None
+        return self.viewer_value('application', obj)
     
     def create(self, validated_data):
         skill_names = validated_data.pop('skill_names', [])
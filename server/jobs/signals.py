@@ -0,0 +1,10 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from common.cache import invalidate_responses
+from .models import JobCategory
+
+
+@receiver([post_save, post_delete], sender=JobCategory)
+def invalidate_job_categories(sender, **kwargs):
+    """Drop cached category lists when a category changes"""
+    invalidate_responses('job-categories')
@@ -1,3 +1,39 @@
 from django.test import TestCase
 
 # Create your tests here.
+from rest_framework.test import APITestCase
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+
+from .models import Company, Job
+
+User = get_user_model()
+
+
+class JobCursorPaginationTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='recruiter', email='recruiter@example.com', password='password123'
+        )
+        self.company = Company.objects.create(name='Acme')
+        salaries = [(None, None), (50000, 90000), (60000, 90000), (None, 120000), (40000, None), (50000, 90000)]
+        for i, (salary_min, salary_max) in enumerate(salaries):
+            Job.objects.create(
+                title=f'Job {i}', description='Work', requirements='Skills',
+                company=self.company, location='Remote', posted_by=self.user,
+                salary_min=salary_min, salary_max=salary_max
+            )
+        self.list_url = reverse('job-list-create')
+
+    def test_salary_high_cursor_walk_handles_missing_salaries(self):
+        expected = [job['id'] for job in self.client.get(self.list_url, {'sort': 'salary_high'}).data['results']]
+
+        ids = []
+        cursor = ''
+        while cursor is not None:
+            response = self.client.get(self.list_url, {'sort': 'salary_high', 'cursor': cursor, 'page_size': 2})
+            ids.extend(job['id'] for job in response.data['results'])
+            cursor = response.data['nextCursor']
+        self.assertEqual(ids, expected)
+        self.assertEqual(len(ids), 6)
@@ -3,8 +3,12 @@ from rest_framework import status, permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.pagination import PageNumberPagination
-from django.db.models import Q
+from django.db.models import Q, IntegerField
+from django.db.models.functions import Coalesce
 from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from common.cache import cache_response
+from common.pagination import KeysetPagination
 from .models import Job, JobCategory, Company, JobApplication, JobBookmark
 from .serializers import (
     JobSerializer, JobListSerializer, JobCategorySerializer, 
@@ -60,19 +64,31 @@ class JobListCreateView(APIView):
         if min_salary:
             queryset = queryset.filter(salary_min__gte=int(min_salary))
         
-        # Sorting
+        # Sorting; salaries are coalesced so cursors never compare against NULL
         sort_by = request.query_params.get('sort', 'newest')
         if sort_by == 'oldest':
-            queryset = queryset.order_by('created_at')
+            ordering = ['created_at', 'id']
         elif sort_by == 'salary_high':
-            queryset = queryset.order_by('-salary_max', '-salary_min')
+            queryset = queryset.annotate(
+                salary_max_sort=Coalesce('salary_max', 0, output_field=IntegerField()),
+                salary_min_sort=Coalesce('salary_min', 0, output_field=IntegerField())
+            )
+            ordering = ['-salary_max_sort', '-salary_min_sort', '-id']
         elif sort_by == 'salary_low':
-            queryset = queryset.order_by('salary_min', 'salary_max')
+            queryset = queryset.annotate(
+                salary_max_sort=Coalesce('salary_max', 0, output_field=IntegerField()),
+                salary_min_sort=Coalesce('salary_min', 0, output_field=IntegerField())
+            )
+            ordering = ['salary_min_sort', 'salary_max_sort', 'id']
         else:  # newest
-            queryset = queryset.order_by('-created_at')
+            ordering = ['-created_at', '-id']
         
         # Pagination
-        paginator = JobPagination()
+        if KeysetPagination.is_requested(request):
+            paginator = KeysetPagination(ordering)
+        else:
+            paginator = JobPagination()
+            queryset = queryset.order_by(*ordering)
         page = paginator.paginate_queryset(queryset, request)
         
         serializer = JobListSerializer(page, many=True, context={'request': request})
@@ -247,6 +263,7 @@ class CompanyListCreateView(APIView):
 
 
 class JobCategoryListView(APIView):
+    @method_decorator(cache_response('job-categories'))
     def get(self, request):
         """List job categories"""
         categories = JobCategory.objects.all()
@@ -0,0 +1,35 @@
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from community.presence import user_group_name
+from .models import Notification
+
+logger = logging.getLogger(__name__)
+
+
+def push_notification(notification_id):
+    """Send a stored notification to its recipient's open WebSocket connections"""
+    from .serializers import NotificationSerializer
+
+    notification = Notification.objects.select_related('sender').filter(pk=notification_id).first()
+    if notification is None:
+        return
+    try:
+        async_to_sync(get_channel_layer().group_send)(user_group_name(notification.recipient_id), {
+            'type': 'notification',
+            'notification': NotificationSerializer(notification).data,
+        })
+    except Exception:
+        # Clients still find the notification through the REST API
+        logger.warning('Could not push notification %s', notification_id, exc_info=True)
+
+
+@receiver(post_save, sender=Notification)
+def notification_created(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: push_notification(instance.pk))
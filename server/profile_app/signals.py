@@ -1,7 +1,8 @@
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
-from .models import UserProfile
+from common.cache import invalidate_responses
+from .models import UserProfile, UserBadge
 
 User = get_user_model()
 
@@ -55,3 +56,10 @@ def decrease_answers_given_count(sender, instance, **kwargs):
         profile.save()
     except UserProfile.DoesNotExist:
         pass
+
+
+@receiver([post_save, post_delete], sender=UserProfile)
+@receiver([post_save, post_delete], sender=UserBadge)
+def invalidate_leaderboard(sender, **kwargs):
+    """Leaderboard rows show profile counters and badge counts"""
+    invalidate_responses('leaderboard')
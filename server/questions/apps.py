@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class QuestionsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'questions'
+    
+    def ready(self):
+        import questions.signals
@@ -0,0 +1 @@
+# Empty file to make it a Python package
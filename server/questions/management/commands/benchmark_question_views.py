@@ -0,0 +1,91 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from rest_framework.test import APIRequestFactory
+
+from questions import views
+from questions.models import Question, QuestionView
+from questions.view_tracking import ViewBuffer
+
+User = get_user_model()
+
+
+class InlineViewTracker:
+    """The previous read path: get_or_create, F() UPDATE and refresh on every hit"""
+
+    def record(self, question_id, user_id, ip_address):
+        question = Question.objects.get(pk=question_id)
+        _, created = QuestionView.objects.get_or_create(
+            question=question, user_id=user_id, ip_address=ip_address
+        )
+        if created:
+            question.views = F('views') + 1
+            question.save(update_fields=['views'])
+            question.refresh_from_db()
+        return created
+
+    def pending_views(self, question_id):
+        return 0
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare hits per second on one hot question with inline and buffered view tracking'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hits', type=int, default=2000, help='Requests per run')
+        parser.add_argument(
+            '--viewers',
+            type=int,
+            default=200,
+            help='Number of distinct viewer IPs cycling through the hot question'
+        )
+
+    def handle(self, *args, **options):
+        hits = options['hits']
+        viewers = options['viewers']
+        original = views.view_buffer
+        try:
+            with transaction.atomic():
+                user = User.objects.create_user(
+                    username='view-benchmark', email='view-benchmark@example.com', password='benchmark'
+                )
+                question = Question.objects.create(
+                    title='Hot question', content='Benchmark content', author=user
+                )
+
+                views.view_buffer = InlineViewTracker()
+                before = self.run(question, hits, viewers)
+                self.stdout.write(f'Inline tracking:   {before:,.0f} hits/s')
+
+                QuestionView.objects.filter(question=question).delete()
+                buffer = views.view_buffer = ViewBuffer(flush_interval=0, max_pending=10 ** 9)
+                after = self.run(question, hits, viewers)
+                stored = buffer.flush()
+                self.stdout.write(f'Buffered tracking: {after:,.0f} hits/s ({stored} views flushed in one batch)')
+
+                self.stdout.write(self.style.SUCCESS(f'Speedup: {after / before:.1f}x'))
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            views.view_buffer = original
+
+    def run(self, question, hits, viewers):
+        factory = APIRequestFactory()
+        view = views.QuestionDetailView.as_view()
+        requests = [
+            factory.get(f'/api/questions/{question.pk}/', REMOTE_ADDR=f'10.0.{i // 256}.{i % 256}')
+            for i in range(viewers)
+        ]
+        start = time.perf_counter()
+        for i in range(hits):
+            response = view(requests[i % viewers], pk=question.pk)
+            assert response.status_code == 200
+        return hits / (time.perf_counter() - start)
@@ -0,0 +1,54 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from questions.related import DIM, MAX_DF, Segment, weigh
+
+
+class Command(BaseCommand):
+    help = 'Time top-k related-question lookups on a synthetic index of N questions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--questions', type=int, default=1000000, help='Number of synthetic questions')
+        parser.add_argument('--terms', type=int, default=40, help='Distinct terms per question')
+        parser.add_argument('--queries', type=int, default=200, help='Number of timed lookups')
+        parser.add_argument('--limit', type=int, default=10, help='Results per lookup')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        count, terms = options['questions'], options['terms']
+        random = np.random.default_rng(options['seed'])
+
+        self.stdout.write(f'Building a synthetic index of {count} questions...')
+        started = time.perf_counter()
+        # Zipf-distributed buckets approximate a natural vocabulary
+        features = (random.zipf(1.3, size=count * terms) - 1) % DIM
+        rows = np.repeat(np.arange(count, dtype=np.int64), terms)
+        frequencies = (1 + np.log(random.integers(1, 4, size=count * terms))).astype(np.float32)
+        document_frequency = np.bincount(features, minlength=DIM)
+        idf = (np.log((count + 1) / (document_frequency + 1)) + 1).astype(np.float32)
+        idf[document_frequency > MAX_DF * count] = 0
+        sample_features = features
+        rows, features, weights = weigh(rows, features, frequencies, idf, count)
+        segment = Segment.from_rows(np.arange(1, count + 1), rows, features, weights)
+        self.stdout.write(f'Built in {time.perf_counter() - started:.1f}s ({len(segment.indices)} postings)')
+
+        timings = []
+        for _ in range(options['queries']):
+            row = int(random.integers(count))
+            query_features = (random.zipf(1.3, size=terms) - 1) % DIM
+            # Mix in a few terms of a stored question so lookups have real matches
+            own_features = sample_features[row * terms:row * terms + 5]
+            query_features = np.unique(np.append(query_features, own_features))
+            query_weights = idf[query_features]
+            norm = np.sqrt((query_weights * query_weights).sum()) or 1.0
+            started = time.perf_counter()
+            segment.top(query_features, query_weights / norm, options['limit'])
+            timings.append(time.perf_counter() - started)
+
+        timings = np.array(timings) * 1000
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(timings)} lookups: median {np.median(timings):.2f} ms, '
+            f'p95 {np.percentile(timings, 95):.2f} ms, max {timings.max():.2f} ms'
+        ))
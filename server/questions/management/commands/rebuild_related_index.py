@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from questions.related import COMPACT_AT, related_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the related-questions vector index and fold in appended questions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Number of questions to load per batch'
+        )
+        parser.add_argument(
+            '--compact', action='store_true',
+            help='Only fold the appended questions into the base segment; run this periodically'
+        )
+        parser.add_argument(
+            '--min-entries', type=int, default=COMPACT_AT,
+            help='With --compact, leave deltas with fewer records than this alone'
+        )
+
+    def handle(self, *args, **options):
+        if options['compact']:
+            records = related_index.compact(min_entries=options['min_entries'])
+            self.stdout.write(self.style.SUCCESS(f'Folded {records} delta records into the related-questions index'))
+            return
+        self.stdout.write(f'Rebuilding related-questions index in {related_index.directory}...')
+        
+        indexed = related_index.rebuild(chunk_size=options['chunk_size'], stdout=self.stdout)
+        
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully indexed {indexed} questions')
+        )
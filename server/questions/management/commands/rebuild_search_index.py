@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from questions.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the question full-text search index'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Number of questions to load and index per batch'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding question search index...')
+        
+        indexed = rebuild_index(chunk_size=options['chunk_size'], stdout=self.stdout)
+        
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully indexed {indexed} questions')
+        )
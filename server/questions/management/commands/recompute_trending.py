@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from questions.models import TrendingWindow
+from questions.trending import ensure_windows, recompute_window
+
+
+class Command(BaseCommand):
+    help = 'Recompute trending question scores from votes, views and answers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--window',
+            action='append',
+            help='Only recompute the named window (can be repeated)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Rows to stream per database round trip'
+        )
+
+    def handle(self, *args, **options):
+        ensure_windows()
+        windows = TrendingWindow.objects.all()
+        if options['window']:
+            windows = windows.filter(name__in=options['window'])
+        
+        for window in windows:
+            scored = recompute_window(window, chunk_size=options['chunk_size'])
+            self.stdout.write(f'Window {window.name}: scored {scored} questions')
+        
+        self.stdout.write(self.style.SUCCESS('Successfully recomputed trending scores'))
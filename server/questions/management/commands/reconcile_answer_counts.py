@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Max
+from answers.models import Answer
+from questions.models import Question
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored Question.answer_count from the answers table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Number of question IDs to reconcile per batch'
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_id = Question.objects.aggregate(last=Max('id'))['last'] or 0
+        
+        self.stdout.write('Reconciling question answer counts...')
+        
+        updated_count = 0
+        for start in range(0, last_id + 1, chunk_size):
+            end = start + chunk_size
+            # One GROUP BY per chunk of question IDs
+            actual = dict(
+                Answer.objects.filter(question_id__gte=start, question_id__lt=end)
+                .values('question_id')
+                .annotate(total=Count('id'))
+                .values_list('question_id', 'total')
+            )
+            stale = []
+            for question in Question.objects.filter(id__gte=start, id__lt=end).only('id', 'answer_count'):
+                count = actual.get(question.id, 0)
+                if question.answer_count != count:
+                    question.answer_count = count
+                    stale.append(question)
+            if stale:
+                Question.objects.bulk_update(stale, ['answer_count'])
+                updated_count += len(stale)
+        
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully updated {updated_count} questions')
+        )
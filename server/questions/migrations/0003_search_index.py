@@ -0,0 +1,127 @@
+# Generated by Django 5.2.3 on 2026-10-17 00:03
+
+import re
+from collections import Counter
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils.html import strip_tags
+
+# Frozen copy of questions.search's tokenizer and field weights
+TOKEN_RE = re.compile(r'[a-z0-9][a-z0-9+#._-]*')
+STOP_WORDS = frozenset([
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'how',
+    'i', 'in', 'is', 'it', 'of', 'on', 'or', 'that', 'the', 'this', 'to',
+    'was', 'what', 'when', 'where', 'which', 'why', 'with',
+])
+MAX_TERM_LENGTH = 64
+TITLE_WEIGHT, TAG_WEIGHT, CONTENT_WEIGHT = 3, 2, 1
+CHUNK_SIZE = 500
+
+
+def tokenize(text):
+    tokens = []
+    for token in TOKEN_RE.findall(strip_tags(text or '').lower()):
+        token = token.rstrip('._-')[:MAX_TERM_LENGTH]
+        if token and token not in STOP_WORDS:
+            tokens.append(token)
+    return tokens
+
+
+def build_document(title, content, tag_names):
+    terms = Counter()
+    for token in tokenize(title):
+        terms[token] += TITLE_WEIGHT
+    for tag_name in tag_names:
+        for token in tokenize(tag_name):
+            terms[token] += TAG_WEIGHT
+    for token in tokenize(content):
+        terms[token] += CONTENT_WEIGHT
+    return terms
+
+
+def index_existing_questions(apps, schema_editor):
+    """Index the questions that exist before the search index does, in chunks"""
+    Question = apps.get_model('questions', 'Question')
+    SearchDocument = apps.get_model('questions', 'SearchDocument')
+    SearchPosting = apps.get_model('questions', 'SearchPosting')
+    SearchTerm = apps.get_model('questions', 'SearchTerm')
+
+    document_counts = Counter()
+    questions = Question.objects.only('id', 'title', 'content').prefetch_related('tags').order_by('id')
+    chunk = []
+
+    def index_chunk(chunk):
+        documents = {
+            question.id: build_document(question.title, question.content, [tag.name for tag in question.tags.all()])
+            for question in chunk
+        }
+        terms = {term for document in documents.values() for term in document}
+        SearchTerm.objects.bulk_create([SearchTerm(term=term) for term in terms], ignore_conflicts=True)
+        term_ids = dict(SearchTerm.objects.filter(term__in=terms).values_list('term', 'id'))
+        postings = []
+        for question_id, document in documents.items():
+            length = sum(document.values())
+            SearchDocument.objects.create(question_id=question_id, length=length)
+            for term, frequency in document.items():
+                document_counts[term] += 1
+                postings.append(SearchPosting(
+                    term_id=term_ids[term], question_id=question_id,
+                    frequency=frequency, document_length=length
+                ))
+        SearchPosting.objects.bulk_create(postings, batch_size=1000)
+
+    for question in questions.iterator(chunk_size=CHUNK_SIZE):
+        chunk.append(question)
+        if len(chunk) >= CHUNK_SIZE:
+            index_chunk(chunk)
+            chunk = []
+    if chunk:
+        index_chunk(chunk)
+
+    term_ids = dict(SearchTerm.objects.values_list('term', 'id'))
+    SearchTerm.objects.bulk_update(
+        [SearchTerm(id=term_ids[term], term=term, document_count=count) for term, count in document_counts.items()],
+        ['document_count'],
+        batch_size=CHUNK_SIZE
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questions', '0002_add_accepted_answer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('question', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='questions.question')),
+                ('length', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64, unique=True)),
+                ('document_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchPosting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('frequency', models.PositiveIntegerField(default=0)),
+                ('document_length', models.PositiveIntegerField(default=0)),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_postings', to='questions.question')),
+                ('term', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='postings', to='questions.searchterm')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['question'], name='questions_s_questio_0c59ac_idx')],
+                'unique_together': {('term', 'question')},
+            },
+        ),
+        migrations.RunPython(index_existing_questions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.3 on 2026-10-17 00:06
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_answer_counts(apps, schema_editor):
+    Question = apps.get_model('questions', 'Question')
+    Answer = apps.get_model('answers', 'Answer')
+    counts = (
+        Answer.objects.values('question_id')
+        .annotate(total=models.Count('id'))
+        .values_list('question_id', 'total')
+    )
+    stale = [Question(id=question_id, answer_count=total) for question_id, total in counts.iterator()]
+    Question.objects.bulk_update(stale, ['answer_count'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('answers', '0002_initial'),
+        ('questions', '0003_search_index'),
+        ('tags', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='answer_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['answer_count', 'created_at'], name='questions_q_answer__df81c9_idx'),
+        ),
+        migrations.RunPython(populate_answer_counts, migrations.RunPython.noop),
+    ]
+
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.3 on 2026-10-17 00:09
+
+import django.db.models.deletion
+import django.utils.timezone
+import time
+
+from django.db import migrations, models
+
+
+def create_windows(apps, schema_editor):
+    TrendingWindow = apps.get_model('questions', 'TrendingWindow')
+    now = time.time()
+    for name, duration, half_life in [
+        ('24h', 86400, 6 * 3600),
+        ('7d', 7 * 86400, 36 * 3600),
+        ('30d', 30 * 86400, 6 * 86400),
+    ]:
+        TrendingWindow.objects.get_or_create(
+            name=name, defaults={'duration': duration, 'half_life': half_life, 'epoch': now}
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questions', '0004_question_answer_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingWindow',
+            fields=[
+                ('name', models.CharField(max_length=10, primary_key=True, serialize=False)),
+                ('duration', models.PositiveIntegerField(help_text='Window length in seconds')),
+                ('half_life', models.FloatField(help_text='Score half-life in seconds')),
+                ('epoch', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TrendingScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(default=0)),
+                ('last_event_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trending_scores', to='questions.question')),
+                ('window', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scores', to='questions.trendingwindow')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['window', '-score'], name='questions_t_window__90cd34_idx')],
+                'unique_together': {('window', 'question')},
+            },
+        ),
+        migrations.RunPython(create_windows, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 from tags.models import Tag
 
 User = get_user_model()
@@ -22,6 +23,7 @@ class Question(models.Model):
     downvotes = models.PositiveIntegerField(default=0)
     priority = models.CharField(max_length=10, choices=PRIORITY_CHOICES, default='medium')
     is_answered = models.BooleanField(default=False)
+    answer_count = models.PositiveIntegerField(default=0)
     accepted_answer = models.OneToOneField(
         'answers.Answer', 
         on_delete=models.SET_NULL, 
@@ -38,6 +40,7 @@ class Question(models.Model):
             models.Index(fields=['created_at']),
             models.Index(fields=['views']),
             models.Index(fields=['upvotes']),
+            models.Index(fields=['answer_count', 'created_at']),
         ]
     
     def __str__(self):
@@ -46,10 +49,6 @@ class Question(models.Model):
     @property
     def vote_score(self):
         return self.upvotes - self.downvotes
-    
-    @property
-    def answer_count(self):
-        return self.answers.count()
 
 
 class QuestionView(models.Model):
@@ -76,23 +75,6 @@ class QuestionVote(models.Model):
     
     class Meta:
         unique_together = ['question', 'user']
-    
-    def save(self, *args, **kwargs):
-        # Update question vote counts
-        if self.pk:  # If updating existing vote
-            old_vote = QuestionVote.objects.get(pk=self.pk)
-            if old_vote.vote_type == 'up':
-                self.question.upvotes -= 1
-            else:
-                self.question.downvotes -= 1
-        
-        super().save(*args, **kwargs)
-        
-        if self.vote_type == 'up':
-            self.question.upvotes += 1
-        else:
-            self.question.downvotes += 1
-        self.question.save()
 
 
 class QuestionBookmark(models.Model):
@@ -103,3 +85,65 @@ class QuestionBookmark(models.Model):
     
     class Meta:
         unique_together = ['user', 'question']
+
+
+class SearchTerm(models.Model):
+    """A normalized token in the question search index"""
+    term = models.CharField(max_length=64, unique=True)
+    document_count = models.PositiveIntegerField(default=0)
+
+
+class SearchDocument(models.Model):
+    """Per-question length used for BM25 length normalization"""
+    question = models.OneToOneField(
+        Question,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='search_document'
+    )
+    length = models.PositiveIntegerField(default=0)
+
+
+class SearchPosting(models.Model):
+    """Weighted occurrence of a term in a question's title, content or tags"""
+    term = models.ForeignKey(SearchTerm, on_delete=models.CASCADE, related_name='postings')
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='search_postings')
+    frequency = models.PositiveIntegerField(default=0)
+    document_length = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['term', 'question']
+        indexes = [
+            models.Index(fields=['question']),
+        ]
+
+
+class TrendingWindow(models.Model):
+    """
+    A trending horizon such as 24h or 7d.
+
+    Scores are stored relative to ``epoch`` (unix seconds): an event at time
+    t adds weight * 2 ** ((t - epoch) / half_life), so ordering by the stored
+    score equals ordering by the decayed score at any moment without ever
+    rewriting old rows. The periodic recompute moves the epoch forward.
+    """
+    name = models.CharField(max_length=10, primary_key=True)
+    duration = models.PositiveIntegerField(help_text="Window length in seconds")
+    half_life = models.FloatField(help_text="Score half-life in seconds")
+    epoch = models.FloatField(default=0)
+
+    def __str__(self):
+        return self.name
+
+
+class TrendingScore(models.Model):
+    window = models.ForeignKey(TrendingWindow, on_delete=models.CASCADE, related_name='scores')
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='trending_scores')
+    score = models.FloatField(default=0)
+    last_event_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        unique_together = ['window', 'question']
+        indexes = [
+            models.Index(fields=['window', '-score']),
+        ]
@@ -0,0 +1,512 @@
+"""
+Related questions and possible duplicates from hashed TF-IDF vectors.
+
+Every question is turned into a sparse vector: the field-weighted terms of
+questions.search.build_document() are hashed into DIM buckets, scaled by
+1 + log(tf) and by the bucket's IDF, and L2-normalized. Vectors are stored
+column-wise (bucket -> rows) in .npy files that are opened memory-mapped,
+so a query only touches the postings of its own buckets and the cosine
+scores of all questions come out of a single np.bincount. A segment keeps
+offsets for the buckets it uses only. Buckets present in more than MAX_DF
+of a large corpus are dropped, like stop words.
+
+The index has two segments: ``base``, written by rebuild(), and a small
+``delta`` for questions created or edited since. Like the tag co-occurrence
+delta (tags.cooccurrence), the delta is a raw file of fixed-size
+DELTA_RECORD records that append() only ever appends to once a question's
+transaction commits: a marker record per question, then its weighted
+buckets. Readers load the records appended since they last looked and keep
+the latest rows of each question as an in-memory segment; a delta row
+supersedes the base row of the same question. ``rebuild_related_index
+--compact``, meant to run periodically, folds the delta into a new base
+once it holds COMPACT_AT records; a plain rebuild also refreshes the IDF
+weights.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Question
+from .search import build_document
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are not locked across processes
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DIM_BITS = 20
+DIM = 1 << DIM_BITS
+MAX_DF = 0.1  # drop buckets found in more than this share of questions...
+MAX_DF_MIN_DOCUMENTS = 1000  # ...once the corpus has at least this many
+MANIFEST = 'manifest.json'
+SEGMENT_ARRAYS = ('ids', 'features', 'indptr', 'indices', 'data')
+# A question's delta rows follow a marker record with feature -1, so a
+# question left without buckets still supersedes its base row
+DELTA_RECORD = np.dtype([('id', '<i8'), ('feature', '<i4'), ('weight', '<f4')])
+COMPACT_AT = 100000
+
+_pending = threading.local()
+
+
+def feature(term):
+    """Stable bucket of a term (Python's hash() differs between processes)"""
+    return zlib.crc32(term.encode()) & (DIM - 1)
+
+
+def term_frequencies(title, content, tag_names):
+    """Return (buckets, 1 + log(tf)) arrays for one question"""
+    counts = Counter()
+    for term, weight in build_document(title, content, tag_names).items():
+        counts[feature(term)] += weight
+    features = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    frequencies = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+    return features, 1 + np.log(frequencies)
+
+
+def weigh(rows, features, frequencies, idf, count):
+    """Apply IDF, drop zero weights and L2-normalize each row"""
+    weights = frequencies * (idf[features] if idf is not None else 1.0)
+    keep = weights > 0
+    rows, features, weights = rows[keep], features[keep], weights[keep].astype(np.float32)
+    norms = np.sqrt(np.bincount(rows, weights * weights, minlength=count)).astype(np.float32)
+    return rows, features, weights / norms[rows]
+
+
+class Segment:
+    """
+    Column-oriented sparse matrix over the buckets in use: the rows of bucket
+    features[i] are indices[indptr[i]:indptr[i + 1]], features sorted.
+    """
+
+    def __init__(self, ids, features, indptr, indices, data):
+        self.ids = ids
+        self.features = features
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_rows(cls, ids, rows, features, weights):
+        order = np.argsort(features, kind='stable')
+        used, counts = np.unique(features[order], return_counts=True)
+        indptr = np.zeros(len(used) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        return cls(
+            np.asarray(ids, dtype=np.int64),
+            used.astype(np.int32),
+            indptr,
+            rows[order].astype(np.int32),
+            weights[order].astype(np.float32)
+        )
+
+    def to_rows(self):
+        features = np.repeat(np.asarray(self.features, dtype=np.int64), np.diff(self.indptr))
+        return np.asarray(self.indices, dtype=np.int64), features, np.asarray(self.data)
+
+    @classmethod
+    def load(cls, directory, name):
+        arrays = {}
+        for array in SEGMENT_ARRAYS:
+            path = os.path.join(directory, f'{name}-{array}.npy')
+            if array == 'features' and not os.path.exists(path):
+                continue
+            arrays[array] = np.load(path, mmap_mode='r')
+        if 'features' not in arrays:
+            # Written before segments were compacted: indptr covers all DIM buckets
+            dense = np.asarray(arrays['indptr'])
+            used = np.flatnonzero(np.diff(dense))
+            arrays['features'] = used.astype(np.int32)
+            arrays['indptr'] = np.append(dense[used], dense[-1])
+        return cls(**arrays)
+
+    def save(self, directory, name):
+        for array in SEGMENT_ARRAYS:
+            np.save(os.path.join(directory, f'{name}-{array}.npy'), getattr(self, array))
+
+    def postings(self, features):
+        """(start, end) offsets of the given buckets; empty for buckets not in use"""
+        positions = np.searchsorted(self.features, features)
+        found = positions < len(self.features)
+        found[found] = self.features[positions[found]] == features[found]
+        positions = np.where(found, positions, 0)
+        starts = np.where(found, self.indptr[positions], 0)
+        ends = np.where(found, self.indptr[positions + 1], 0)
+        return starts, ends
+
+    def top(self, features, weights, k, hidden=None):
+        """
+        The k rows with the best positive cosine similarity to a normalized
+        query vector, best first, as (rows, scores). ``hidden`` rows score 0.
+        """
+        starts, ends = self.postings(features)
+        rows, values = [], []
+        for start, end, weight in zip(starts, ends, weights):
+            if end > start:
+                rows.append(self.indices[start:end])
+                values.append(self.data[start:end] * weight)
+        if not rows or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        rows = np.concatenate(rows)
+        scores = np.bincount(rows, np.concatenate(values), minlength=len(self.ids))
+        if hidden is not None and len(hidden):
+            scores[hidden] = 0
+
+        # Only rows sharing a bucket with the query can score, and each occurs
+        # at most once per bucket, so the best k * buckets postings hold the
+        # top k rows; this avoids partitioning the whole score array.
+        take = k * len(features)
+        if take < len(rows):
+            rows = rows[np.argpartition(scores[rows], -take)[-take:]]
+        rows = np.unique(rows)
+        rows = rows[scores[rows] > 0]
+        best = rows[np.argsort(-scores[rows], kind='stable')][:k]
+        return best, scores[best]
+
+
+def to_records(ids, rows, features, weights):
+    """Delta records for weighted rows: each question's marker, then its buckets"""
+    markers = np.arange(len(ids), dtype=np.int64)
+    owners = np.concatenate([markers, rows])
+    order = np.argsort(owners, kind='stable')
+    records = np.empty(len(owners), dtype=DELTA_RECORD)
+    records['id'] = np.asarray(ids, dtype=np.int64)[owners[order]]
+    records['feature'] = np.concatenate([np.full(len(ids), -1), features])[order]
+    records['weight'] = np.concatenate([np.zeros(len(ids)), weights])[order]
+    return records
+
+
+def delta_segment(records):
+    """Segment of the latest rows of every question in delta records, ids sorted"""
+    markers = records['feature'] < 0
+    marker_ids = records['id'][markers]
+    ids, last = np.unique(marker_ids[::-1], return_index=True)
+    # Records belong to the marker before them; keep those of each id's last one
+    owner = np.cumsum(markers) - 1
+    keep = ~markers & np.isin(owner, len(marker_ids) - 1 - last)
+    rows = np.searchsorted(ids, records['id'][keep])
+    return Segment.from_rows(ids, rows, records['feature'][keep].astype(np.int64), records['weight'][keep])
+
+
+def merge(base, delta):
+    """One segment of the base rows not superseded by the delta and the delta rows"""
+    base_rows, base_features, base_weights = base.to_rows()
+    delta_rows, delta_features, delta_weights = delta.to_rows()
+    keep = ~np.isin(base.ids, delta.ids)
+    ids = np.concatenate([np.asarray(base.ids)[keep], np.asarray(delta.ids)])
+    order = np.argsort(ids, kind='stable')
+    position = np.empty(len(ids), dtype=np.int64)
+    position[order] = np.arange(len(ids))
+    renumber = np.full(len(base.ids), -1, dtype=np.int64)
+    renumber[keep] = position[:keep.sum()]
+    entries = keep[base_rows]
+    return Segment.from_rows(
+        ids[order],
+        np.concatenate([renumber[base_rows[entries]], position[keep.sum() + delta_rows]]),
+        np.concatenate([base_features[entries], delta_features]),
+        np.concatenate([base_weights[entries], delta_weights])
+    )
+
+
+def remove_files(directory, name):
+    paths = [os.path.join(directory, f'{name}-{array}.npy') for array in SEGMENT_ARRAYS + ('idf',)]
+    for path in paths + [os.path.join(directory, f'{name}.bin')]:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class RelatedIndex:
+    """Process-wide reader and writer of the on-disk related-questions index"""
+
+    def __init__(self, directory=None):
+        self._directory = directory
+        self._lock = threading.Lock()
+        self._state = None
+        self._state_key = None
+        self._records = None  # delta records in self._state
+        self._delta_read = 0  # bytes of the delta file in self._records
+
+    @property
+    def directory(self):
+        if self._directory is not None:
+            return str(self._directory)
+        return str(getattr(settings, 'RELATED_QUESTIONS_INDEX_DIR', settings.BASE_DIR / 'data' / 'related_questions'))
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, MANIFEST)
+
+    def exists(self):
+        return os.path.exists(self.manifest_path)
+
+    def read_manifest(self):
+        with open(self.manifest_path) as manifest:
+            return json.load(manifest)
+
+    def write_manifest(self, manifest):
+        temporary = f'{self.manifest_path}.{uuid.uuid4().hex}'
+        with open(temporary, 'w') as output:
+            json.dump(manifest, output)
+        os.replace(temporary, self.manifest_path)
+
+    def delta_path(self, name):
+        return os.path.join(self.directory, f'{name}.bin')
+
+    def idf_path(self, name):
+        return os.path.join(self.directory, f'{name}-idf.npy')
+
+    def state(self):
+        """
+        (manifest, idf, base, delta), reloaded whenever the manifest changes
+        and with the delta records appended since
+        """
+        try:
+            stat = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return None
+        key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        with self._lock:
+            if self._state_key != key:
+                manifest = self.read_manifest()
+                idf = base = None
+                if manifest.get('base'):
+                    idf = np.load(self.idf_path(manifest['base']), mmap_mode='r')
+                    base = Segment.load(self.directory, manifest['base'])
+                self._records = np.empty(0, dtype=DELTA_RECORD)
+                legacy = os.path.join(self.directory, f"{manifest.get('delta')}-ids.npy")
+                if manifest.get('delta') and os.path.exists(legacy):
+                    # Written as a segment before the delta became append-only
+                    legacy = Segment.load(self.directory, manifest['delta'])
+                    self._records = to_records(legacy.ids, *legacy.to_rows())
+                self._state, self._state_key, self._delta_read = (manifest, idf, base, None), key, 0
+                if len(self._records):
+                    self._state = (manifest, idf, base, delta_segment(self._records))
+
+            manifest, idf, base, delta = self._state
+            if manifest.get('delta'):
+                try:
+                    size = os.path.getsize(self.delta_path(manifest['delta']))
+                except FileNotFoundError:
+                    size = 0
+                # A record being appended right now is picked up next time
+                size -= size % DELTA_RECORD.itemsize
+                if size > self._delta_read:
+                    with open(self.delta_path(manifest['delta']), 'rb') as delta_file:
+                        delta_file.seek(self._delta_read)
+                        appended = np.frombuffer(delta_file.read(size - self._delta_read), dtype=DELTA_RECORD)
+                    self._records = np.concatenate([self._records, appended])
+                    self._state = (manifest, idf, base, delta_segment(self._records))
+                    self._delta_read = size
+            return self._state
+
+    @contextmanager
+    def write_lock(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # Querying
+
+    def query_vector(self, title, content, tag_names, idf=None):
+        features, frequencies = term_frequencies(title, content, tag_names)
+        rows = np.zeros(len(features), dtype=np.int64)
+        _, features, weights = weigh(rows, features, frequencies, idf, 1)
+        return features, weights
+
+    def search(self, title, content, tag_names, limit, exclude=None, min_score=0.0):
+        """Return up to ``limit`` (question_id, score) pairs, best first"""
+        state = self.state()
+        if state is None:
+            return []
+        manifest, idf, base, delta = state
+        features, weights = self.query_vector(title, content, tag_names, idf)
+        if not len(features):
+            return []
+
+        matches = []
+        if base is not None and len(base):
+            # Rows re-appended to the delta supersede their base rows
+            hidden = np.asarray(delta.ids) if delta is not None else np.empty(0, dtype=np.int64)
+            if exclude is not None:
+                hidden = np.append(hidden, exclude)
+            positions = np.searchsorted(base.ids, hidden)
+            positions = positions[positions < len(base.ids)]
+            positions = positions[np.isin(base.ids[positions], hidden)]
+            rows, scores = base.top(features, weights, limit, hidden=positions)
+            matches.extend(zip(base.ids[rows].tolist(), scores.tolist()))
+        if delta is not None and len(delta):
+            hidden = np.flatnonzero(np.asarray(delta.ids) == exclude) if exclude is not None else None
+            rows, scores = delta.top(features, weights, limit, hidden=hidden)
+            matches.extend(zip(delta.ids[rows].tolist(), scores.tolist()))
+
+        matches.sort(key=lambda match: -match[1])
+        return [match for match in matches if match[1] >= min_score][:limit]
+
+    def related(self, question, limit):
+        """Questions most similar to an existing question"""
+        tag_names = [tag.name for tag in question.tags.all()]
+        return self.search(question.title, question.content, tag_names, limit, exclude=question.id)
+
+    # Writing
+
+    def vectorize(self, questions, idf):
+        """Weighted rows for a list of questions: (ids, rows, features, weights)"""
+        ids, rows, features, frequencies = [], [], [], []
+        for row, question in enumerate(questions):
+            tag_names = [tag.name for tag in question.tags.all()]
+            question_features, question_frequencies = term_frequencies(question.title, question.content, tag_names)
+            ids.append(question.id)
+            rows.append(np.full(len(question_features), row, dtype=np.int64))
+            features.append(question_features)
+            frequencies.append(question_frequencies)
+        if not ids:
+            empty = np.empty(0, dtype=np.int64)
+            return ids, empty, empty, np.empty(0, dtype=np.float32)
+        rows, features, weights = weigh(
+            np.concatenate(rows), np.concatenate(features), np.concatenate(frequencies), idf, len(ids)
+        )
+        return ids, rows, features, weights
+
+    def append(self, question_ids):
+        """Add or replace questions by appending their rows to the delta file"""
+        if not self.exists():
+            return 0
+        questions = list(
+            Question.objects.filter(id__in=question_ids).only('id', 'title', 'content').prefetch_related('tags')
+        )
+        # Held so a concurrent rebuild or compaction cannot drop the records
+        with self.write_lock():
+            manifest = self.read_manifest()
+            idf = np.load(self.idf_path(manifest['base']), mmap_mode='r') if manifest.get('base') else None
+            ids, rows, features, weights = self.vectorize(questions, idf)
+            # Deleted questions get a bare marker, which hides their base rows
+            found = set(ids)
+            ids = ids + [question_id for question_id in question_ids if question_id not in found]
+            if not manifest.get('delta'):
+                # The first append since the base was written names the delta file
+                manifest['delta'] = f'delta-{uuid.uuid4().hex}'
+                self.write_manifest(manifest)
+            with open(self.delta_path(manifest['delta']), 'ab') as delta_file:
+                delta_file.write(to_records(ids, rows, features, weights).tobytes())
+        return len(questions)
+
+    def compact(self, min_entries=None):
+        """
+        Fold the delta into a new base segment, keeping the IDF weights, once
+        it holds at least min_entries (COMPACT_AT) records; returns the
+        records folded.
+        """
+        if min_entries is None:
+            min_entries = COMPACT_AT
+        if not self.exists():
+            return 0
+        with self.write_lock():
+            self._state_key = None
+            manifest, idf, base, delta = self.state()
+            records = len(self._records)
+            if not records or records < min_entries or base is None:
+                return 0
+            name = f'base-{uuid.uuid4().hex}'
+            merge(base, delta).save(self.directory, name)
+            np.save(self.idf_path(name), idf)
+            self.write_manifest({**manifest, 'base': name, 'delta': None})
+            for segment in (manifest['base'], manifest['delta']):
+                remove_files(self.directory, segment)
+            self._state_key = None
+        return records
+
+    def rebuild(self, chunk_size=1000, stdout=None):
+        """Rebuild the base segment and IDF weights from every question"""
+        started_at = timezone.now()
+        last_id = 0
+        ids, rows, features, frequencies = [], [], [], []
+        questions = Question.objects.only('id', 'title', 'content').prefetch_related('tags').order_by('id')
+        for question in questions.iterator(chunk_size=chunk_size):
+            tag_names = [tag.name for tag in question.tags.all()]
+            question_features, question_frequencies = term_frequencies(question.title, question.content, tag_names)
+            rows.append(np.full(len(question_features), len(ids), dtype=np.int32))
+            ids.append(question.id)
+            features.append(question_features.astype(np.int32))
+            frequencies.append(question_frequencies)
+            last_id = question.id
+            if stdout and len(ids) % (chunk_size * 10) == 0:
+                stdout.write(f'Vectorized {len(ids)} questions')
+
+        count = len(ids)
+        if count:
+            rows = np.concatenate(rows).astype(np.int64)
+            features = np.concatenate(features).astype(np.int64)
+            frequencies = np.concatenate(frequencies)
+        else:
+            rows = features = np.empty(0, dtype=np.int64)
+            frequencies = np.empty(0, dtype=np.float32)
+
+        document_frequency = np.bincount(features, minlength=DIM)
+        idf = (np.log((count + 1) / (document_frequency + 1)) + 1).astype(np.float32)
+        if count >= MAX_DF_MIN_DOCUMENTS:
+            idf[document_frequency > MAX_DF * count] = 0
+        rows, features, weights = weigh(rows, features, frequencies, idf, count)
+        base = Segment.from_rows(ids, rows, features, weights)
+
+        with self.write_lock():
+            name = f'base-{uuid.uuid4().hex}'
+            base.save(self.directory, name)
+            np.save(self.idf_path(name), idf)
+            old = self.read_manifest() if self.exists() else {}
+            self.write_manifest({'base': name, 'delta': None, 'built_at': time.time()})
+            for segment in (old.get('base'), old.get('delta')):
+                if segment:
+                    remove_files(self.directory, segment)
+
+        # Questions created or edited while we were reading go to the new delta
+        changed = list(
+            Question.objects.filter(Q(id__gt=last_id) | Q(updated_at__gte=started_at)).values_list('id', flat=True)
+        )
+        if changed:
+            self.append(changed)
+        return count
+
+
+related_index = RelatedIndex()
+
+
+def schedule_append(question_id):
+    """Append a question to the index once the current transaction commits"""
+    pending = getattr(_pending, 'ids', None)
+    if pending is None:
+        pending = _pending.ids = set()
+    pending.add(question_id)
+    transaction.on_commit(lambda: _append_pending(question_id))
+
+
+def _append_pending(question_id):
+    pending = getattr(_pending, 'ids', None)
+    if not pending or question_id not in pending:
+        return
+    pending.discard(question_id)
+    try:
+        related_index.append([question_id])
+    except OSError:
+        logger.exception('Failed to append question %s to the related index', question_id)
@@ -0,0 +1,290 @@
+"""
+Inverted-index full-text search for questions.
+
+Title, content and tag names are tokenized into SearchTerm rows with one
+SearchPosting per (term, question) carrying a field-weighted term frequency.
+Queries look up the postings of their terms only and rank the matching
+questions with BM25 inside the database.
+"""
+import math
+import re
+import threading
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import (
+    Avg, Case, Count, F, FloatField, OuterRef, Subquery, Sum, Value, When
+)
+from django.db.models.functions import Cast
+from django.utils.html import strip_tags
+
+from .models import Question, SearchDocument, SearchPosting, SearchTerm
+
+# Field weights: a title hit is worth more than a tag hit, which is worth
+# more than a body hit.
+TITLE_WEIGHT = 3
+TAG_WEIGHT = 2
+CONTENT_WEIGHT = 1
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+MAX_TERM_LENGTH = 64
+MAX_PREFIX_EXPANSION = 20
+STATS_CACHE_KEY = 'questions:search:stats'
+STATS_CACHE_TIMEOUT = 300
+
+STOP_WORDS = frozenset([
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'how',
+    'i', 'in', 'is', 'it', 'of', 'on', 'or', 'that', 'the', 'this', 'to',
+    'was', 'what', 'when', 'where', 'which', 'why', 'with',
+])
+
+TOKEN_RE = re.compile(r'[a-z0-9][a-z0-9+#._-]*')
+
+_pending = threading.local()
+
+
+def tokenize(text):
+    """Split text into lowercase search tokens, keeping names like c++ or node.js"""
+    tokens = []
+    for token in TOKEN_RE.findall(strip_tags(text or '').lower()):
+        token = token.rstrip('._-')[:MAX_TERM_LENGTH]
+        if token and token not in STOP_WORDS:
+            tokens.append(token)
+    return tokens
+
+
+def build_document(title, content, tag_names):
+    """Return a Counter of field-weighted term frequencies for a question"""
+    terms = Counter()
+    for token in tokenize(title):
+        terms[token] += TITLE_WEIGHT
+    for tag_name in tag_names:
+        for token in tokenize(tag_name):
+            terms[token] += TAG_WEIGHT
+    for token in tokenize(content):
+        terms[token] += CONTENT_WEIGHT
+    return terms
+
+
+def _term_ids(terms):
+    """Get or create SearchTerm rows for the given strings, returning {term: id}"""
+    if not terms:
+        return {}
+    SearchTerm.objects.bulk_create(
+        [SearchTerm(term=term) for term in terms],
+        ignore_conflicts=True
+    )
+    return dict(SearchTerm.objects.filter(term__in=terms).values_list('term', 'id'))
+
+
+def index_question(question):
+    """(Re)index a single question, adjusting document frequencies by delta"""
+    tag_names = list(question.tags.values_list('name', flat=True))
+    document = build_document(question.title, question.content, tag_names)
+    length = sum(document.values())
+
+    with transaction.atomic():
+        old_term_ids = set(
+            SearchPosting.objects.filter(question=question).values_list('term_id', flat=True)
+        )
+        term_ids = _term_ids(list(document))
+        new_term_ids = set(term_ids.values())
+
+        SearchPosting.objects.filter(question=question).delete()
+        SearchPosting.objects.bulk_create([
+            SearchPosting(
+                term_id=term_ids[term],
+                question=question,
+                frequency=frequency,
+                document_length=length
+            )
+            for term, frequency in document.items()
+        ])
+        SearchDocument.objects.update_or_create(question=question, defaults={'length': length})
+
+        removed = old_term_ids - new_term_ids
+        added = new_term_ids - old_term_ids
+        if removed:
+            SearchTerm.objects.filter(id__in=removed).update(document_count=F('document_count') - 1)
+        if added:
+            SearchTerm.objects.filter(id__in=added).update(document_count=F('document_count') + 1)
+
+
+def unindex_question(question_id):
+    """Drop a question's document frequencies before its postings are deleted"""
+    term_ids = list(
+        SearchPosting.objects.filter(question_id=question_id).values_list('term_id', flat=True)
+    )
+    if term_ids:
+        SearchTerm.objects.filter(id__in=term_ids, document_count__gt=0).update(
+            document_count=F('document_count') - 1
+        )
+
+
+def schedule_index(question_id):
+    """
+    Reindex a question once the current transaction commits.
+
+    Saving a question and then adding its tags one by one fires several
+    signals; the pending set makes sure each question is indexed once.
+    """
+    pending = getattr(_pending, 'ids', None)
+    if pending is None:
+        pending = _pending.ids = set()
+    pending.add(question_id)
+    transaction.on_commit(lambda: _index_pending(question_id))
+
+
+def _index_pending(question_id):
+    pending = getattr(_pending, 'ids', None)
+    if not pending or question_id not in pending:
+        return
+    pending.discard(question_id)
+    question = Question.objects.filter(id=question_id).first()
+    if question is not None:
+        index_question(question)
+
+
+def index_stats():
+    """Return (document count, average document length), cached briefly"""
+    stats = cache.get(STATS_CACHE_KEY)
+    if stats is None:
+        aggregate = SearchDocument.objects.aggregate(total=Count('question'), average=Avg('length'))
+        stats = (aggregate['total'] or 0, aggregate['average'] or 0.0)
+        cache.set(STATS_CACHE_KEY, stats, STATS_CACHE_TIMEOUT)
+    return stats
+
+
+def match_terms(query):
+    """
+    Resolve a query to {term_id: document_count}.
+
+    Every token is matched exactly, except the last one while the user is
+    still typing, which is expanded to the most common terms it prefixes.
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return {}
+
+    exact = set(tokens)
+    prefix = None
+    if query and not query[-1].isspace():
+        prefix = tokens[-1]
+
+    matches = dict(
+        SearchTerm.objects.filter(term__in=exact, document_count__gt=0)
+        .values_list('id', 'document_count')
+    )
+    if prefix:
+        expanded = (
+            SearchTerm.objects.filter(term__startswith=prefix, document_count__gt=0)
+            .order_by('-document_count')
+            .values_list('id', 'document_count')[:MAX_PREFIX_EXPANSION]
+        )
+        matches.update(expanded)
+    return matches
+
+
+def search_questions(queryset, query):
+    """
+    Restrict a Question queryset to questions matching ``query``.
+
+    The result is annotated with ``search_rank`` (BM25) so callers can
+    order by relevance.
+    """
+    terms = match_terms(query)
+    if not terms:
+        return queryset.none()
+
+    total, average_length = index_stats()
+    total = max(total, max(terms.values()))
+    average_length = average_length or 1.0
+
+    idf = Case(
+        *[
+            When(term_id=term_id, then=Value(
+                math.log(1 + (total - count + 0.5) / (count + 0.5))
+            ))
+            for term_id, count in terms.items()
+        ],
+        default=Value(0.0),
+        output_field=FloatField()
+    )
+    frequency = Cast('frequency', FloatField())
+    length = Cast('document_length', FloatField())
+    score = idf * frequency * Value(BM25_K1 + 1) / (
+        frequency + Value(BM25_K1) * (Value(1 - BM25_B) + Value(BM25_B) * length / Value(float(average_length)))
+    )
+
+    rank = (
+        SearchPosting.objects.filter(question=OuterRef('pk'), term_id__in=terms.keys())
+        .values('question')
+        .annotate(score=Sum(score, output_field=FloatField()))
+        .values('score')
+    )
+    matching = SearchPosting.objects.filter(term_id__in=terms.keys()).values('question_id')
+
+    return queryset.filter(pk__in=matching).annotate(
+        search_rank=Subquery(rank, output_field=FloatField())
+    )
+
+
+def rebuild_index(chunk_size=500, stdout=None):
+    """Rebuild the whole index, streaming questions in chunks"""
+    SearchPosting.objects.all().delete()
+    SearchDocument.objects.all().delete()
+    SearchTerm.objects.all().delete()
+    cache.delete(STATS_CACHE_KEY)
+
+    document_counts = Counter()
+    indexed = 0
+    questions = Question.objects.only('id', 'title', 'content').prefetch_related('tags').order_by('id')
+    chunk = []
+    for question in questions.iterator(chunk_size=chunk_size):
+        chunk.append(question)
+        if len(chunk) >= chunk_size:
+            indexed += _index_chunk(chunk, document_counts)
+            chunk = []
+            if stdout:
+                stdout.write(f'Indexed {indexed} questions')
+    if chunk:
+        indexed += _index_chunk(chunk, document_counts)
+
+    term_ids = dict(SearchTerm.objects.values_list('term', 'id'))
+    SearchTerm.objects.bulk_update(
+        [SearchTerm(id=term_ids[term], term=term, document_count=count) for term, count in document_counts.items()],
+        ['document_count'],
+        batch_size=chunk_size
+    )
+    return indexed
+
+
+def _index_chunk(questions, document_counts):
+    documents = {}
+    for question in questions:
+        tag_names = [tag.name for tag in question.tags.all()]
+        documents[question.id] = build_document(question.title, question.content, tag_names)
+
+    term_ids = _term_ids(list({term for document in documents.values() for term in document}))
+    postings = []
+    search_documents = []
+    for question_id, document in documents.items():
+        length = sum(document.values())
+        search_documents.append(SearchDocument(question_id=question_id, length=length))
+        for term, frequency in document.items():
+            document_counts[term] += 1
+            postings.append(SearchPosting(
+                term_id=term_ids[term],
+                question_id=question_id,
+                frequency=frequency,
+                document_length=length
+            ))
+
+    with transaction.atomic():
+        SearchDocument.objects.bulk_create(search_documents)
+        SearchPosting.objects.bulk_create(postings, batch_size=1000)
+    return len(documents)
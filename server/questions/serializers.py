@@ -2,9 +2,10 @@ from rest_framework import serializers
 from .models import Question, QuestionVote, QuestionBookmark, QuestionView
 from tags.serializers import TagSerializer
 from auth_app.serializers import UserSerializer
+from common.serializers import ViewerRelation, ViewerStateListSerializer, ViewerStateMixin
 
 
-class QuestionSerializer(serializers.ModelSerializer):
+class QuestionSerializer(ViewerStateMixin, serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     tags = TagSerializer(many=True, read_only=True)
     tag_names = serializers.ListField(
@@ -25,41 +26,34 @@ class QuestionSerializer(serializers.ModelSerializer):
             'is_answered', 'answer_count', 'user_vote', 'is_bookmarked',
             'created_at', 'updated_at'
         ]
-        read_only_fields = ['author', 'views', 'upvotes', 'downvotes', 'is_answered']
+        read_only_fields = ['author', 'views', 'upvotes', 'downvotes', 'is_answered', 'answer_count']
+        list_serializer_class = ViewerStateListSerializer
+    
+    viewer_relations = {
+        'vote': ViewerRelation(QuestionVote, 'question', value='vote_type'),
+        'bookmark': ViewerRelation(QuestionBookmark, 'question'),
+    }
     
     def get_user_vote(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            vote = QuestionVote.objects.filter(question=obj, user=request.user).first()
-            return vote.vote_type if vote else None
-        return None
+        return self.viewer_value('vote', obj)
     
     def get_is_bookmarked(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return QuestionBookmark.objects.filter(question=obj, user=request.user).exists()
-        return False
+        return self.viewer_value('bookmark', obj) is not None
     
     def create(self, validated_data):
         tag_names = validated_data.pop('tag_names', [])
         question = Question.objects.create(**validated_data)
         
-        # Handle tags
+        # Handle tags; the m2m signal maintains Tag.question_count
         if tag_names:
             from tags.models import Tag
-            for tag_name in tag_names:
-                tag, created = Tag.objects.get_or_create(name=tag_name.lower())
-                question.tags.add(tag)
-                if created:
-                    tag.question_count = 1
-                else:
-                    tag.question_count += 1
-                tag.save()
+            tags = [Tag.objects.get_or_create(name=tag_name.lower())[0] for tag_name in tag_names]
+            question.tags.add(*tags)
         
         return question
 
 
-class QuestionListSerializer(serializers.ModelSerializer):
+class QuestionListSerializer(ViewerStateMixin, serializers.ModelSerializer):
     """Lightweight serializer for question lists"""
     author = UserSerializer(read_only=True)
     tags = TagSerializer(many=True, read_only=True)
@@ -73,43 +67,20 @@ class QuestionListSerializer(serializers.ModelSerializer):
             'id', 'title', 'author', 'tags', 'views', 'vote_score',
             'answer_count', 'is_answered', 'is_bookmarked', 'created_at'
         ]
+        list_serializer_class = ViewerStateListSerializer
+    
+    viewer_relations = {
+        'bookmark': ViewerRelation(QuestionBookmark, 'question'),
+    }
     
     def get_is_bookmarked(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return QuestionBookmark.objects.filter(question=obj, user=request.user).exists()
-        return False
+        return self.viewer_value('bookmark', obj) is not None
 
 
 class QuestionVoteSerializer(serializers.ModelSerializer):
     class Meta:
         model = QuestionVote
         fields = ['vote_type']
-    
-    def create(self, validated_data):
-        question = self.context['question']
-        user = self.context['user']
-        
-        # Check if user already voted
-        existing_vote = QuestionVote.objects.filter(question=question, user=user).first()
-        
-        if existing_vote:
-            if existing_vote.vote_type == validated_data['vote_type']:
-                # Same vote type - remove vote
-                existing_vote.delete()
-                return None
-            else:
-                # Different vote type - update vote
-                existing_vote.vote_type = validated_data['vote_type']
-                existing_vote.save()
-                return existing_vote
-        else:
-            # New vote
-            return QuestionVote.objects.create(
-                question=question,
-                user=user,
-                **validated_data
-            )
 
 
 class QuestionBookmarkSerializer(serializers.ModelSerializer):
@@ -0,0 +1,73 @@
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+from common.cache import invalidate_responses
+from common.votes import vote_cast
+from .models import Question, QuestionVote
+from .related import schedule_append
+from .search import schedule_index, unindex_question
+from .trending import get_weight, record_event, record_weights
+
+
+@receiver(post_save, sender=Question)
+def index_saved_question(sender, instance, created, **kwargs):
+    """Keep the search and related-question indexes in sync when a question is created or edited"""
+    schedule_index(instance.pk)
+    schedule_append(instance.pk)
+    if created:
+        record_event(instance.pk, 'question')
+
+
+@receiver(m2m_changed, sender=Question.tags.through)
+def index_retagged_question(sender, instance, action, reverse, pk_set, **kwargs):
+    """Reindex a question when its tags change"""
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+    if not reverse:
+        schedule_index(instance.pk)
+        schedule_append(instance.pk)
+    elif pk_set:
+        for question_id in pk_set:
+            schedule_index(question_id)
+            schedule_append(question_id)
+
+
+@receiver(pre_delete, sender=Question)
+def unindex_deleted_question(sender, instance, **kwargs):
+    """Release document frequencies before the postings cascade away"""
+    unindex_question(instance.pk)
+
+
+@receiver(post_save, sender=QuestionVote)
+def score_question_vote(sender, instance, created, **kwargs):
+    """Feed new votes into the trending scores"""
+    if created:
+        record_event(instance.question_id, 'upvote' if instance.vote_type == 'up' else 'downvote')
+
+
+@receiver(vote_cast, sender=QuestionVote)
+def rescore_changed_vote(sender, target_id, deltas, **kwargs):
+    """Take removed and flipped votes back out of the trending scores"""
+    if not any(delta < 0 for delta in deltas.values()):
+        return  # a new vote, already scored by its post_save
+    record_weights({
+        target_id: deltas['up'] * get_weight('upvote') + deltas['down'] * get_weight('downvote')
+    })
+
+
+@receiver([post_save, post_delete], sender=Question)
+def invalidate_question_responses(sender, **kwargs):
+    """Question lists and tag counts change with every question"""
+    invalidate_responses('questions', 'tags')
+
+
+@receiver(m2m_changed, sender=Question.tags.through)
+def invalidate_retagged_responses(sender, action, **kwargs):
+    """Retagging changes both question lists and tag counts"""
+    if action in ['post_add', 'post_remove', 'post_clear']:
+        invalidate_responses('questions', 'tags')
+
+
+@receiver(vote_cast, sender=QuestionVote)
+def invalidate_voted_responses(sender, **kwargs):
+    """Question lists show vote counts"""
+    invalidate_responses('questions')
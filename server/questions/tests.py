@@ -1,3 +1,611 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings
 
 # Create your tests here.
+from rest_framework.test import APITestCase
+from rest_framework import status
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from io import StringIO
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from answers.models import Answer
+from tags.models import Tag, TagFollow
+from . import views
+from .models import (
+    Question, QuestionBookmark, QuestionView, QuestionVote, SearchPosting, SearchTerm,
+    TrendingScore, TrendingWindow
+)
+from .related import DELTA_RECORD, related_index
+from .search import search_questions, tokenize
+from .trending import ensure_windows, record_event, recompute_window
+from .view_tracking import ViewBuffer
+from .views import question_votes
+
+User = get_user_model()
+
+
+class QuestionSearchTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='asker', email='asker@example.com', password='password123'
+        )
+        self.list_url = reverse('question-list-create')
+
+    def create_question(self, title, content, tags=()):
+        with self.captureOnCommitCallbacks(execute=True):
+            question = Question.objects.create(title=title, content=content, author=self.user)
+            for name in tags:
+                tag, created = Tag.objects.get_or_create(name=name)
+                question.tags.add(tag)
+        return question
+
+    def test_tokenize_keeps_language_names(self):
+        self.assertEqual(
+            tokenize('<p>How to use C++ and node.js with Django?</p>'),
+            ['use', 'c++', 'node.js', 'django']
+        )
+
+    def test_search_ranks_title_matches_first(self):
+        body_match = self.create_question('Deploying apps', 'I deploy django on a server')
+        title_match = self.create_question('Django migrations fail', 'Nothing works')
+        self.create_question('React hooks', 'useEffect runs twice')
+
+        response = self.client.get(self.list_url, {'search': 'django '})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ids = [question['id'] for question in response.data['questions']]
+        self.assertEqual(ids, [title_match.id, body_match.id])
+        self.assertEqual(response.data['count'], 2)
+
+    def test_search_matches_tag_names_and_prefixes(self):
+        tagged = self.create_question('Slow queries', 'Everything is slow', tags=['postgresql'])
+        self.create_question('Other', 'Unrelated text')
+
+        results = search_questions(Question.objects.all(), 'postg')
+        self.assertEqual(list(results.values_list('id', flat=True)), [tagged.id])
+
+    def test_edit_and_delete_keep_document_counts_in_sync(self):
+        question = self.create_question('Flask routing', 'Blueprints question')
+        self.assertEqual(SearchTerm.objects.get(term='flask').document_count, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            question.title = 'FastAPI routing'
+            question.save()
+        self.assertEqual(SearchTerm.objects.get(term='flask').document_count, 0)
+        self.assertEqual(SearchTerm.objects.get(term='fastapi').document_count, 1)
+        self.assertFalse(search_questions(Question.objects.all(), 'flask ').exists())
+
+        question.delete()
+        self.assertEqual(SearchTerm.objects.get(term='fastapi').document_count, 0)
+        self.assertFalse(SearchPosting.objects.exists())
+
+    def test_rebuild_command_indexes_in_chunks(self):
+        for i in range(5):
+            self.create_question(f'Question {i} about caching', 'Redis or memcached')
+        SearchPosting.objects.all().delete()
+        SearchTerm.objects.all().delete()
+
+        out = StringIO()
+        call_command('rebuild_search_index', chunk_size=2, stdout=out)
+        self.assertIn('Successfully indexed 5 questions', out.getvalue())
+        self.assertEqual(SearchTerm.objects.get(term='caching').document_count, 5)
+        self.assertEqual(search_questions(Question.objects.all(), 'redis ').count(), 5)
+
+    def test_rolled_back_save_does_not_stop_indexing(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    Question.objects.create(title='Rolled back', content='Never stored', author=self.user)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        question = self.create_question('Celery retries', 'Tasks fail')
+        self.assertEqual(list(search_questions(Question.objects.all(), 'celery ').values_list('id', flat=True)), [question.id])
+
+
+@override_settings(QUESTION_VIEW_FLUSH_INTERVAL=0)
+class QuestionViewBufferTests(APITestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com', password='password123'
+        )
+        self.viewer = User.objects.create_user(
+            username='viewer', email='viewer@example.com', password='password123'
+        )
+        self.question = Question.objects.create(title='Hot', content='Body', author=self.author)
+        self.buffer = ViewBuffer(flush_interval=0, max_pending=100)
+        self.original_buffer = views.view_buffer
+        views.view_buffer = self.buffer
+        self.detail_url = reverse('question-detail', args=[self.question.id])
+
+    def tearDown(self):
+        views.view_buffer = self.original_buffer
+
+    def assertWrites(self, queries, expected):
+        writes = [
+            query['sql'] for query in queries
+            if query['sql'].split()[0] in ('INSERT', 'UPDATE', 'DELETE')
+        ]
+        self.assertEqual(len(writes), expected, writes)
+
+    def test_read_path_is_write_free(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.detail_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertWrites(queries, 0)
+        self.assertFalse(QuestionView.objects.exists())
+
+    def test_response_includes_pending_views(self):
+        response = self.client.get(self.detail_url, REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.data['data']['views'], 1)
+        response = self.client.get(self.detail_url, REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.data['data']['views'], 1)
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.views, 0)
+
+    def test_flush_aggregates_and_keeps_unique_views(self):
+        QuestionView.objects.create(question=self.question, user=None, ip_address='10.0.0.1')
+        for ip in ['10.0.0.1', '10.0.0.2', '10.0.0.2', '10.0.0.3']:
+            self.buffer.record(self.question.id, None, ip)
+        self.buffer.record(self.question.id, self.viewer.id, '10.0.0.1')
+
+        with CaptureQueriesContext(connection) as queries:
+            stored = self.buffer.flush()
+        # one bulk insert of new views and one UPDATE for all counters
+        self.assertWrites(queries, 2)
+        self.assertEqual(stored, 3)
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.views, 3)
+        self.assertEqual(QuestionView.objects.filter(question=self.question).count(), 4)
+
+        # A fresh process re-recording the same viewers adds nothing
+        other = ViewBuffer(flush_interval=0)
+        other.record(self.question.id, None, '10.0.0.2')
+        other.record(self.question.id, self.viewer.id, '10.0.0.1')
+        self.assertEqual(other.flush(), 0)
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.views, 3)
+
+    def test_flush_skips_deleted_questions(self):
+        self.buffer.record(self.question.id, None, '10.0.0.1')
+        self.question.delete()
+        self.assertEqual(self.buffer.flush(), 0)
+
+
+class QuestionCursorPaginationTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='asker', email='asker@example.com', password='password123'
+        )
+        self.list_url = reverse('question-list-create')
+        # Several questions share vote and view values so tiebreakers matter
+        for i in range(7):
+            Question.objects.create(
+                title=f'Question {i}', content='Body', author=self.user,
+                upvotes=i % 3, views=i % 2
+            )
+
+    def walk(self, params):
+        ids = []
+        cursor = ''
+        while True:
+            response = self.client.get(self.list_url, {**params, 'cursor': cursor, 'page_size': 3})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(question['id'] for question in response.data['questions'])
+            if not response.data['isNext']:
+                self.assertIsNone(response.data['nextCursor'])
+                return ids
+            cursor = response.data['nextCursor']
+
+    def test_cursor_pages_match_page_number_order(self):
+        for sort in ['newest', 'oldest', 'votes', 'views', 'answers']:
+            expected = [
+                question['id'] for question in
+                self.client.get(self.list_url, {'sort': sort, 'page_size': 100}).data['questions']
+            ]
+            self.assertEqual(self.walk({'sort': sort}), expected, sort)
+            self.assertEqual(len(expected), 7)
+
+    def test_cursor_response_has_optional_approximate_total(self):
+        response = self.client.get(self.list_url, {'cursor': ''})
+        self.assertNotIn('count', response.data)
+        response = self.client.get(self.list_url, {'cursor': '', 'total': 'approx'})
+        self.assertEqual(response.data['count'], 7)
+
+    def test_cursor_from_another_sort_is_rejected(self):
+        response = self.client.get(self.list_url, {'sort': 'votes', 'cursor': '', 'page_size': 2})
+        cursor = response.data['nextCursor']
+        response = self.client.get(self.list_url, {'sort': 'views', 'cursor': cursor})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(self.list_url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class QuestionViewerStateTests(APITestCase):
+
+    def setUp(self):
+        self.viewer = User.objects.create_user(
+            username='viewer', email='viewer@example.com', password='password123'
+        )
+        self.author = User.objects.create_user(
+            username='asker', email='asker@example.com', password='password123'
+        )
+        self.tags = [Tag.objects.create(name=f'tag{i}', slug=f'tag{i}') for i in range(3)]
+        TagFollow.objects.create(user=self.viewer, tag=self.tags[0])
+        self.list_url = reverse('question-list-create')
+
+    def create_questions(self, count):
+        for i in range(count):
+            question = Question.objects.create(title=f'Question {i}', content='Body', author=self.author)
+            question.tags.add(*self.tags)
+            if i % 2 == 0:
+                QuestionBookmark.objects.create(user=self.viewer, question=question)
+
+    def count_list_queries(self, page_size):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.list_url, {'page_size': page_size})
+        self.assertEqual(len(response.data['questions']), page_size)
+        return len(queries), response
+
+    def test_page_queries_do_not_grow_with_page_size(self):
+        self.create_questions(100)
+        self.client.force_authenticate(self.viewer)
+
+        small, _ = self.count_list_queries(5)
+        large, response = self.count_list_queries(100)
+        self.assertEqual(small, large)
+        # count, page, tags prefetch, bookmarks, tag follows
+        self.assertLessEqual(large, 5)
+
+        bookmarked = [question['is_bookmarked'] for question in response.data['questions']]
+        self.assertEqual(bookmarked.count(True), 50)
+        following = {
+            tag['name']: tag['is_following'] for tag in response.data['questions'][0]['tags']
+        }
+        self.assertEqual(following, {'tag0': True, 'tag1': False, 'tag2': False})
+
+    def test_detail_reads_vote_and_bookmark(self):
+        self.create_questions(1)
+        question = Question.objects.get()
+        QuestionVote.objects.create(question=question, user=self.viewer, vote_type='up')
+        self.client.force_authenticate(self.viewer)
+
+        response = self.client.get(reverse('question-detail', args=[question.id]))
+        self.assertEqual(response.data['data']['user_vote'], 'up')
+        self.assertTrue(response.data['data']['is_bookmarked'])
+
+
+class TrendingQuestionTests(APITestCase):
+
+    def setUp(self):
+        ensure_windows()
+        self.author = User.objects.create_user(
+            username='asker', email='asker@example.com', password='password123'
+        )
+        self.voters = [
+            User.objects.create_user(username=f'voter{i}', email=f'voter{i}@example.com', password='password123')
+            for i in range(3)
+        ]
+        self.quiet = Question.objects.create(title='Quiet', content='Body', author=self.author)
+        self.busy = Question.objects.create(title='Busy', content='Body', author=self.author)
+        self.python = Tag.objects.create(name='python', slug='python')
+        self.quiet.tags.add(self.python)
+        for voter in self.voters:
+            QuestionVote.objects.create(question=self.busy, user=voter, vote_type='up')
+        Answer.objects.create(question=self.busy, author=self.voters[0], content='Answer')
+        self.url = reverse('trending-questions')
+
+    def result_ids(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [question['id'] for question in response.data['results']]
+
+    def test_events_update_scores_incrementally(self):
+        self.assertEqual(self.result_ids(window='24h'), [self.busy.id, self.quiet.id])
+        self.assertEqual(self.result_ids(window='7d', limit=1), [self.busy.id])
+        self.assertEqual(self.result_ids(tag='python'), [self.quiet.id])
+
+    def test_recompute_matches_incremental_scores(self):
+        window = TrendingWindow.objects.get(name='7d')
+        before = dict(TrendingScore.objects.filter(window=window).values_list('question_id', 'score'))
+        recompute_window(window)
+        after = dict(TrendingScore.objects.filter(window=window).values_list('question_id', 'score'))
+        self.assertEqual(before.keys(), after.keys())
+        for question_id, score in before.items():
+            self.assertAlmostEqual(score, after[question_id], places=2)
+
+    def test_older_events_decay(self):
+        window = TrendingWindow.objects.get(name='24h')
+        # Pretend the epoch is one half-life later: earlier scores are now worth half
+        TrendingWindow.objects.filter(pk=window.pk).update(epoch=window.epoch - window.half_life)
+        record_event(self.quiet.id, 'upvote')
+        scores = dict(TrendingScore.objects.filter(window=window).values_list('question_id', 'score'))
+        self.assertAlmostEqual(scores[self.quiet.id], 1.0 + 3.0 * 2, places=1)
+
+    def test_stale_epochs_are_rebased(self):
+        window = TrendingWindow.objects.get(name='24h')
+        # A year without recompute_trending: 2 ** (365 days / 6h) overflows a double
+        stale = window.epoch - 365 * 86400
+        TrendingWindow.objects.filter(pk=window.pk).update(epoch=stale)
+        record_event(self.quiet.id, 'upvote')
+        window.refresh_from_db()
+        self.assertGreater(window.epoch, stale + 364 * 86400)
+        scores = dict(TrendingScore.objects.filter(window=window).values_list('question_id', 'score'))
+        # Everything recorded under the old epoch is a year old and worth nothing
+        self.assertAlmostEqual(scores[self.quiet.id], 3.0, places=1)
+        self.assertAlmostEqual(scores[self.busy.id], 0.0, places=1)
+
+    def scores(self, window_name):
+        window = TrendingWindow.objects.get(name=window_name)
+        return dict(TrendingScore.objects.filter(window=window).values_list('question_id', 'score'))
+
+    def test_removed_and_flipped_votes_lower_scores(self):
+        # setUp's votes bypassed the vote engine's counters
+        Question.objects.filter(pk=self.busy.pk).update(upvotes=3)
+        before = self.scores('30d')[self.busy.id]
+        question_votes.cast(self.busy.id, self.voters[0], 'up')
+        self.assertAlmostEqual(self.scores('30d')[self.busy.id], before - 3.0, places=1)
+        question_votes.cast(self.busy.id, self.voters[1], 'down')
+        self.assertAlmostEqual(self.scores('30d')[self.busy.id], before - 3.0 - 3.0 - 2.0, places=1)
+
+    def test_endpoint_is_a_fixed_number_of_queries(self):
+        with self.assertNumQueries(3):
+            # window, scores joined with questions and authors, tags prefetch
+            self.client.get(self.url, {'window': '30d', 'limit': 10})
+
+    def test_unknown_window_is_rejected(self):
+        response = self.client.get(self.url, {'window': '1y'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class QuestionVoteTests(APITestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='asker', email='asker@example.com', password='password123'
+        )
+        self.voter = User.objects.create_user(
+            username='voter', email='voter@example.com', password='password123'
+        )
+        self.question = Question.objects.create(title='Votes', content='Body', author=self.author)
+        self.url = reverse('vote-question', args=[self.question.id])
+        self.client.force_authenticate(self.voter)
+
+    def vote(self, vote_type):
+        response = self.client.post(self.url, {'vote_type': vote_type})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_vote_toggle_and_flip(self):
+        data = self.vote('up')
+        self.assertEqual((data['upvotes'], data['downvotes'], data['user_vote']), (1, 0, 'up'))
+
+        data = self.vote('down')
+        self.assertEqual((data['upvotes'], data['downvotes'], data['user_vote']), (0, 1, 'down'))
+        self.assertEqual(data['vote_score'], -1)
+
+        data = self.vote('down')
+        self.assertEqual((data['upvotes'], data['downvotes'], data['user_vote']), (0, 0, None))
+        self.assertFalse(QuestionVote.objects.exists())
+
+        self.question.refresh_from_db()
+        self.assertEqual((self.question.upvotes, self.question.downvotes), (0, 0))
+
+    def test_vote_only_updates_counter_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.vote('up')
+        updates = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('UPDATE "questions_question"')
+        ]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"upvotes"', updates[0])
+        self.assertNotIn('"content"', updates[0])
+
+    def test_cannot_vote_on_own_question(self):
+        self.client.force_authenticate(self.author)
+        response = self.client.post(self.url, {'vote_type': 'up'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+def supports_concurrent_writes():
+    """SQLite only serializes writers safely with BEGIN IMMEDIATE transactions"""
+    if connection.vendor != 'sqlite':
+        return True
+    return connection.settings_dict['OPTIONS'].get('transaction_mode') == 'IMMEDIATE'
+
+
+@unittest.skipUnless(supports_concurrent_writes(), 'database does not support concurrent writers')
+class QuestionVoteConcurrencyTests(TransactionTestCase):
+
+    def test_concurrent_votes_keep_exact_counts(self):
+        author = User.objects.create_user(
+            username='asker', email='asker@example.com', password='password123'
+        )
+        question = Question.objects.create(title='Hot', content='Body', author=author)
+        voters = [
+            User.objects.create_user(username=f'voter{i}', email=f'voter{i}@example.com', password='password123')
+            for i in range(24)
+        ]
+        # Every voter upvotes; a third then flip to down and a third toggle off
+        plans = [['up'], ['up', 'down'], ['up', 'up']] * 8
+        barrier = threading.Barrier(len(voters))
+        errors = []
+
+        def run(voter, plan):
+            try:
+                barrier.wait()
+                for vote_type in plan:
+                    question_votes.cast(question.id, voter, vote_type)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=pair) for pair in zip(voters, plans)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        question.refresh_from_db()
+        self.assertEqual(question.upvotes, 8)
+        self.assertEqual(question.downvotes, 8)
+        self.assertEqual(QuestionVote.objects.filter(question=question, vote_type='up').count(), 8)
+        self.assertEqual(QuestionVote.objects.filter(question=question, vote_type='down').count(), 8)
+
+
+@unittest.skipUnless(supports_concurrent_writes(), 'database does not support concurrent writers')
+class QuestionViewConcurrencyTests(TransactionTestCase):
+
+    def test_concurrent_flushes_count_each_view_once(self):
+        author = User.objects.create_user(
+            username='asker', email='asker@example.com', password='password123'
+        )
+        question = Question.objects.create(title='Hot', content='Body', author=author)
+        # Several processes saw the same viewers and flush at once
+        buffers = [ViewBuffer(flush_interval=0) for _ in range(6)]
+        for buffer in buffers:
+            for ip in ['10.0.0.1', '10.0.0.2', '10.0.0.3']:
+                buffer.record(question.id, None, ip)
+        barrier = threading.Barrier(len(buffers))
+        errors = []
+
+        def run(buffer):
+            try:
+                barrier.wait()
+                buffer.flush()
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(buffer,)) for buffer in buffers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        question.refresh_from_db()
+        self.assertEqual(question.views, 3)
+        self.assertEqual(QuestionView.objects.filter(question=question).count(), 3)
+
+
+class RelatedQuestionTests(APITestCase):
+
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.index_dir)
+        settings_override = override_settings(RELATED_QUESTIONS_INDEX_DIR=self.index_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.author = User.objects.create_user(
+            username='asker', email='asker@example.com', password='password123'
+        )
+        self.python = Tag.objects.create(name='python', slug='python')
+        self.target = self.create_question(
+            'How to merge two dictionaries in python', 'I want to merge dict objects into one dictionary.', [self.python]
+        )
+        self.similar = self.create_question(
+            'Merge python dictionaries', 'What is the best way to merge two dictionaries?', [self.python]
+        )
+        self.unrelated = self.create_question(
+            'Centering a div with flexbox', 'My css layout does not center the div.'
+        )
+        call_command('rebuild_related_index', stdout=StringIO())
+
+    def create_question(self, title, content, tags=()):
+        with self.captureOnCommitCallbacks(execute=True):
+            question = Question.objects.create(title=title, content=content, author=self.author)
+            question.tags.add(*tags)
+        return question
+
+    def related_ids(self, question):
+        response = self.client.get(reverse('related-questions', args=[question.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [result['id'] for result in response.data['results']]
+
+    def test_related_ranks_similar_questions(self):
+        response = self.client.get(reverse('related-questions', args=[self.target.id]))
+        results = response.data['results']
+        self.assertEqual(results[0]['id'], self.similar.id)
+        self.assertNotIn(self.target.id, [result['id'] for result in results])
+        self.assertGreater(results[0]['similarity'], 0.3)
+
+    def test_new_questions_are_appended(self):
+        newer = self.create_question('Python merge dictionaries with unpacking', 'merge two dictionaries', [self.python])
+        manifest = related_index.read_manifest()
+        self.assertIsNotNone(manifest['delta'])
+        self.assertIn(newer.id, self.related_ids(self.target))
+
+        # Later questions are appended to the same file as whole records
+        delta_path = related_index.delta_path(manifest['delta'])
+        size = os.path.getsize(delta_path)
+        latest = self.create_question('Merging dictionaries', 'python dict merge', [self.python])
+        self.assertEqual(related_index.read_manifest(), manifest)
+        self.assertGreater(os.path.getsize(delta_path), size)
+        self.assertEqual(os.path.getsize(delta_path) % DELTA_RECORD.itemsize, 0)
+        self.assertIn(latest.id, self.related_ids(self.target))
+        self.assertEqual(list(related_index.state()[3].ids), [newer.id, latest.id])
+
+    def test_compaction_folds_delta_into_base(self):
+        newer = self.create_question('Dictionary merge in python', 'merge dictionaries', [self.python])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.similar.title = 'Flexbox div centering'
+            self.similar.content = 'center a div with css flexbox'
+            self.similar.save()
+            self.similar.tags.clear()
+        manifest = related_index.read_manifest()
+
+        call_command('rebuild_related_index', '--compact', stdout=StringIO())
+        self.assertEqual(related_index.read_manifest(), manifest)
+
+        call_command('rebuild_related_index', '--compact', '--min-entries', '1', stdout=StringIO())
+        compacted = related_index.read_manifest()
+        self.assertIsNone(compacted['delta'])
+        self.assertNotEqual(compacted['base'], manifest['base'])
+        self.assertFalse(os.path.exists(related_index.delta_path(manifest['delta'])))
+        base = related_index.state()[2]
+        self.assertEqual(list(base.ids), sorted([self.target.id, self.similar.id, self.unrelated.id, newer.id]))
+        self.assertEqual(self.related_ids(self.target)[0], newer.id)
+        self.assertNotIn(self.similar.id, self.related_ids(self.target))
+        self.assertEqual(self.related_ids(self.unrelated), [self.similar.id])
+
+    def test_edits_supersede_base_rows(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.similar.title = 'Flexbox div centering'
+            self.similar.content = 'center a div with css flexbox'
+            self.similar.save()
+            self.similar.tags.clear()
+        self.assertNotIn(self.similar.id, self.related_ids(self.target))
+        self.assertEqual(self.related_ids(self.unrelated), [self.similar.id])
+
+    def test_rebuild_folds_delta_into_base(self):
+        newer = self.create_question('Dictionary merge in python', 'merge dictionaries', [self.python])
+        call_command('rebuild_related_index', stdout=StringIO())
+        self.assertIsNone(related_index.read_manifest()['delta'])
+        self.assertIn(newer.id, self.related_ids(self.target))
+
+    def test_duplicate_suggestions_while_typing(self):
+        response = self.client.get(
+            reverse('duplicate-questions'), {'title': 'merge two python dictionaries', 'tags': 'python'}
+        )
+        ids = [result['id'] for result in response.data['results']]
+        self.assertEqual(set(ids), {self.target.id, self.similar.id})
+        response = self.client.get(reverse('duplicate-questions'), {'title': 'rust borrow checker'})
+        self.assertEqual(response.data['results'], [])
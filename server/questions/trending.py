@@ -0,0 +1,179 @@
+"""
+Materialized, exponentially decayed trending scores.
+
+Every vote, view, answer and new question adds a weighted amount to the
+question's TrendingScore row in each window. Scores are anchored at the
+window's epoch (see TrendingWindow), so an event is a single UPDATE with an
+F() increment and reading the top questions is an index scan on
+(window, -score). recompute_window() rebuilds a window from the source
+tables and moves its epoch forward so the stored numbers stay small.
+Without it, record_weights() rebases a window itself once its growth
+factor passes 2**MAX_GROWTH_EXPONENT, scaling its scores down to a new
+epoch in one UPDATE, so the factor never overflows.
+"""
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, FloatField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Power
+from django.utils import timezone
+
+from answers.models import Answer
+from .models import Question, QuestionView, QuestionVote, TrendingScore, TrendingWindow
+
+DEFAULT_WINDOWS = {
+    # name: (duration, half-life) in seconds
+    '24h': (86400, 6 * 3600),
+    '7d': (7 * 86400, 36 * 3600),
+    '30d': (30 * 86400, 6 * 86400),
+}
+
+DEFAULT_WEIGHTS = {
+    'question': 1.0,
+    'view': 0.5,
+    'upvote': 3.0,
+    'downvote': -2.0,
+    'answer': 5.0,
+}
+
+MAX_GROWTH_EXPONENT = 32
+
+
+def get_weight(kind):
+    weights = getattr(settings, 'TRENDING_WEIGHTS', DEFAULT_WEIGHTS)
+    return weights.get(kind, DEFAULT_WEIGHTS[kind])
+
+
+def ensure_windows():
+    """Create any configured window that has no row yet"""
+    windows = getattr(settings, 'TRENDING_WINDOWS', DEFAULT_WINDOWS)
+    now = time.time()
+    TrendingWindow.objects.bulk_create(
+        [
+            TrendingWindow(name=name, duration=duration, half_life=half_life, epoch=now)
+            for name, (duration, half_life) in windows.items()
+        ],
+        ignore_conflicts=True
+    )
+
+
+def record_event(question_id, kind, count=1):
+    """Add ``count`` events of ``kind`` ('view', 'upvote', ...) to a question"""
+    record_weights({question_id: get_weight(kind) * count})
+
+
+def record_weights(weights):
+    """
+    Add undecayed weights to several questions in every window.
+
+    One INSERT creates missing rows and one UPDATE applies all increments;
+    the decay factor is computed in SQL from each window's current epoch.
+    """
+    weights = {question_id: weight for question_id, weight in weights.items() if weight}
+    if not weights:
+        return
+    windows = list(TrendingWindow.objects.values_list('name', 'epoch', 'half_life'))
+    if not windows:
+        return
+    now = time.time()
+    for name, epoch, half_life in windows:
+        if (now - epoch) / half_life > MAX_GROWTH_EXPONENT:
+            rebase_window(name, now)
+    window_names = [name for name, _, _ in windows]
+
+    window = TrendingWindow.objects.filter(name=OuterRef('window_id'))
+    growth = Power(
+        Value(2.0),
+        (Value(now) - Subquery(window.values('epoch')[:1], output_field=FloatField()))
+        / Subquery(window.values('half_life')[:1], output_field=FloatField())
+    )
+    increment = Case(
+        *[When(question_id=question_id, then=Value(float(weight))) for question_id, weight in weights.items()],
+        default=Value(0.0),
+        output_field=FloatField()
+    )
+
+    with transaction.atomic():
+        TrendingScore.objects.bulk_create(
+            [
+                TrendingScore(window_id=name, question_id=question_id)
+                for name in window_names for question_id in weights
+            ],
+            ignore_conflicts=True
+        )
+        TrendingScore.objects.filter(question_id__in=weights.keys()).update(
+            score=F('score') + increment * growth,
+            last_event_at=timezone.now()
+        )
+
+
+def rebase_window(name, epoch):
+    """Re-anchor a window's stored scores at a later epoch without changing their ranking"""
+    with transaction.atomic():
+        window = TrendingWindow.objects.select_for_update().filter(name=name).first()
+        if window is None or window.epoch >= epoch:
+            return
+        factor = 2 ** ((window.epoch - epoch) / window.half_life)
+        TrendingScore.objects.filter(window=window).update(score=F('score') * factor)
+        TrendingWindow.objects.filter(pk=window.pk).update(epoch=epoch)
+
+
+def trending_scores(window, limit, tag=None):
+    """Top TrendingScore rows with active questions for a window, optionally for one tag"""
+    since = timezone.now() - timedelta(seconds=window.duration)
+    scores = TrendingScore.objects.filter(window=window, last_event_at__gte=since)
+    if tag is not None:
+        scores = scores.filter(question__tags=tag)
+    return scores.select_related('question__author__activity').prefetch_related(
+        'question__tags'
+    ).order_by('-score')[:limit]
+
+
+def recompute_window(window, chunk_size=2000):
+    """Rebuild one window from the source tables with a fresh epoch"""
+    epoch = time.time()
+    since = timezone.now() - timedelta(seconds=window.duration)
+    scores = defaultdict(float)
+    latest = {}
+
+    def add(rows, weight_for):
+        for question_id, created_at, *extra in rows.iterator(chunk_size=chunk_size):
+            age = created_at.timestamp() - epoch
+            scores[question_id] += weight_for(*extra) * 2 ** (age / window.half_life)
+            if question_id not in latest or latest[question_id] < created_at:
+                latest[question_id] = created_at
+
+    add(
+        Question.objects.filter(created_at__gte=since).values_list('id', 'created_at'),
+        lambda: get_weight('question')
+    )
+    add(
+        QuestionView.objects.filter(created_at__gte=since).values_list('question_id', 'created_at'),
+        lambda: get_weight('view')
+    )
+    add(
+        QuestionVote.objects.filter(created_at__gte=since).values_list('question_id', 'created_at', 'vote_type'),
+        lambda vote_type: get_weight('upvote' if vote_type == 'up' else 'downvote')
+    )
+    add(
+        Answer.objects.filter(created_at__gte=since).values_list('question_id', 'created_at'),
+        lambda: get_weight('answer')
+    )
+
+    with transaction.atomic():
+        TrendingWindow.objects.filter(pk=window.pk).update(epoch=epoch)
+        TrendingScore.objects.filter(window=window).delete()
+        TrendingScore.objects.bulk_create(
+            [
+                TrendingScore(
+                    window=window, question_id=question_id, score=score, last_event_at=latest[question_id]
+                )
+                for question_id, score in scores.items()
+            ],
+            batch_size=chunk_size
+        )
+    window.epoch = epoch
+    return len(scores)
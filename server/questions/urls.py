@@ -6,6 +6,8 @@ urlpatterns = [
     path('<int:pk>/', views.QuestionDetailView.as_view(), name='question-detail'),
     path('<int:question_id>/vote/', views.vote_question, name='vote-question'),
     path('<int:question_id>/bookmark/', views.bookmark_question, name='bookmark-question'),
+    path('<int:pk>/related/', views.related_questions, name='related-questions'),
+    path('duplicates/', views.duplicate_questions, name='duplicate-questions'),
     path('my-questions/', views.user_questions, name='user-questions'),
     path('my-bookmarks/', views.user_bookmarks, name='user-bookmarks'),
     path('trending/', views.trending_questions, name='trending-questions'),
@@ -0,0 +1,186 @@
+"""
+Write-behind view counting for questions.
+
+Viewing a question only records an event in process memory. Events are
+deduplicated per (question, user, ip) and flushed periodically: one query
+to find which views are already stored, one bulk insert of new QuestionView
+rows and a single UPDATE adding the per-question increments to
+Question.views.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Case, F, Q, Value, When
+
+from .models import Question, QuestionView
+from .trending import get_weight, record_weights
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_INTERVAL = 10  # seconds
+DEFAULT_MAX_PENDING = 1000
+DEFAULT_SEEN_SIZE = 100000
+
+
+class ViewBuffer:
+    """Per-process buffer of question view events"""
+
+    def __init__(self, flush_interval=None, max_pending=None, seen_size=None):
+        self._flush_interval = flush_interval
+        self._max_pending = max_pending
+        self._seen_size = seen_size
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = defaultdict(set)
+        self._pending_total = 0
+        self._seen = OrderedDict()
+        self._timer = None
+
+    @property
+    def flush_interval(self):
+        if self._flush_interval is not None:
+            return self._flush_interval
+        return getattr(settings, 'QUESTION_VIEW_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+
+    @property
+    def max_pending(self):
+        if self._max_pending is not None:
+            return self._max_pending
+        return getattr(settings, 'QUESTION_VIEW_MAX_PENDING', DEFAULT_MAX_PENDING)
+
+    @property
+    def seen_size(self):
+        if self._seen_size is not None:
+            return self._seen_size
+        return getattr(settings, 'QUESTION_VIEW_SEEN_SIZE', DEFAULT_SEEN_SIZE)
+
+    def record(self, question_id, user_id, ip_address):
+        """Record a view; returns False if this viewer was already counted recently"""
+        key = (question_id, user_id, ip_address)
+        with self._lock:
+            if key in self._seen:
+                self._seen.move_to_end(key)
+                return False
+            self._seen[key] = True
+            if len(self._seen) > self.seen_size:
+                self._seen.popitem(last=False)
+            self._pending[question_id].add((user_id, ip_address))
+            self._pending_total += 1
+            should_flush = self._pending_total >= self.max_pending
+        self._start_timer()
+        if should_flush:
+            self.flush()
+        return True
+
+    def pending_views(self, question_id):
+        """Number of views recorded for a question but not yet flushed"""
+        with self._lock:
+            return len(self._pending.get(question_id, ()))
+
+    def flush(self):
+        """Persist buffered views; returns the number of new views stored"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, defaultdict(set)
+                self._pending_total = 0
+            if not pending:
+                return 0
+            try:
+                return self._write(pending)
+            except Exception:
+                # Put the events back so the next flush retries them
+                with self._lock:
+                    for question_id, viewers in pending.items():
+                        self._pending[question_id] |= viewers
+                        self._pending_total += len(viewers)
+                raise
+
+    def _write(self, pending):
+        with transaction.atomic():
+            # Lock the questions before looking for stored views: a concurrent
+            # flush of the same viewers waits here, then finds this one's rows
+            # and does not count them again
+            existing_ids = set(
+                Question.objects.select_for_update().filter(id__in=pending.keys())
+                .order_by('id').values_list('id', flat=True)
+            )
+            viewer_filter = Q()
+            for question_id, viewers in pending.items():
+                if question_id in existing_ids:
+                    viewer_filter |= Q(
+                        question_id=question_id,
+                        ip_address__in={ip for _, ip in viewers}
+                    )
+            if not viewer_filter:
+                return 0
+
+            stored = set(
+                QuestionView.objects.filter(viewer_filter)
+                .values_list('question_id', 'user_id', 'ip_address')
+            )
+
+            new_views = []
+            increments = defaultdict(int)
+            for question_id, viewers in pending.items():
+                if question_id not in existing_ids:
+                    continue
+                for user_id, ip_address in viewers:
+                    if (question_id, user_id, ip_address) in stored:
+                        continue
+                    new_views.append(QuestionView(
+                        question_id=question_id,
+                        user_id=user_id,
+                        ip_address=ip_address
+                    ))
+                    increments[question_id] += 1
+
+            if not new_views:
+                return 0
+
+            QuestionView.objects.bulk_create(new_views, ignore_conflicts=True)
+            Question.objects.filter(id__in=increments.keys()).update(
+                views=F('views') + Case(
+                    *[When(id=question_id, then=Value(count)) for question_id, count in increments.items()],
+                    default=Value(0)
+                )
+            )
+            record_weights({
+                question_id: count * get_weight('view') for question_id, count in increments.items()
+            })
+        return len(new_views)
+
+    def _start_timer(self):
+        if self._timer is not None or self.flush_interval <= 0:
+            return
+        with self._lock:
+            if self._timer is not None:
+                return
+            self._timer = threading.Thread(
+                target=self._run, name='question-view-flush', daemon=True
+            )
+            self._timer.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                close_old_connections()
+                self.flush()
+            except Exception:
+                logger.exception('Failed to flush question views')
+
+
+view_buffer = ViewBuffer()
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        view_buffer.flush()
+    except Exception:
+        logger.exception('Failed to flush question views on exit')
@@ -3,16 +3,27 @@ from rest_framework import status, permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.pagination import PageNumberPagination
-from django.db.models import Q, F, Count
+from django.conf import settings
+from django.db.models import F
 from django.shortcuts import get_object_or_404
-from django.utils import timezone
-
-from .models import Question, QuestionVote, QuestionBookmark, QuestionView
+from django.utils.decorators import method_decorator
+from common.cache import cache_response
+from common.pagination import KeysetPagination
+from common.votes import VoteEngine
+from tags.models import Tag
+from tags.postings import MATCH_ALL, MATCH_ANY, MATCH_MODES, filter_questions_by_tags
+from .models import Question, QuestionVote, QuestionBookmark, TrendingWindow
+from .related import related_index
+from .search import search_questions
+from .trending import trending_scores
+from .view_tracking import view_buffer
 from .serializers import (
     QuestionSerializer, QuestionListSerializer, QuestionVoteSerializer,
     QuestionBookmarkSerializer
 )
 
+question_votes = VoteEngine(QuestionVote, 'question')
+
 
 class QuestionPagination(PageNumberPagination):
     page_size = 20
@@ -23,31 +34,35 @@ class QuestionPagination(PageNumberPagination):
 class QuestionListCreateView(APIView):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     
+    @method_decorator(cache_response('questions'))
     def get(self, request):
         """List questions with filtering and pagination"""
-        queryset = Question.objects.select_related('author').prefetch_related('tags')
+        queryset = Question.objects.select_related('author__activity').prefetch_related('tags')
         
         # Search functionality
         search = request.query_params.get('search', '')
         if search:
-            queryset = queryset.filter(
-                Q(title__icontains=search) | 
-                Q(content__icontains=search) |
-                Q(tags__name__icontains=search)
-            ).distinct()
+            queryset = search_questions(queryset, search)
         
-        # Filter by tags (support both tag IDs and tag names)
+        # Filter by tags (support both tag IDs and tag names); match=all|any|not
         tags = request.query_params.get('tags', '')
         if tags:
-            tag_list = tags.split(',')
+            match = request.query_params.get('match', MATCH_ANY)
+            if match not in MATCH_MODES:
+                return Response(
+                    {'error': f"match must be one of: {', '.join(MATCH_MODES)}."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            tag_list = [tag.strip() for tag in tags.split(',') if tag.strip()]
             # Check if the tags are numeric (IDs) or text (names)
             try:
-                # Try to convert to integers (tag IDs)
-                tag_ids = [int(tag.strip()) for tag in tag_list]
-                queryset = queryset.filter(tags__id__in=tag_ids).distinct()
+                tag_ids = [int(tag) for tag in tag_list]
             except ValueError:
-                # If not numeric, treat as tag names
-                queryset = queryset.filter(tags__name__in=tag_list).distinct()
+                found = dict(Tag.objects.filter(name__in=tag_list).values_list('name', 'id'))
+                if match == MATCH_ALL and len(found) < len(set(tag_list)):
+                    queryset = queryset.none()
+                tag_ids = list(found.values())
+            queryset = filter_questions_by_tags(queryset, tag_ids, match)
         
         # Filter by answered status
         answered = request.query_params.get('answered', '')
@@ -56,26 +71,40 @@ class QuestionListCreateView(APIView):
         elif answered.lower() == 'false':
             queryset = queryset.filter(is_answered=False)
         
-        # Sorting
-        sort_by = request.query_params.get('sort', 'newest')
-        if sort_by == 'oldest':
-            queryset = queryset.order_by('created_at')
+        # Sorting; every ordering ends with the primary key so it is stable
+        sort_by = request.query_params.get('sort', 'relevance' if search else 'newest')
+        if sort_by == 'relevance' and search:
+            ordering = ['-search_rank', '-created_at', '-id']
+        elif sort_by == 'oldest':
+            ordering = ['created_at', 'id']
         elif sort_by == 'votes':
-            queryset = queryset.annotate(
-                vote_score=F('upvotes') - F('downvotes')
-            ).order_by('-vote_score', '-created_at')
+            queryset = queryset.annotate(net_votes=F('upvotes') - F('downvotes'))
+            ordering = ['-net_votes', '-created_at', '-id']
         elif sort_by == 'views':
-            queryset = queryset.order_by('-views', '-created_at')
+            ordering = ['-views', '-created_at', '-id']
         elif sort_by == 'answers':
-            queryset = queryset.annotate(
-                answer_count=Count('answers')
-            ).order_by('-answer_count', '-created_at')
+            ordering = ['-answer_count', '-created_at', '-id']
         else:  # newest
-            queryset = queryset.order_by('-created_at')
+            ordering = ['-created_at', '-id']
+        
+        # Keyset pagination on request; relevance scores are not stable enough for cursors
+        if KeysetPagination.is_requested(request) and ordering[0] != '-search_rank':
+            paginator = KeysetPagination(ordering)
+            page = paginator.paginate_queryset(queryset, request)
+            serializer = QuestionListSerializer(page, many=True, context={'request': request})
+            response = {
+                'success': True,
+                'questions': serializer.data,
+                'isNext': paginator.has_next,
+                'nextCursor': paginator.next_cursor,
+            }
+            if paginator.total is not None:
+                response['count'] = paginator.total
+            return Response(response)
         
         # Pagination
         paginator = QuestionPagination()
-        page = paginator.paginate_queryset(queryset, request)
+        page = paginator.paginate_queryset(queryset.order_by(*ordering), request)
         
         serializer = QuestionListSerializer(page, many=True, context={'request': request})
         paginated_response = paginator.get_paginated_response(serializer.data)
@@ -107,29 +136,18 @@ class QuestionDetailView(APIView):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     
     def get_object(self, pk):
-        """Get question object and track view"""
+        """Get question object"""
         try:
-            obj = Question.objects.select_related('author').prefetch_related('tags', 'answers__author').get(pk=pk)
-            
-            # Track view if user is authenticated or by IP
-            user = self.request.user if self.request.user.is_authenticated else None
-            ip_address = self.get_client_ip()
-            
-            view_obj, created = QuestionView.objects.get_or_create(
-                question=obj,
-                user=user,
-                ip_address=ip_address
-            )
-            
-            if created:
-                obj.views = F('views') + 1
-                obj.save(update_fields=['views'])
-                obj.refresh_from_db()
-            
-            return obj
+            return Question.objects.select_related('author').prefetch_related('tags', 'answers__author').get(pk=pk)
         except Question.DoesNotExist:
             return None
     
+    def track_view(self, question):
+        """Buffer a view of the question; counts are flushed in the background"""
+        user_id = self.request.user.id if self.request.user.is_authenticated else None
+        view_buffer.record(question.id, user_id, self.get_client_ip())
+        question.views += view_buffer.pending_views(question.id)
+    
     def get_client_ip(self):
         x_forwarded_for = self.request.META.get('HTTP_X_FORWARDED_FOR')
         if x_forwarded_for:
@@ -147,6 +165,7 @@ class QuestionDetailView(APIView):
                 status=status.HTTP_404_NOT_FOUND
             )
         
+        self.track_view(question)
         serializer = QuestionSerializer(question, context={'request': request})
         return Response({
             'success': True,
@@ -212,30 +231,26 @@ class QuestionDetailView(APIView):
 @permission_classes([permissions.IsAuthenticated])
 def vote_question(request, question_id):
     """Vote on a question"""
-    question = get_object_or_404(Question, id=question_id)
+    question = get_object_or_404(Question.objects.only('id', 'author_id'), id=question_id)
     
     # Users cannot vote on their own questions
-    if question.author == request.user:
+    if question.author_id == request.user.id:
         return Response(
             {'error': 'You cannot vote on your own question.'}, 
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    serializer = QuestionVoteSerializer(
-        data=request.data,
-        context={'question': question, 'user': request.user}
-    )
+    serializer = QuestionVoteSerializer(data=request.data)
     
     if serializer.is_valid():
-        vote = serializer.save()
-        question.refresh_from_db()
+        result = question_votes.cast(question.id, request.user, serializer.validated_data['vote_type'])
         
         return Response({
             'message': 'Vote recorded successfully.',
-            'upvotes': question.upvotes,
-            'downvotes': question.downvotes,
-            'vote_score': question.vote_score,
-            'user_vote': vote.vote_type if vote else None
+            'upvotes': result.upvotes,
+            'downvotes': result.downvotes,
+            'vote_score': result.upvotes - result.downvotes,
+            'user_vote': result.user_vote
         })
     
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -304,32 +319,33 @@ def user_bookmarks(request):
 
 @api_view(['GET'])
 def trending_questions(request):
-    """Get trending/hot questions based on recent activity, votes, and views"""
-    from datetime import datetime, timedelta
-    from django.utils import timezone
+    """Get trending questions from the precomputed, time-decayed scores"""
+    window = TrendingWindow.objects.filter(name=request.query_params.get('window', '30d')).first()
+    if window is None:
+        return Response(
+            {'error': 'Unknown trending window.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
     
-    # First try to get recent questions (last 30 days for more inclusive results)
-    last_month = timezone.now() - timedelta(days=30)
+    try:
+        limit = min(max(int(request.query_params.get('limit', 5)), 1), 50)
+    except ValueError:
+        limit = 5
     
-    questions = Question.objects.filter(
-        created_at__gte=last_month
-    ).select_related('author').prefetch_related('tags').annotate(
-        answer_count=Count('answers'),
-        vote_score=F('upvotes') - F('downvotes'),
-        engagement_score=(F('upvotes') - F('downvotes')) + F('views') + (Count('answers') * 2)
-    ).order_by('-engagement_score', '-vote_score', '-views')[:5]
+    # Optional per-tag trending, by tag ID or name
+    tag = None
+    tag_param = request.query_params.get('tag')
+    if tag_param:
+        lookup = {'id': tag_param} if tag_param.isdigit() else {'name': tag_param.lower()}
+        tag = Tag.objects.filter(**lookup).first()
+        if tag is None:
+            return Response({'results': []})
     
-    # If not enough recent questions, get top questions of all time
-    if questions.count() < 5:
-        questions = Question.objects.select_related('author').prefetch_related('tags').annotate(
-            answer_count=Count('answers'),
-            vote_score=F('upvotes') - F('downvotes'),
-            engagement_score=(F('upvotes') - F('downvotes')) + F('views') + (Count('answers') * 2)
-        ).order_by('-engagement_score', '-vote_score', '-views', '-created_at')[:5]
+    questions = [score.question for score in trending_scores(window, limit, tag)]
     
-    # If still not enough, just get the most recent questions
-    if questions.count() < 5:
-        questions = Question.objects.select_related('author').prefetch_related('tags').order_by('-created_at')[:5]
+    # Fresh installs have no scores until events arrive or the recompute runs
+    if not questions and tag is None:
+        questions = Question.objects.select_related('author__activity').prefetch_related('tags').order_by('-created_at')[:limit]
     
     serializer = QuestionListSerializer(questions, many=True, context={'request': request})
     return Response({
@@ -337,6 +353,49 @@ def trending_questions(request):
     })
 
 
+def similar_questions_response(request, matches):
+    """Serialize (question_id, score) matches in order, skipping deleted questions"""
+    questions = Question.objects.select_related('author__activity').prefetch_related('tags').in_bulk(
+        [question_id for question_id, _ in matches]
+    )
+    found = [(questions[question_id], score) for question_id, score in matches if question_id in questions]
+    serializer = QuestionListSerializer([question for question, _ in found], many=True, context={'request': request})
+    results = []
+    for data, (_, score) in zip(serializer.data, found):
+        data['similarity'] = round(score, 4)
+        results.append(data)
+    return Response({'results': results})
+
+
+def similar_limit(request, default):
+    try:
+        return min(max(int(request.query_params.get('limit', default)), 1), 20)
+    except ValueError:
+        return default
+
+
+@api_view(['GET'])
+def related_questions(request, pk):
+    """Questions most similar to this one (hashed TF-IDF cosine similarity)"""
+    question = get_object_or_404(Question.objects.only('id', 'title', 'content').prefetch_related('tags'), pk=pk)
+    matches = related_index.related(question, similar_limit(request, 5))
+    return similar_questions_response(request, matches)
+
+
+@api_view(['GET'])
+def duplicate_questions(request):
+    """Possible duplicates of a question that is still being written"""
+    title = request.query_params.get('title', '')
+    content = request.query_params.get('content', '')
+    tag_names = [name.strip() for name in request.query_params.get('tags', '').split(',') if name.strip()]
+    if len(title.strip()) < 3 and not content.strip():
+        return Response({'results': []})
+    
+    threshold = getattr(settings, 'RELATED_QUESTIONS_DUPLICATE_THRESHOLD', 0.3)
+    matches = related_index.search(title, content, tag_names, similar_limit(request, 5), min_score=threshold)
+    return similar_questions_response(request, matches)
+
+
 class UserQuestionsView(APIView):
     """Get all questions by a specific user"""
     permission_classes = [permissions.AllowAny]
@@ -17,6 +17,10 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
 # is populated before importing code that may import ORM models.
 django_asgi_app = get_asgi_application()
 
+# Build the tag autocomplete index while the server starts, not on the first search
+from tags.autocomplete import tag_autocomplete
+tag_autocomplete.warm()
+
 # Now import channels after Django is set up
 from channels.routing import ProtocolTypeRouter, URLRouter
 from chat.routing import websocket_urlpatterns
@@ -75,6 +75,7 @@ INSTALLED_APPS = [
     'community',
     'notifications',
     'chat',
+    'common',
 ]
 
 MIDDLEWARE = [
@@ -125,6 +126,15 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Cache shared by all processes (Redis); also used by django-celery-results
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.redis.RedisCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'redis://127.0.0.1:6379/1'),
+        'KEY_PREFIX': 'cpoverflow',
+    }
+}
+
 
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
@@ -235,6 +245,53 @@ SIMPLE_JWT = {
 }
 
 
+# Question view counting: views are buffered per process and flushed in batches
+QUESTION_VIEW_FLUSH_INTERVAL = 10  # seconds, 0 disables the background flush
+QUESTION_VIEW_MAX_PENDING = 1000  # flush early once this many views are buffered
+QUESTION_VIEW_SEEN_SIZE = 100000  # recently counted viewers remembered per process
+
+
+# Related questions: hashed TF-IDF index, built by `manage.py rebuild_related_index`
+RELATED_QUESTIONS_INDEX_DIR = BASE_DIR / 'data' / 'related_questions'
+RELATED_QUESTIONS_DUPLICATE_THRESHOLD = 0.3  # minimum cosine similarity for duplicate suggestions
+TAG_COOCCURRENCE_DIR = BASE_DIR / 'data' / 'tag_cooccurrence'
+
+# Chat messages: broadcast over the channel layer, stored in batches by chat.writer
+CHAT_MESSAGE_DURABILITY = 'deferred'  # 'deferred' broadcasts before storing, 'commit' after
+CHAT_MESSAGE_BATCH_DELAY = 0.05  # seconds a message may wait for its batch
+CHAT_MESSAGE_BATCH_SIZE = 200  # write early once this many messages are buffered
+CHAT_MAX_SUBSCRIPTIONS = 200  # rooms one ws/chat/ connection may subscribe to
+
+# Typing and join/leave events: throttled, debounced and batched by chat.coalescing
+CHAT_TYPING_INTERVAL = 2.0  # seconds between typing changes one user broadcasts to a room
+CHAT_JOIN_LEAVE_DEBOUNCE = 3.0  # seconds a leave waits for the user to reconnect
+CHAT_EVENT_BATCH_WINDOW = 0.1  # seconds a room's changes are collected into one event
+CHAT_EVENT_BATCH_SIZE = 50  # send early once this many changes are collected
+
+# Presence: WebSocket connections kept alive by heartbeat frames (community.presence)
+PRESENCE = {
+    'BACKEND': 'community.presence.RedisPresenceStore',  # LocalPresenceStore for a single process
+    'LOCATION': os.getenv('PRESENCE_LOCATION', 'redis://127.0.0.1:6379/2'),
+    'KEY_PREFIX': 'cpoverflow:presence',
+    'TTL': 75,  # seconds a connection stays online without a heartbeat
+    'FLUSH_INTERVAL': 30,  # seconds between writes of activity and online flags
+}
+
+# Anonymous response cache: per-process LRU in front of CACHES['default']
+RESPONSE_CACHE = {
+    'LOCAL_MAX_ENTRIES': 512,  # pages kept in each process
+    'LOCAL_TTL': 2,  # seconds before a process re-checks for invalidations
+    'TIMEOUT': 60,  # seconds a page is fresh
+    'STALE_TIMEOUT': 30,  # seconds a page may be served while one request rebuilds it
+    'ENDPOINTS': {
+        'questions': {'TIMEOUT': 30},
+        'tags': {'TIMEOUT': 300},
+        'job-categories': {'TIMEOUT': 3600, 'STALE_TIMEOUT': 600},
+        'leaderboard': {'TIMEOUT': 120, 'STALE_TIMEOUT': 60},
+    },
+}
+
+
 # Celery Configuration
 CELERY_BROKER_URL = 'redis://localhost:6379/0'  # Ensure Redis is running
 CELERY_RESULT_BACKEND = 'django-db'
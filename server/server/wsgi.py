@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
 
 application = get_wsgi_application()
+
+# Build the tag autocomplete index while the server starts, not on the first search
+from tags.autocomplete import tag_autocomplete
+tag_autocomplete.warm()
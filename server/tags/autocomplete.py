@@ -0,0 +1,305 @@
+"""
+In-memory tag autocomplete.
+
+Tag names are kept lowercased in one sorted list, which doubles as a trie:
+the names under a prefix are a contiguous slice found with two bisects, and
+a prefix's child characters are found by bisecting past each child in turn.
+For every prefix of up to TOP_DEPTH characters the TOP_K most used tags are
+precomputed, so short, crowded prefixes are answered from a table and longer
+ones only rank the few names under them.
+
+When a query has fewer prefix matches than requested, names within one edit
+(insertion, deletion, substitution or transposition of adjacent characters)
+of the query fill the remaining slots. Only edits that lead to existing
+prefixes are generated, by walking the trie's children.
+
+Each process holds its own index. server.asgi and server.wsgi call warm() so
+it is built in a background thread while the server starts; a search
+arriving before that finishes waits for it rather than building its own,
+and processes that never start a server (management commands, tests) build
+it on first use. Tag saves and deletes
+swap in an updated copy once committed and bump a generation in the shared cache;
+other processes notice the new generation within CHECK_INTERVAL seconds and
+rebuild in a background thread while serving the old index. A rebuild also
+runs every REBUILD_INTERVAL seconds to pick up question counts, which move
+through F() updates without signals.
+"""
+import heapq
+import logging
+import threading
+import time
+import uuid
+from bisect import bisect_left, insort
+
+from django.core.cache import cache
+from django.db import connection
+
+from .models import Tag
+
+logger = logging.getLogger(__name__)
+
+TOP_DEPTH = 3
+TOP_K = 20
+DEFAULT_LIMIT = 8
+FUZZY_MIN_LENGTH = 3
+CHECK_INTERVAL = 5
+REBUILD_INTERVAL = 300
+GENERATION_KEY = 'tags:autocomplete:generation'
+
+
+def normalize(name):
+    return name.strip().lower()
+
+
+def _rank(entry):
+    # entry: (key, question_count, id, name); most used first, then by name
+    return (-entry[1], entry[0])
+
+
+def _successor(prefix):
+    """Smallest string greater than every string starting with prefix"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class TagIndex:
+    """An immutable snapshot of tag names; updates return a new index"""
+
+    def __init__(self, entries, top=None):
+        """``entries`` are sorted (key, question_count, id, name) tuples"""
+        self.entries = entries
+        self.keys = [entry[0] for entry in self.entries]
+        self.by_id = {entry[2]: entry for entry in self.entries}
+        self.top = self._build_top() if top is None else top
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build from (id, name, question_count) rows"""
+        return cls(sorted((normalize(name), count, tag_id, name) for tag_id, name, count in rows))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _build_top(self):
+        top = {}
+        for entry in sorted(self.entries, key=_rank):
+            key = entry[0]
+            for depth in range(min(len(key), TOP_DEPTH) + 1):
+                ranked = top.setdefault(key[:depth], [])
+                if len(ranked) < TOP_K:
+                    ranked.append(entry)
+        return top
+
+    def span(self, prefix, lo=0, hi=None):
+        """The [lo, hi) slice of entries whose key starts with prefix"""
+        hi = len(self.keys) if hi is None else hi
+        if not prefix:
+            return lo, hi
+        start = bisect_left(self.keys, prefix, lo, hi)
+        return start, bisect_left(self.keys, _successor(prefix), start, hi)
+
+    def children(self, prefix, lo, hi):
+        """(char, start, end) for each character following prefix in [lo, hi)"""
+        depth = len(prefix)
+        i = lo
+        while i < hi:
+            key = self.keys[i]
+            if len(key) == depth:
+                i += 1
+                continue
+            char = key[depth]
+            end = bisect_left(self.keys, prefix + chr(ord(char) + 1), i, hi)
+            yield char, i, end
+            i = end
+
+    def ranked(self, prefix, limit):
+        """The ``limit`` most used tags under prefix"""
+        if len(prefix) <= TOP_DEPTH and limit <= TOP_K:
+            return self.top.get(prefix, [])[:limit]
+        lo, hi = self.span(prefix)
+        return heapq.nsmallest(limit, self.entries[lo:hi], key=_rank)
+
+    def near_prefixes(self, query):
+        """Existing prefixes one edit away from the query"""
+        found = set()
+
+        def keep(candidate, lo=0, hi=None):
+            if candidate and candidate != query and candidate not in found:
+                start, end = self.span(candidate, lo, hi)
+                if start < end:
+                    found.add(candidate)
+
+        for i in range(len(query)):
+            keep(query[:i] + query[i + 1:])
+            if i + 1 < len(query):
+                keep(query[:i] + query[i + 1] + query[i] + query[i + 2:])
+
+        # Substitutions and insertions: only characters that follow the
+        # untouched head somewhere in the index, searched within their slice
+        lo, hi = 0, len(self.keys)
+        for i in range(len(query)):
+            head = query[:i]
+            if i:
+                lo, hi = self.span(head, lo, hi)
+                if lo == hi:
+                    break
+            for char, start, end in self.children(head, lo, hi):
+                if char != query[i]:
+                    keep(head + char + query[i + 1:], start, end)
+                keep(head + char + query[i:], start, end)
+        return found
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        """Tags starting with the query, then tags one edit away, as entries"""
+        query = normalize(query)
+        results = self.ranked(query, limit)
+        if len(results) >= limit or len(query) < FUZZY_MIN_LENGTH:
+            return results
+
+        seen = {entry[2] for entry in results}
+        fuzzy = {}
+        for prefix in self.near_prefixes(query):
+            for entry in self.ranked(prefix, limit):
+                if entry[2] not in seen:
+                    fuzzy[entry[2]] = entry
+        return results + heapq.nsmallest(limit - len(results), fuzzy.values(), key=_rank)
+
+    def upsert(self, tag_id, name, question_count):
+        """A new index with the tag added or replaced"""
+        return self._replace(self.by_id.get(tag_id), (normalize(name), question_count, tag_id, name))
+
+    def remove(self, tag_id):
+        """A new index without the tag"""
+        old = self.by_id.get(tag_id)
+        return self if old is None else self._replace(old, None)
+
+    def _replace(self, old, new):
+        entries = list(self.entries)
+        if old is not None:
+            del entries[bisect_left(entries, old)]
+        if new is not None:
+            insort(entries, new)
+        index = TagIndex(entries, top=dict(self.top))
+        index._retop(old, new)
+        return index
+
+    def _retop(self, old, new):
+        """Repair the precomputed rankings of the prefixes old and new fall under"""
+        prefixes = set()
+        for entry in (old, new):
+            if entry is not None:
+                key = entry[0]
+                prefixes.update(key[:depth] for depth in range(min(len(key), TOP_DEPTH) + 1))
+        for prefix in prefixes:
+            ranked = [entry for entry in self.top.get(prefix, []) if entry != old]
+            if new is not None and new[0].startswith(prefix):
+                ranked.append(new)
+                ranked.sort(key=_rank)
+                del ranked[TOP_K:]
+            lo, hi = self.span(prefix)
+            if len(ranked) < min(TOP_K, hi - lo):
+                # The old entry left a gap that only a rescan can fill
+                ranked = heapq.nsmallest(TOP_K, self.entries[lo:hi], key=_rank)
+            if ranked:
+                self.top[prefix] = ranked
+            else:
+                self.top.pop(prefix, None)
+
+
+class TagAutocomplete:
+    """The process-wide index, kept in step with the Tag table"""
+
+    def __init__(self):
+        self._index = None
+        self._generation = None
+        self._checked_at = 0.0
+        self._built_at = 0.0
+        self._lock = threading.Lock()
+        self._rebuilding = False
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        return self.index().search(query, limit)
+
+    def index(self):
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._rebuild()
+        elif self._stale():
+            self._rebuild_in_background()
+        return self._index
+
+    def _shared_generation(self):
+        generation = cache.get(GENERATION_KEY)
+        if generation is None:
+            cache.add(GENERATION_KEY, uuid.uuid4().hex, None)
+            generation = cache.get(GENERATION_KEY)
+        return generation
+
+    def _stale(self):
+        now = time.monotonic()
+        if now - self._built_at >= REBUILD_INTERVAL:
+            return True
+        if now - self._checked_at < CHECK_INTERVAL:
+            return False
+        self._checked_at = now
+        return self._shared_generation() != self._generation
+
+    def _rebuild(self):
+        generation = self._shared_generation()
+        rows = Tag.objects.values_list('id', 'name', 'question_count')
+        self._index = TagIndex.from_rows(rows.iterator(chunk_size=5000))
+        self._generation = generation
+        self._checked_at = self._built_at = time.monotonic()
+
+    def _rebuild_in_background(self):
+        with self._lock:
+            if self._rebuilding:
+                return None
+            self._rebuilding = True
+
+        def run():
+            try:
+                if self._index is None:
+                    # Searches block on the lock instead of building a second copy
+                    with self._lock:
+                        if self._index is None:
+                            self._rebuild()
+                else:
+                    self._rebuild()
+            except Exception:
+                logger.exception('Could not build the tag autocomplete index')
+            finally:
+                self._rebuilding = False
+                connection.close()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def warm(self):
+        """Start building the index in the background, as a server process starts"""
+        if self._index is None:
+            return self._rebuild_in_background()
+        return None
+
+    def _changed(self, update):
+        with self._lock:
+            if self._index is not None:
+                self._index = update(self._index)
+            self._generation = uuid.uuid4().hex
+            cache.set(GENERATION_KEY, self._generation, None)
+            self._checked_at = time.monotonic()
+
+    def tag_saved(self, tag_id, name, question_count):
+        self._changed(lambda index: index.upsert(tag_id, name, question_count))
+
+    def tag_deleted(self, tag_id):
+        self._changed(lambda index: index.remove(tag_id))
+
+    def clear(self):
+        """Drop the index; the next search rebuilds it"""
+        with self._lock:
+            self._index = None
+
+
+tag_autocomplete = TagAutocomplete()
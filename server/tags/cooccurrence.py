@@ -0,0 +1,392 @@
+"""
+Tag co-occurrence for related tags and tag suggestions.
+
+Two sparse count matrices are kept on disk in CSR form (.npy files opened
+memory-mapped):
+
+* ``tags``: tag x tag, how many questions carry both tags; the diagonal is
+  the number of questions carrying the tag.
+* ``titles``: title token bucket x tag, how many tagged questions have the
+  token in their title. Tokens come from questions.search.tokenize() and are
+  hashed into TITLE_DIM buckets.
+
+Related tags are a row of ``tags``. Suggestions for a draft add up
+P(tag | token), weighted by the token's IDF, over the title's tokens, plus
+P(tag | tag) for tags the draft already has.
+
+Like the related-questions index, the matrices are rebuilt in bulk by a
+command and kept current in between by a small delta: each tagging change
+appends (matrix, row, column, +/-1) records to a raw int64 file once its
+transaction commits, and queries add the delta entries of the rows they read.
+Readers only load the records appended since they last looked. Folding the
+delta into new base matrices is left to ``rebuild_tag_cooccurrence
+--compact``, meant to run periodically; it does nothing until the delta
+holds COMPACT_AT entries. Title edits, and tagging changes committed while a
+rebuild is reading, only reach the matrices on the next rebuild.
+"""
+import json
+import logging
+import os
+import time
+import uuid
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from questions.search import tokenize
+from .postings import QuestionTag
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are not locked across processes
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+TITLE_DIM = 1 << 18
+TAGS, TITLES = 0, 1
+MATRICES = ('tags', 'titles')
+CSR_ARRAYS = ('indptr', 'indices', 'data')
+COMPACT_AT = 100000
+RECORD_BYTES = 4 * 8  # matrix, row, column, delta as int64
+MANIFEST = 'manifest.json'
+
+
+def title_buckets(title):
+    """Distinct hashed title tokens"""
+    return sorted({zlib.crc32(token.encode()) & (TITLE_DIM - 1) for token in tokenize(title)})
+
+
+def tagging_delta(title, before, after):
+    """
+    Matrix entries that change when a question's tags go from ``before`` to
+    ``after``, as a Counter of (matrix, row, column) -> delta.
+    """
+    delta = Counter()
+    buckets = title_buckets(title) if before != after else []
+    for tags, sign in ((after, 1), (before, -1)):
+        for tag in tags:
+            for other in tags:
+                delta[(TAGS, tag, other)] += sign
+            for bucket in buckets:
+                delta[(TITLES, bucket, tag)] += sign
+    return Counter({key: value for key, value in delta.items() if value})
+
+
+class CSRMatrix:
+    """Row-compressed sparse counts: row r is indices/data[indptr[r]:indptr[r + 1]]"""
+
+    def __init__(self, indptr, indices, data):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+
+    @classmethod
+    def from_coo(cls, rows, cols, values, n_rows):
+        """Sum duplicate (row, col) entries and drop zeros"""
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        values = np.asarray(values, dtype=np.int64)
+        width = int(cols.max()) + 1 if len(cols) else 1
+        keys, inverse = np.unique(rows * width + cols, return_inverse=True)
+        sums = np.bincount(inverse, values, minlength=len(keys)).astype(np.int64)
+        keep = sums != 0
+        keys, sums = keys[keep], sums[keep]
+        rows = keys // width
+        indptr = np.zeros(n_rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+        return cls(indptr, (keys % width).astype(np.int32), sums.astype(np.int32))
+
+    def to_coo(self):
+        rows = np.repeat(np.arange(len(self.indptr) - 1, dtype=np.int64), np.diff(self.indptr))
+        return rows, np.asarray(self.indices, dtype=np.int64), np.asarray(self.data, dtype=np.int64)
+
+    @property
+    def n_rows(self):
+        return len(self.indptr) - 1
+
+    def row(self, row):
+        if row >= self.n_rows:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+        start, end = self.indptr[row], self.indptr[row + 1]
+        return self.indices[start:end], self.data[start:end]
+
+    @classmethod
+    def load(cls, directory, name):
+        return cls(*[np.load(os.path.join(directory, f'{name}-{array}.npy'), mmap_mode='r') for array in CSR_ARRAYS])
+
+    def save(self, directory, name):
+        for array in CSR_ARRAYS:
+            np.save(os.path.join(directory, f'{name}-{array}.npy'), getattr(self, array))
+
+
+def _sum_by_column(cols, values):
+    """Merge (column, value) pairs into sorted columns with positive totals"""
+    if not len(cols):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    columns, inverse = np.unique(cols, return_inverse=True)
+    totals = np.bincount(inverse, values).astype(np.int64)
+    keep = totals > 0
+    return columns[keep], totals[keep]
+
+
+class TagCooccurrence:
+    """Process-wide reader and writer of the on-disk co-occurrence matrices"""
+
+    def __init__(self, directory=None):
+        self._directory = directory
+        self._state = None
+        self._state_key = None
+        self._delta_read = 0  # bytes of the delta file in self._state
+
+    @property
+    def directory(self):
+        if self._directory is not None:
+            return str(self._directory)
+        return str(getattr(settings, 'TAG_COOCCURRENCE_DIR', settings.BASE_DIR / 'data' / 'tag_cooccurrence'))
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, MANIFEST)
+
+    def exists(self):
+        return os.path.exists(self.manifest_path)
+
+    def read_manifest(self):
+        with open(self.manifest_path) as manifest:
+            return json.load(manifest)
+
+    def write_manifest(self, manifest):
+        temporary = f'{self.manifest_path}.{uuid.uuid4().hex}'
+        with open(temporary, 'w') as output:
+            json.dump(manifest, output)
+        os.replace(temporary, self.manifest_path)
+
+    def delta_path(self, name):
+        return os.path.join(self.directory, f'{name}.bin')
+
+    def state(self):
+        """
+        (manifest, base matrices, delta entries), reloaded whenever the
+        manifest changes and extended by the records appended since
+        """
+        try:
+            stat = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return None
+        key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if self._state_key != key:
+            manifest = self.read_manifest()
+            base = [CSRMatrix.load(self.directory, f"{manifest['base']}-{matrix}") for matrix in MATRICES]
+            self._state, self._state_key = (manifest, base, np.empty((0, 4), dtype=np.int64)), key
+            self._delta_read = 0
+        manifest, base, delta = self._state
+        if manifest.get('delta'):
+            try:
+                size = os.path.getsize(self.delta_path(manifest['delta']))
+            except FileNotFoundError:
+                size = 0
+            # A record being appended right now is picked up next time
+            size -= size % RECORD_BYTES
+            if size > self._delta_read:
+                with open(self.delta_path(manifest['delta']), 'rb') as delta_file:
+                    delta_file.seek(self._delta_read)
+                    appended = np.frombuffer(delta_file.read(size - self._delta_read), dtype=np.int64)
+                delta = np.concatenate([delta, appended.reshape(-1, 4)])
+                self._state, self._delta_read = (manifest, base, delta), size
+        return self._state
+
+    @contextmanager
+    def write_lock(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # Querying
+
+    def _rows(self, matrix, rows):
+        """Summed (columns, counts) over the given rows of a matrix, delta included"""
+        state = self.state()
+        if state is None:
+            return _sum_by_column([], [])
+        _, base, delta = state
+        cols, values = [], []
+        for row in rows:
+            row_cols, row_values = base[matrix].row(row)
+            cols.append(row_cols)
+            values.append(row_values)
+        if len(delta):
+            mask = (delta[:, 0] == matrix) & np.isin(delta[:, 1], rows)
+            cols.append(delta[mask, 2])
+            values.append(delta[mask, 3])
+        return _sum_by_column(np.concatenate(cols), np.concatenate(values))
+
+    def related(self, tag_id, limit):
+        """Tags most often used together with a tag, as (tag_id, count) pairs"""
+        cols, counts = self._rows(TAGS, [tag_id])
+        keep = cols != tag_id
+        cols, counts = cols[keep], counts[keep]
+        order = np.lexsort((cols, -counts))[:limit]
+        return list(zip(cols[order].tolist(), counts[order].tolist()))
+
+    def suggest(self, title, tag_ids=(), limit=5):
+        """Tags for a draft question as (tag_id, score) pairs, best first"""
+        state = self.state()
+        if state is None:
+            return []
+        total = state[0].get('title_total', 0)
+        cols, scores = [], []
+        for bucket in title_buckets(title):
+            token_cols, counts = self._rows(TITLES, [bucket])
+            if len(token_cols):
+                idf = np.log((total + 1) / (counts.sum() + 1)) + 1
+                cols.append(token_cols)
+                scores.append(counts / counts.sum() * idf)
+        for tag_id in tag_ids:
+            tag_cols, counts = self._rows(TAGS, [tag_id])
+            own = counts[tag_cols == tag_id]
+            if len(own):
+                cols.append(tag_cols)
+                scores.append(counts / own[0])
+        if not cols:
+            return []
+
+        cols, inverse = np.unique(np.concatenate(cols), return_inverse=True)
+        scores = np.bincount(inverse, np.concatenate(scores))
+        keep = ~np.isin(cols, list(tag_ids))
+        cols, scores = cols[keep], scores[keep]
+        order = np.lexsort((cols, -scores))[:limit]
+        return list(zip(cols[order].tolist(), scores[order].tolist()))
+
+    # Writing
+
+    def apply(self, delta):
+        """Append a Counter of (matrix, row, column) -> delta to the delta file"""
+        if not delta or not self.exists():
+            return
+        entries = np.array([(*key, value) for key, value in delta.items()], dtype=np.int64)
+        # Held so a concurrent compaction cannot drop the records
+        with self.write_lock():
+            manifest = self.read_manifest()
+            if not manifest.get('delta'):
+                # The first change since the base was written names the delta file
+                manifest['delta'] = f'delta-{uuid.uuid4().hex}'
+                self.write_manifest(manifest)
+            with open(self.delta_path(manifest['delta']), 'ab') as delta_file:
+                delta_file.write(entries.tobytes())
+
+    def compact(self, min_entries=None):
+        """
+        Fold the delta into new base matrices once it holds at least
+        min_entries (COMPACT_AT) entries; returns the entries folded.
+        """
+        if min_entries is None:
+            min_entries = COMPACT_AT
+        if not self.exists():
+            return 0
+        with self.write_lock():
+            self._state_key = None
+            manifest, base, entries = self.state()
+            if not len(entries) or len(entries) < min_entries:
+                return 0
+            self._write_base(manifest, *self._fold(base, entries))
+            self._remove_delta(manifest.get('delta'))
+            self._state_key = None
+        return len(entries)
+
+    def _remove_delta(self, name):
+        if name and os.path.exists(self.delta_path(name)):
+            os.remove(self.delta_path(name))
+
+    def _fold(self, base, entries):
+        matrices = []
+        for matrix, n_rows in ((TAGS, None), (TITLES, TITLE_DIM)):
+            rows, cols, values = base[matrix].to_coo()
+            mask = entries[:, 0] == matrix
+            rows = np.concatenate([rows, entries[mask, 1]])
+            cols = np.concatenate([cols, entries[mask, 2]])
+            values = np.concatenate([values, entries[mask, 3]])
+            n_rows = n_rows or (int(rows.max()) + 1 if len(rows) else 1)
+            matrices.append(CSRMatrix.from_coo(rows, cols, values, n_rows))
+        return matrices
+
+    def _write_base(self, manifest, tags, titles):
+        """Save new base matrices, point the manifest at them and drop the old files"""
+        name = f'base-{uuid.uuid4().hex}'
+        tags.save(self.directory, f'{name}-tags')
+        titles.save(self.directory, f'{name}-titles')
+        old_base = manifest.get('base')
+        self.write_manifest({
+            'base': name,
+            'delta': None,
+            'built_at': time.time(),
+            # Token occurrences over all tags, for the suggestion IDF
+            'title_total': int(np.asarray(titles.data).sum()),
+        })
+        if old_base:
+            for matrix in MATRICES:
+                for array in CSR_ARRAYS:
+                    path = os.path.join(self.directory, f'{old_base}-{matrix}-{array}.npy')
+                    if os.path.exists(path):
+                        os.remove(path)
+
+    def rebuild(self, chunk_size=5000, stdout=None):
+        """Recompute both matrices from Question.tags"""
+        delta = Counter()
+        rows = (
+            QuestionTag.objects.order_by('question_id')
+            .values_list('question_id', 'tag_id', 'question__title')
+        )
+        current, title, tags = None, '', []
+        questions = 0
+        for question_id, tag_id, question_title in rows.iterator(chunk_size=chunk_size):
+            if question_id != current:
+                if tags:
+                    delta.update(tagging_delta(title, set(), set(tags)))
+                    questions += 1
+                current, title, tags = question_id, question_title, []
+            tags.append(tag_id)
+        if tags:
+            delta.update(tagging_delta(title, set(), set(tags)))
+            questions += 1
+
+        entries = (
+            np.array([(*key, value) for key, value in delta.items()], dtype=np.int64)
+            if delta else np.empty((0, 4), dtype=np.int64)
+        )
+        empty = CSRMatrix(np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32))
+        with self.write_lock():
+            manifest = self.read_manifest() if self.exists() else {}
+            self._write_base(manifest, *self._fold([empty, empty], entries))
+            self._remove_delta(manifest.get('delta'))
+            self._state_key = None
+        if stdout:
+            stdout.write(f'Counted tag pairs of {questions} questions')
+        return questions
+
+
+tag_cooccurrence = TagCooccurrence()
+
+
+def schedule_apply(delta):
+    """Apply a tagging delta once the current transaction commits"""
+    if not delta:
+        return
+
+    def apply():
+        try:
+            tag_cooccurrence.apply(delta)
+        except OSError:
+            logger.exception('Failed to update the tag co-occurrence matrices')
+
+    transaction.on_commit(apply)
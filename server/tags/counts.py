@@ -0,0 +1,51 @@
+"""
+Stored Tag.question_count maintenance.
+
+Tagging changes move the counters with F() deltas, so concurrent writers
+never overwrite each other and no tag's questions are ever counted on the
+write path. Tags that change by the same amount share one UPDATE.
+reconcile_question_counts() repairs any drift from the m2m table with a
+single GROUP BY.
+"""
+from collections import Counter, defaultdict
+
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+
+from .models import Tag
+from .postings import QuestionTag
+
+
+def adjust_question_counts(deltas):
+    """Apply {tag_id: delta} to Tag.question_count"""
+    by_delta = defaultdict(list)
+    for tag_id, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(tag_id)
+    for delta, tag_ids in by_delta.items():
+        Tag.objects.filter(pk__in=tag_ids).update(
+            question_count=Greatest(F('question_count') + delta, 0)
+        )
+
+
+def count_pairs(pairs, sign=1):
+    """{tag_id: sign * number of questions} for (tag_id, question_id) pairs"""
+    return {tag_id: sign * total for tag_id, total in Counter(tag_id for tag_id, _ in pairs).items()}
+
+
+def reconcile_question_counts():
+    """Recompute every tag's count from Question.tags; returns the number of tags fixed"""
+    actual = dict(
+        QuestionTag.objects.order_by()
+        .values('tag_id')
+        .annotate(total=Count('question_id'))
+        .values_list('tag_id', 'total')
+    )
+    stale = []
+    for tag in Tag.objects.only('id', 'question_count').iterator():
+        count = actual.get(tag.id, 0)
+        if tag.question_count != count:
+            tag.question_count = count
+            stale.append(tag)
+    Tag.objects.bulk_update(stale, ['question_count'], batch_size=1000)
+    return len(stale)
@@ -0,0 +1,56 @@
+"""
+Following and unfollowing tags in bulk.
+
+Each call runs in one transaction that first locks the user's row, so two
+requests from the same user cannot both count the same follow. Follows are
+inserted with one bulk_create and removed with one DELETE, and the follower
+counts of all affected tags move together in one F() UPDATE.
+"""
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from .models import Tag, TagFollow
+
+User = get_user_model()
+
+MAX_TAGS_PER_REQUEST = 100
+
+
+def _lock_user(user):
+    User.objects.select_for_update().filter(pk=user.pk).values_list('pk', flat=True).first()
+
+
+def _existing_tag_ids(tag_ids):
+    return set(Tag.objects.filter(pk__in=tag_ids).values_list('pk', flat=True))
+
+
+@transaction.atomic
+def follow_tags(user, tag_ids):
+    """Follow every existing tag in tag_ids; returns the IDs newly followed"""
+    _lock_user(user)
+    followed = set(TagFollow.objects.filter(user=user, tag_id__in=tag_ids).values_list('tag_id', flat=True))
+    new_ids = sorted(_existing_tag_ids(tag_ids) - followed)
+    if new_ids:
+        TagFollow.objects.bulk_create(
+            [TagFollow(user=user, tag_id=tag_id) for tag_id in new_ids],
+            ignore_conflicts=True
+        )
+        Tag.objects.filter(pk__in=new_ids).update(followers_count=F('followers_count') + 1)
+    return new_ids
+
+
+@transaction.atomic
+def unfollow_tags(user, tag_ids):
+    """Unfollow the given tags; returns the IDs that were followed"""
+    _lock_user(user)
+    follows = TagFollow.objects.filter(user=user, tag_id__in=tag_ids)
+    removed_ids = sorted(follows.values_list('tag_id', flat=True))
+    if removed_ids:
+        # QuerySet.delete() bypasses TagFollow.delete(), which would count again
+        follows.delete()
+        Tag.objects.filter(pk__in=removed_ids).update(
+            followers_count=Greatest(F('followers_count') - 1, 0)
+        )
+    return removed_ids
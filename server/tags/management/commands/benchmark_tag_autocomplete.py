@@ -0,0 +1,73 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from tags.autocomplete import TagIndex
+
+SYLLABLES = [
+    'py', 'thon', 'ja', 'va', 'script', 're', 'act', 'dj', 'ango', 'no', 'de', 'type', 'rust', 'go',
+    'lang', 'sql', 'post', 'gres', 'my', 'mongo', 'db', 'ku', 'ber', 'netes', 'dock', 'er', 'css',
+    'html', 'vue', 'ang', 'ular', 'swift', 'kot', 'lin', 'ruby', 'rails', 'php', 'lar', 'avel', 'c',
+    'net', 'spring', 'boot', 'flask', 'fast', 'api', 'graph', 'ql', 'redis', 'kafka', 'aws', 'linux',
+]
+
+
+class Command(BaseCommand):
+    help = 'Time tag autocomplete lookups on a synthetic index of N tags'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tags', type=int, default=100000, help='Number of synthetic tags')
+        parser.add_argument('--queries', type=int, default=5000, help='Number of timed lookups')
+        parser.add_argument('--limit', type=int, default=8, help='Results per lookup')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        names = set()
+        while len(names) < options['tags']:
+            parts = rng.choices(SYLLABLES, k=rng.randint(1, 4))
+            suffix = f'-{rng.randint(1, 99)}' if rng.random() < 0.3 else ''
+            names.add(''.join(parts) + suffix)
+        # Long-tailed usage counts, like real tags
+        rows = [(i, name, int(rng.paretovariate(1.2))) for i, name in enumerate(sorted(names), 1)]
+
+        started = time.perf_counter()
+        index = TagIndex.from_rows(rows)
+        self.stdout.write(f'Built an index of {len(index)} tags in {time.perf_counter() - started:.2f}s')
+
+        samples = [name for _, name, _ in rng.sample(rows, min(len(rows), options['queries']))]
+        for label, make_query in (('prefix', self.prefix), ('typo', self.typo)):
+            queries = [make_query(rng, name) for name in samples]
+            timings = []
+            for query in queries:
+                started = time.perf_counter()
+                index.search(query, options['limit'])
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            self.stdout.write(self.style.SUCCESS(
+                f'{len(timings)} {label} lookups: median {statistics.median(timings):.3f} ms, '
+                f'p95 {timings[int(len(timings) * 0.95)]:.3f} ms, max {timings[-1]:.3f} ms'
+            ))
+
+        started = time.perf_counter()
+        index.upsert(len(rows) + 1, 'pythonic', 10 ** 6)
+        self.stdout.write(f'One tag insert: {(time.perf_counter() - started) * 1000:.1f} ms')
+
+    def prefix(self, rng, name):
+        return name[:rng.randint(1, len(name))]
+
+    def typo(self, rng, name):
+        """A prefix of at least three characters with one random edit"""
+        query = name[:rng.randint(min(3, len(name)), len(name))]
+        i = rng.randrange(len(query))
+        edit = rng.choice(['delete', 'swap', 'replace', 'insert'])
+        if edit == 'delete' and len(query) > 3:
+            return query[:i] + query[i + 1:]
+        if edit == 'swap' and i + 1 < len(query):
+            return query[:i] + query[i + 1] + query[i] + query[i + 2:]
+        char = rng.choice('abcdefghijklmnopqrstuvwxyz')
+        if edit == 'replace':
+            return query[:i] + char + query[i + 1:]
+        return query[:i] + char + query[i:]
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from tags.cooccurrence import COMPACT_AT, tag_cooccurrence
+
+
+class Command(BaseCommand):
+    help = 'Recompute the tag co-occurrence matrices used for related tags and suggestions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--compact', action='store_true',
+            help='Only fold the recorded tagging changes into the matrices; run this periodically'
+        )
+        parser.add_argument(
+            '--min-entries', type=int, default=COMPACT_AT,
+            help='With --compact, leave deltas with fewer entries than this alone'
+        )
+
+    def handle(self, *args, **options):
+        if options['compact']:
+            entries = tag_cooccurrence.compact(min_entries=options['min_entries'])
+            self.stdout.write(self.style.SUCCESS(f'Folded {entries} delta entries into the co-occurrence matrices'))
+            return
+        self.stdout.write('Counting tag co-occurrence...')
+        questions = tag_cooccurrence.rebuild(stdout=self.stdout)
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully rebuilt the tag co-occurrence matrices from {questions} questions')
+        )
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from tags.postings import rebuild_postings
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the tag-to-question posting lists from Question.tags'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Number of rows to read and posting blocks to insert per batch'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding tag posting lists...')
+        indexed = rebuild_postings(chunk_size=options['chunk_size'], stdout=self.stdout)
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully indexed {indexed} question tags')
+        )
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from tags.counts import reconcile_question_counts
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored Tag.question_count from Question.tags in one GROUP BY'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Reconciling tag question counts...')
+        updated_count = reconcile_question_counts()
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully updated {updated_count} tags')
+        )
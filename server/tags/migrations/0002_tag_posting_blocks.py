@@ -0,0 +1,49 @@
+# Generated by Django 5.2.3 on 2026-10-17 00:17
+
+import sys
+from array import array
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_posting_blocks(apps, schema_editor):
+    Question = apps.get_model('questions', 'Question')
+    TagPostingBlock = apps.get_model('tags', 'TagPostingBlock')
+    blocks = {}
+    rows = Question.tags.through.objects.values_list('tag_id', 'question_id')
+    for tag_id, question_id in rows.iterator():
+        blocks.setdefault((tag_id, question_id >> 16), []).append(question_id & 0xFFFF)
+    postings = []
+    for (tag_id, block), offsets in blocks.items():
+        packed = array('H', sorted(offsets))
+        if sys.byteorder == 'big':
+            packed.byteswap()
+        postings.append(TagPostingBlock(
+            tag_id=tag_id, block=block, offsets=packed.tobytes(), size=len(offsets)
+        ))
+    TagPostingBlock.objects.bulk_create(postings, batch_size=1000)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questions', '0001_initial'),
+        ('tags', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagPostingBlock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('block', models.PositiveIntegerField()),
+                ('offsets', models.BinaryField(default=bytes)),
+                ('size', models.PositiveIntegerField(default=0)),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='posting_blocks', to='tags.tag')),
+            ],
+            options={
+                'unique_together': {('tag', 'block')},
+            },
+        ),
+        migrations.RunPython(populate_posting_blocks, migrations.RunPython.noop),
+    ]
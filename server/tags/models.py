@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models import F
+from django.db.models.functions import Greatest
 from django.contrib.auth import get_user_model
 from django.utils.text import slugify
 
@@ -42,12 +44,26 @@ class TagFollow(models.Model):
         unique_together = ['user', 'tag']
     
     def save(self, *args, **kwargs):
-        if not self.pk:  # New follow
-            self.tag.followers_count += 1
-            self.tag.save()
+        created = not self.pk
         super().save(*args, **kwargs)
+        if created:
+            Tag.objects.filter(pk=self.tag_id).update(followers_count=F('followers_count') + 1)
     
     def delete(self, *args, **kwargs):
-        self.tag.followers_count -= 1
-        self.tag.save()
-        super().delete(*args, **kwargs)
+        result = super().delete(*args, **kwargs)
+        Tag.objects.filter(pk=self.tag_id).update(followers_count=Greatest(F('followers_count') - 1, 0))
+        return result
+
+
+class TagPostingBlock(models.Model):
+    """
+    The IDs of a tag's questions that fall in one block of 65536 IDs, stored
+    as a sorted array of little-endian uint16 offsets (see tags.postings)
+    """
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='posting_blocks')
+    block = models.PositiveIntegerField()
+    offsets = models.BinaryField(default=bytes)
+    size = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['tag', 'block']
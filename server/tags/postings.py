@@ -0,0 +1,229 @@
+"""
+Tag-to-question posting lists for multi-tag filtering.
+
+Question IDs are split into blocks of 65536; for every (tag, block) a
+TagPostingBlock row holds the sorted 16-bit offsets of the tag's questions
+in that block. Tagging a question rewrites one small row, and AND/OR/NOT
+queries are answered by intersecting or merging the blocks in Python
+instead of joining and de-duplicating the m2m table.
+
+filter_questions_by_tags() always answers from the index and hands the
+database a ``pk__in`` filter, so it still applies the requested ordering
+and pagination. An AND match reads the stored block sizes first and decodes
+only the blocks every tag has. Results up to TAG_INDEX_MAX_INLINE_IDS go in
+as bind parameters; larger ones as a list of integer literals (IdList),
+which is not limited by the number of parameters a query may have.
+"""
+import sys
+from array import array
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Expression, IntegerField, Q
+
+from questions.models import Question
+from .models import TagPostingBlock
+
+BLOCK_BITS = 16
+OFFSET_MASK = (1 << BLOCK_BITS) - 1
+DEFAULT_MAX_INLINE_IDS = 5000
+
+MATCH_ALL = 'all'
+MATCH_ANY = 'any'
+MATCH_NOT = 'not'
+MATCH_MODES = (MATCH_ALL, MATCH_ANY, MATCH_NOT)
+
+QuestionTag = Question.tags.through
+
+
+def encode(offsets):
+    """Pack sorted offsets as little-endian uint16"""
+    packed = array('H', offsets)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def decode(data):
+    offsets = array('H')
+    offsets.frombytes(bytes(data))
+    if sys.byteorder == 'big':
+        offsets.byteswap()
+    return offsets
+
+
+def _group(pairs):
+    """Group (tag_id, question_id) pairs into {(tag_id, block): {offset}}"""
+    groups = defaultdict(set)
+    for tag_id, question_id in pairs:
+        groups[(tag_id, question_id >> BLOCK_BITS)].add(question_id & OFFSET_MASK)
+    return groups
+
+
+def _update_blocks(pairs, add):
+    groups = _group(pairs)
+    if not groups:
+        return
+    with transaction.atomic():
+        if add:
+            TagPostingBlock.objects.bulk_create(
+                [TagPostingBlock(tag_id=tag_id, block=block) for tag_id, block in groups],
+                ignore_conflicts=True
+            )
+        lookup = Q()
+        for tag_id, block in groups:
+            lookup |= Q(tag_id=tag_id, block=block)
+        rows = list(TagPostingBlock.objects.select_for_update().filter(lookup))
+
+        changed, emptied = [], []
+        for row in rows:
+            offsets = set(decode(row.offsets))
+            if add:
+                offsets |= groups[(row.tag_id, row.block)]
+            else:
+                offsets -= groups[(row.tag_id, row.block)]
+            if not offsets:
+                emptied.append(row.pk)
+                continue
+            row.offsets = encode(sorted(offsets))
+            row.size = len(offsets)
+            changed.append(row)
+        if changed:
+            TagPostingBlock.objects.bulk_update(changed, ['offsets', 'size'])
+        if emptied:
+            TagPostingBlock.objects.filter(pk__in=emptied).delete()
+
+
+def add_postings(pairs):
+    """Add (tag_id, question_id) pairs to the index"""
+    _update_blocks(pairs, add=True)
+
+
+def remove_postings(pairs):
+    """Remove (tag_id, question_id) pairs from the index"""
+    _update_blocks(pairs, add=False)
+
+
+def load_postings(tag_ids, blocks=None):
+    """Return {tag_id: {block: offsets}} for the given tags (and blocks) in one query"""
+    postings = {tag_id: {} for tag_id in tag_ids}
+    rows = TagPostingBlock.objects.filter(tag_id__in=tag_ids)
+    if blocks is not None:
+        rows = rows.filter(block__in=blocks)
+    for tag_id, block, offsets in rows.values_list('tag_id', 'block', 'offsets'):
+        postings[tag_id][block] = decode(offsets)
+    return postings
+
+
+def match_all(postings):
+    """Sorted IDs of questions carrying every tag"""
+    if not postings:
+        return []
+    lists = list(postings.values())
+    blocks = set(lists[0]).intersection(*lists[1:])
+    ids = []
+    for block in sorted(blocks):
+        # Start from the shortest list so the set stays small
+        arrays = sorted((tag_blocks[block] for tag_blocks in lists), key=len)
+        offsets = set(arrays[0]).intersection(*arrays[1:])
+        base = block << BLOCK_BITS
+        ids.extend(base | offset for offset in sorted(offsets))
+    return ids
+
+
+def match_any(postings):
+    """Sorted IDs of questions carrying at least one of the tags"""
+    merged = defaultdict(set)
+    for tag_blocks in postings.values():
+        for block, offsets in tag_blocks.items():
+            merged[block].update(offsets)
+    ids = []
+    for block in sorted(merged):
+        base = block << BLOCK_BITS
+        ids.extend(base | offset for offset in sorted(merged[block]))
+    return ids
+
+
+def block_sizes(tag_ids):
+    """Return {tag_id: {block: number of questions}} without reading the offsets"""
+    sizes = {tag_id: {} for tag_id in tag_ids}
+    rows = TagPostingBlock.objects.filter(tag_id__in=tag_ids).values_list('tag_id', 'block', 'size')
+    for tag_id, block, size in rows:
+        sizes[tag_id][block] = size
+    return sizes
+
+
+class IdList(Expression):
+    """
+    IDs written into the SQL as integer literals, for ``pk__in`` filters
+    with more values than a query may have bind parameters
+    """
+
+    def __init__(self, ids):
+        super().__init__(output_field=IntegerField())
+        self.ids = ids
+
+    def as_sql(self, compiler, connection):
+        return '(%s)' % ', '.join(str(int(question_id)) for question_id in self.ids), []
+
+
+def _id_set(ids):
+    max_inline = getattr(settings, 'TAG_INDEX_MAX_INLINE_IDS', DEFAULT_MAX_INLINE_IDS)
+    return ids if len(ids) <= max_inline else IdList(ids)
+
+
+def filter_questions_by_tags(queryset, tag_ids, match=MATCH_ANY):
+    """
+    Restrict a Question queryset to questions with all, any or none of the
+    given tags. The queryset's ordering is left untouched.
+    """
+    tag_ids = list(dict.fromkeys(tag_ids))
+    if not tag_ids:
+        # No tag excludes anything; with none to match, nothing matches
+        return queryset if match == MATCH_NOT else queryset.none()
+
+    if match == MATCH_ALL and len(tag_ids) > 1:
+        # Only blocks holding questions of every tag can hold a match
+        blocks = set.intersection(*(set(tag_blocks) for tag_blocks in block_sizes(tag_ids).values()))
+        if not blocks:
+            return queryset.none()
+        ids = match_all(load_postings(tag_ids, blocks))
+    else:
+        ids = match_any(load_postings(tag_ids))
+
+    if match == MATCH_NOT:
+        return queryset.exclude(pk__in=_id_set(ids)) if ids else queryset
+    return queryset.filter(pk__in=_id_set(ids)) if ids else queryset.none()
+
+
+def rebuild_postings(chunk_size=2000, stdout=None):
+    """Rebuild the whole index from the Question.tags table"""
+    TagPostingBlock.objects.all().delete()
+    rows = QuestionTag.objects.order_by('tag_id', 'question_id').values_list('tag_id', 'question_id')
+
+    blocks = []
+    current, offsets = None, []
+    indexed = 0
+
+    def flush():
+        if offsets:
+            blocks.append(TagPostingBlock(
+                tag_id=current[0], block=current[1], offsets=encode(offsets), size=len(offsets)
+            ))
+
+    for tag_id, question_id in rows.iterator(chunk_size=chunk_size):
+        key = (tag_id, question_id >> BLOCK_BITS)
+        if key != current:
+            flush()
+            current, offsets = key, []
+            if len(blocks) >= chunk_size:
+                TagPostingBlock.objects.bulk_create(blocks)
+                blocks = []
+        offsets.append(question_id & OFFSET_MASK)
+        indexed += 1
+    flush()
+    TagPostingBlock.objects.bulk_create(blocks)
+    if stdout:
+        stdout.write(f'Indexed {indexed} question tags')
+    return indexed
@@ -1,11 +1,10 @@
 from rest_framework import serializers
-from django.db.models import Count
+from common.serializers import ViewerRelation, ViewerStateListSerializer, ViewerStateMixin
 from .models import Tag, TagFollow
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(ViewerStateMixin, serializers.ModelSerializer):
     is_following = serializers.SerializerMethodField()
-    question_count = serializers.SerializerMethodField()
     
     class Meta:
         model = Tag
@@ -15,31 +14,23 @@ class TagSerializer(serializers.ModelSerializer):
             'created_at'
         ]
         read_only_fields = ['slug', 'question_count', 'followers_count']
+        list_serializer_class = ViewerStateListSerializer
     
-    def get_is_following(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return TagFollow.objects.filter(tag=obj, user=request.user).exists()
-        return False
+    viewer_relations = {
+        'follow': ViewerRelation(TagFollow, 'tag'),
+    }
     
-    def get_question_count(self, obj):
-        """Get actual question count from database"""
-        if hasattr(obj, 'question_count'):
-            return obj.question_count
-        return obj.questions.count()
+    def get_is_following(self, obj):
+        return self.viewer_value('follow', obj) is not None
 
 
 class TagListSerializer(serializers.ModelSerializer):
     """Lightweight serializer for tag lists"""
-    question_count = serializers.SerializerMethodField()
     
     class Meta:
         model = Tag
         fields = ['id', 'name', 'description', 'color', 'question_count']
-    
-    def get_question_count(self, obj):
-        """Get actual question count from database"""
-        return obj.questions.count()
+        read_only_fields = ['question_count']
 
 
 class TagFollowSerializer(serializers.ModelSerializer):
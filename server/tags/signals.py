@@ -1,21 +1,132 @@
-from django.db.models.signals import m2m_changed
+from collections import Counter
+
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete
+from django.db import transaction
 from django.dispatch import receiver
+from common.cache import invalidate_responses
 from questions.models import Question
+from .autocomplete import tag_autocomplete
+from .cooccurrence import schedule_apply, tag_cooccurrence, tagging_delta
+from .counts import adjust_question_counts, count_pairs
+from .postings import QuestionTag, add_postings, remove_postings
+
+
+def _tag_pairs(instance, reverse, pk_set):
+    if reverse:
+        return [(instance.pk, question_id) for question_id in pk_set]
+    return [(tag_id, instance.pk) for tag_id in pk_set]
 
 
 @receiver(m2m_changed, sender=Question.tags.through)
-def update_tag_question_count(sender, instance, action, pk_set, **kwargs):
+def update_tag_question_count(sender, instance, action, reverse, pk_set, **kwargs):
     """
-    Update question count for tags when questions are tagged/untagged
+    Move Tag.question_count by the rows actually added or removed
     """
-    if action in ['post_add', 'post_remove']:
-        from tags.models import Tag
-        
-        if pk_set:
-            for tag_id in pk_set:
-                try:
-                    tag = Tag.objects.get(pk=tag_id)
-                    tag.question_count = tag.questions.count()
-                    tag.save(update_fields=['question_count'])
-                except Tag.DoesNotExist:
-                    pass
+    if action == 'pre_remove' and pk_set:
+        # remove() reports every requested ID, including ones that were never linked
+        lookup = {'tag_id': instance.pk} if reverse else {'question_id': instance.pk}
+        linked = 'question_id__in' if reverse else 'tag_id__in'
+        instance._removed_tag_pairs = list(
+            QuestionTag.objects.filter(**lookup, **{linked: pk_set}).values_list('tag_id', 'question_id')
+        )
+    elif action == 'post_remove':
+        adjust_question_counts(count_pairs(getattr(instance, '_removed_tag_pairs', []), sign=-1))
+    elif action == 'post_add' and pk_set:
+        # add() only reports the IDs it inserted
+        adjust_question_counts(count_pairs(_tag_pairs(instance, reverse, pk_set)))
+    elif action == 'pre_clear':
+        # clear() does not report which rows it removes either
+        lookup = {'tag_id': instance.pk} if reverse else {'question_id': instance.pk}
+        instance._cleared_tag_pairs = list(QuestionTag.objects.filter(**lookup).values_list('tag_id', 'question_id'))
+    elif action == 'post_clear':
+        adjust_question_counts(count_pairs(getattr(instance, '_cleared_tag_pairs', []), sign=-1))
+
+
+@receiver([post_save, post_delete], sender='tags.Tag')
+def invalidate_tag_responses(sender, **kwargs):
+    """Tags appear in the tag list and on every listed question"""
+    invalidate_responses('tags', 'questions')
+
+
+@receiver(post_save, sender='tags.Tag')
+def update_autocomplete_on_save(sender, instance, **kwargs):
+    """Add or rename the tag in this process's autocomplete index"""
+    tag_id, name, question_count = instance.pk, instance.name, instance.question_count
+    transaction.on_commit(lambda: tag_autocomplete.tag_saved(tag_id, name, question_count))
+
+
+@receiver(post_delete, sender='tags.Tag')
+def update_autocomplete_on_delete(sender, instance, **kwargs):
+    """Drop the tag from this process's autocomplete index"""
+    tag_id = instance.pk
+    transaction.on_commit(lambda: tag_autocomplete.tag_deleted(tag_id))
+
+
+@receiver(m2m_changed, sender=Question.tags.through)
+def update_tag_postings(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keep the tag posting lists in step with Question.tags"""
+    if action == 'pre_clear':
+        # clear() does not report which rows it removes, so look them up first
+        lookup = {'tag_id': instance.pk} if reverse else {'question_id': instance.pk}
+        instance._cleared_tag_postings = list(
+            QuestionTag.objects.filter(**lookup).values_list('tag_id', 'question_id')
+        )
+    elif action == 'post_clear':
+        remove_postings(getattr(instance, '_cleared_tag_postings', []))
+    elif action in ['post_add', 'post_remove'] and pk_set:
+        pairs = _tag_pairs(instance, reverse, pk_set)
+        if action == 'post_add':
+            add_postings(pairs)
+        else:
+            remove_postings(pairs)
+
+
+def _tag_sets(question_ids):
+    """{question_id: (title, set of tag IDs)} for the given questions"""
+    tag_sets = {
+        question_id: (title, set())
+        for question_id, title in Question.objects.filter(id__in=question_ids).values_list('id', 'title')
+    }
+    rows = QuestionTag.objects.filter(question_id__in=question_ids).values_list('question_id', 'tag_id')
+    for question_id, tag_id in rows:
+        tag_sets[question_id][1].add(tag_id)
+    return tag_sets
+
+
+@receiver(m2m_changed, sender=Question.tags.through)
+def update_tag_cooccurrence(sender, instance, action, reverse, pk_set, **kwargs):
+    """Move the co-occurrence counts of every question whose tag set changes"""
+    if not tag_cooccurrence.exists():
+        return
+    if action in ['pre_add', 'pre_remove', 'pre_clear']:
+        if not reverse:
+            tags = set(QuestionTag.objects.filter(question_id=instance.pk).values_list('tag_id', flat=True))
+            instance._cooccurrence_before = {instance.pk: (instance.title, tags)}
+        elif action == 'pre_clear':
+            question_ids = QuestionTag.objects.filter(tag_id=instance.pk).values_list('question_id', flat=True)
+            instance._cooccurrence_before = _tag_sets(list(question_ids))
+        else:
+            instance._cooccurrence_before = _tag_sets(pk_set or [])
+        return
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+
+    delta = Counter()
+    for title, before in getattr(instance, '_cooccurrence_before', {}).values():
+        if action == 'post_clear' and not reverse:
+            after = set()
+        elif reverse:
+            after = before | {instance.pk} if action == 'post_add' else before - {instance.pk}
+        else:
+            after = before | pk_set if action == 'post_add' else before - pk_set
+        delta.update(tagging_delta(title, before, after))
+    schedule_apply(delta)
+
+
+@receiver(pre_delete, sender=Question)
+def remove_deleted_question_postings(sender, instance, **kwargs):
+    """Deleting a question drops its m2m rows without an m2m_changed signal"""
+    pairs = list(QuestionTag.objects.filter(question_id=instance.pk).values_list('tag_id', 'question_id'))
+    remove_postings(pairs)
+    adjust_question_counts(count_pairs(pairs, sign=-1))
+    schedule_apply(tagging_delta(instance.title, {tag_id for tag_id, _ in pairs}, set()))
@@ -1,3 +1,402 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings
 
 # Create your tests here.
+from rest_framework.test import APITestCase
+from rest_framework import status
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.signals import m2m_changed
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from questions.models import Question
+from .autocomplete import GENERATION_KEY, TagIndex, tag_autocomplete
+from .cooccurrence import tag_cooccurrence
+from .models import Tag, TagFollow, TagPostingBlock
+from .signals import update_tag_postings
+from .postings import MATCH_ALL, MATCH_ANY, decode, encode, filter_questions_by_tags, load_postings, match_all, match_any
+
+User = get_user_model()
+
+
+class TagPostingIndexTests(APITestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='asker', email='asker@example.com', password='password123'
+        )
+        self.python = Tag.objects.create(name='python', slug='python')
+        self.django = Tag.objects.create(name='django', slug='django')
+        self.react = Tag.objects.create(name='react', slug='react')
+        self.both = self.create_question('Both', self.python, self.django)
+        self.only_python = self.create_question('Python', self.python)
+        self.only_react = self.create_question('React', self.react)
+
+    def create_question(self, title, *tags):
+        question = Question.objects.create(title=title, content='Body', author=self.author)
+        question.tags.add(*tags)
+        return question
+
+    def indexed(self, tag):
+        return match_any(load_postings([tag.id]))
+
+    def assert_index_matches_table(self):
+        for tag in Tag.objects.all():
+            self.assertEqual(self.indexed(tag), sorted(tag.questions.values_list('id', flat=True)))
+
+    def list_ids(self, **params):
+        response = self.client.get('/api/questions/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [question['id'] for question in response.data['questions']]
+
+    def test_index_follows_m2m_changes(self):
+        self.assert_index_matches_table()
+        self.only_python.tags.remove(self.python)
+        self.react.questions.add(self.both)
+        self.assert_index_matches_table()
+        self.both.tags.clear()
+        self.assert_index_matches_table()
+        self.only_react.delete()
+        self.assert_index_matches_table()
+        self.assertFalse(TagPostingBlock.objects.filter(tag=self.react).exists())
+
+    def test_match_modes(self):
+        self.assertEqual(self.list_ids(tags='python,django', match='all'), [self.both.id])
+        self.assertEqual(
+            self.list_ids(tags=f'{self.python.id},{self.react.id}', match='any'),
+            [self.only_react.id, self.only_python.id, self.both.id]
+        )
+        self.assertEqual(self.list_ids(tags='django', match='not'), [self.only_react.id, self.only_python.id])
+        self.assertEqual(self.list_ids(tags='python,missing', match='all'), [])
+        self.assertEqual(self.list_ids(tags='nosuchtag'), [])
+        self.assertEqual(self.list_ids(tags='nosuchtag', match='any'), [])
+        self.assertEqual(
+            self.list_ids(tags='nosuchtag', match='not'),
+            [self.only_react.id, self.only_python.id, self.both.id]
+        )
+
+    def test_results_keep_requested_sort(self):
+        self.assertEqual(
+            self.list_ids(tags='python', sort='oldest'), [self.both.id, self.only_python.id]
+        )
+
+    @override_settings(TAG_INDEX_MAX_INLINE_IDS=1)
+    def test_large_results_are_written_as_literals(self):
+        self.assertEqual(self.list_ids(tags='python', match='any'), [self.only_python.id, self.both.id])
+        self.assertEqual(self.list_ids(tags='python', match='not'), [self.only_react.id])
+        self.assertEqual(self.list_ids(tags='python,django', match='all'), [self.both.id])
+
+        # Still answered from the index rather than by the m2m table
+        queryset = filter_questions_by_tags(Question.objects.all(), [self.python.id], MATCH_ANY)
+        sql = str(queryset.query)
+        self.assertIn(f'IN ({self.both.id}, {self.only_python.id})', sql)
+        self.assertNotIn(Question.tags.through._meta.db_table, sql)
+
+    def test_match_all_reads_only_shared_blocks(self):
+        far = Question.objects.create(id=(3 << 16) + 1, title='Far', content='Body', author=self.author)
+        rust = Tag.objects.create(name='rust', slug='rust')
+        far.tags.add(rust)
+        queryset = Question.objects.all()
+        with CaptureQueriesContext(connection) as queries:
+            matched = filter_questions_by_tags(queryset, [self.python.id, rust.id], MATCH_ALL)
+        # The sizes show python and rust share no block; no offsets are read
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(list(matched), [])
+
+    def test_invalid_match_mode(self):
+        response = self.client.get('/api/questions/', {'tags': 'python', 'match': 'some'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_rebuild_command(self):
+        TagPostingBlock.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_tag_index', stdout=out)
+        self.assertIn('Successfully indexed 4 question tags', out.getvalue())
+        self.assert_index_matches_table()
+
+
+class TagQuestionCountTests(APITestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='asker', email='asker@example.com', password='password123'
+        )
+        self.python = Tag.objects.create(name='python', slug='python')
+        self.django = Tag.objects.create(name='django', slug='django')
+        self.question = Question.objects.create(title='Question', content='Body', author=self.author)
+
+    def counts(self):
+        return dict(Tag.objects.values_list('name', 'question_count'))
+
+    def test_counts_follow_m2m_changes(self):
+        self.question.tags.add(self.python, self.django)
+        self.question.tags.add(self.python)
+        self.assertEqual(self.counts(), {'python': 1, 'django': 1})
+
+        self.django.questions.add(Question.objects.create(title='Other', content='Body', author=self.author))
+        self.assertEqual(self.counts(), {'python': 1, 'django': 2})
+
+        # Removing a tag the question does not carry changes nothing
+        other = Question.objects.create(title='Untagged', content='Body', author=self.author)
+        other.tags.remove(self.python)
+        self.question.tags.remove(self.python)
+        self.assertEqual(self.counts(), {'python': 0, 'django': 2})
+
+        self.django.questions.clear()
+        self.assertEqual(self.counts(), {'python': 0, 'django': 0})
+
+    def test_clear_counts_without_posting_receiver(self):
+        self.question.tags.add(self.python, self.django)
+        # The count receiver collects the cleared rows itself
+        m2m_changed.disconnect(update_tag_postings, sender=Question.tags.through)
+        self.addCleanup(m2m_changed.connect, update_tag_postings, sender=Question.tags.through)
+        self.question.tags.clear()
+        self.assertEqual(self.counts(), {'python': 0, 'django': 0})
+
+    def test_question_delete_and_create_move_counts(self):
+        self.client.force_authenticate(self.author)
+        response = self.client.post(
+            '/api/questions/', {'title': 'New', 'content': 'Body', 'tag_names': ['python', 'rust']}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.counts(), {'python': 1, 'django': 0, 'rust': 1})
+
+        Question.objects.get(title='New').delete()
+        self.assertEqual(self.counts(), {'python': 0, 'django': 0, 'rust': 0})
+
+    def test_tag_list_reads_stored_count(self):
+        self.question.tags.add(self.python)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/tags/', {'sort': 'popular'})
+        counts = {tag['name']: tag['question_count'] for tag in response.data['tags']}
+        self.assertEqual(counts['python'], 1)
+
+    def test_reconcile_command_repairs_drift(self):
+        self.question.tags.add(self.python)
+        Tag.objects.update(question_count=7)
+        out = StringIO()
+        with self.assertNumQueries(3):
+            call_command('reconcile_tag_counts', stdout=out)
+        self.assertEqual(self.counts(), {'python': 1, 'django': 0})
+        self.assertIn('Successfully updated 2 tags', out.getvalue())
+
+
+class TagAutocompleteTests(APITestCase):
+
+    def setUp(self):
+        tag_autocomplete.clear()
+        self.addCleanup(tag_autocomplete.clear)
+        for name, count in [('python', 50), ('pytorch', 10), ('javascript', 80), ('java', 40), ('django', 30)]:
+            Tag.objects.create(name=name, slug=name, question_count=count)
+        self.url = reverse('tag-autocomplete')
+
+    def names(self, q, **params):
+        response = self.client.get(self.url, {'q': q, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [tag['name'] for tag in response.data['tags']]
+
+    def test_prefix_matches_ranked_by_question_count(self):
+        self.assertEqual(self.names('py'), ['python', 'pytorch'])
+        self.assertEqual(self.names('JA'), ['javascript', 'java'])
+        self.assertEqual(self.names('', limit=2), ['javascript', 'python'])
+
+    def test_typos_fill_remaining_slots(self):
+        self.assertEqual(self.names('pyhton'), ['python'])
+        self.assertEqual(self.names('dajngo'), ['django'])
+        self.assertEqual(self.names('jvaa'), ['javascript', 'java'])
+        self.assertEqual(self.names('pyt', limit=1), ['python'])
+
+    def test_index_follows_tag_changes(self):
+        self.assertEqual(self.names('ru'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name='rust', slug='rust', question_count=5)
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.get(name='pytorch').delete()
+        self.assertEqual(self.names('ru'), ['rust'])
+        self.assertEqual(self.names('py'), ['python'])
+
+    def test_index_rebuilds_on_new_generation(self):
+        self.assertEqual(self.names('ru'), [])
+        # Another process saved a tag: only the shared generation moved
+        Tag.objects.bulk_create([Tag(name='rust', slug='rust')])
+        cache.set(GENERATION_KEY, 'elsewhere', None)
+        tag_autocomplete._checked_at = 0
+        self.assertTrue(tag_autocomplete._stale())
+        # Normally done in a background thread
+        tag_autocomplete._rebuild()
+        self.assertEqual(self.names('ru'), ['rust'])
+        self.assertFalse(tag_autocomplete._stale())
+
+
+class TagAutocompleteWarmTests(TransactionTestCase):
+
+    def test_warm_builds_the_index_in_the_background(self):
+        tag_autocomplete.clear()
+        self.addCleanup(tag_autocomplete.clear)
+        Tag.objects.create(name='python', slug='python', question_count=5)
+        tag_autocomplete.warm().join()
+        self.assertIsNotNone(tag_autocomplete._index)
+        with self.assertNumQueries(0):
+            self.assertEqual([entry[3] for entry in tag_autocomplete.search('py')], ['python'])
+        self.assertIsNone(tag_autocomplete.warm())
+
+
+class TagIndexTests(TestCase):
+
+    def test_updates_keep_top_rankings(self):
+        rows = [(i, f'tag{i:03d}', i) for i in range(1, 101)]
+        index = TagIndex.from_rows(rows)
+        self.assertEqual([entry[2] for entry in index.search('tag', 3)], [100, 99, 98])
+
+        index = index.upsert(5, 'tag005', 1000).remove(100)
+        self.assertEqual([entry[2] for entry in index.search('tag', 3)], [5, 99, 98])
+        self.assertEqual(index.top, TagIndex(index.entries).top)
+
+
+class TagCooccurrenceTests(APITestCase):
+
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.index_dir)
+        settings_override = override_settings(TAG_COOCCURRENCE_DIR=self.index_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.author = User.objects.create_user(
+            username='asker', email='asker@example.com', password='password123'
+        )
+        self.python = Tag.objects.create(name='python', slug='python')
+        self.django = Tag.objects.create(name='django', slug='django')
+        self.pandas = Tag.objects.create(name='pandas', slug='pandas')
+        self.css = Tag.objects.create(name='css', slug='css')
+        self.create_question('Django model migrations fail', self.python, self.django)
+        self.create_question('Django admin ordering', self.python, self.django)
+        self.create_question('Pandas dataframe groupby', self.python, self.pandas)
+        self.create_question('Center a div with flexbox', self.css)
+        call_command('rebuild_tag_cooccurrence', stdout=StringIO())
+
+    def create_question(self, title, *tags):
+        with self.captureOnCommitCallbacks(execute=True):
+            question = Question.objects.create(title=title, content='Body', author=self.author)
+            question.tags.add(*tags)
+        return question
+
+    def related(self, tag):
+        response = self.client.get(reverse('related-tags', args=[tag.id]))
+        return [(item['name'], item['count']) for item in response.data['tags']]
+
+    def suggested(self, title, tags=''):
+        response = self.client.get(reverse('suggest-tags'), {'title': title, 'tags': tags})
+        return [item['name'] for item in response.data['tags']]
+
+    def test_related_tags(self):
+        self.assertEqual(self.related(self.python), [('django', 2), ('pandas', 1)])
+        self.assertEqual(self.related(self.css), [])
+
+    def test_suggestions_from_title_and_chosen_tags(self):
+        # Both tags are on every question mentioning django
+        self.assertEqual(set(self.suggested('Django migrations squash')), {'django', 'python'})
+        self.assertEqual(self.suggested('Pandas merge', tags='python'), ['pandas', 'django'])
+        self.assertEqual(self.suggested('nothing known here'), [])
+
+    def test_tagging_changes_update_the_delta(self):
+        question = self.create_question('Flexbox grid gap', self.css)
+        with self.captureOnCommitCallbacks(execute=True):
+            question.tags.add(self.python)
+        self.assertEqual(self.related(self.css), [('python', 1)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.css.questions.clear()
+        self.assertEqual(self.related(self.python), [('django', 2), ('pandas', 1)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Question.objects.get(title='Django admin ordering').delete()
+        self.assertEqual(self.related(self.python), [('django', 1), ('pandas', 1)])
+
+        # Changes are appended to the same delta file, never folded on commit
+        delta = tag_cooccurrence.read_manifest()['delta']
+        size = os.path.getsize(tag_cooccurrence.delta_path(delta))
+        with self.captureOnCommitCallbacks(execute=True):
+            question.tags.remove(self.python)
+        self.assertEqual(tag_cooccurrence.read_manifest()['delta'], delta)
+        self.assertGreater(os.path.getsize(tag_cooccurrence.delta_path(delta)), size)
+
+        # Folding the delta into the base gives the same counts
+        before = self.related(self.python)
+        call_command('rebuild_tag_cooccurrence', '--compact', stdout=StringIO())
+        self.assertEqual(tag_cooccurrence.read_manifest()['delta'], delta)
+        call_command('rebuild_tag_cooccurrence', '--compact', '--min-entries', '1', stdout=StringIO())
+        self.assertIsNone(tag_cooccurrence.read_manifest()['delta'])
+        self.assertFalse(os.path.exists(tag_cooccurrence.delta_path(delta)))
+        self.assertEqual(self.related(self.python), before)
+
+
+class TagFollowTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='follower', email='follower@example.com', password='password123'
+        )
+        self.tags = [Tag.objects.create(name=f'tag{i}', slug=f'tag{i}', description='x' * 500) for i in range(20)]
+        self.tag_ids = [tag.id for tag in self.tags]
+        self.url = reverse('bulk-follow-tags')
+        self.client.force_authenticate(self.user)
+
+    def followers(self):
+        return list(Tag.objects.filter(pk__in=self.tag_ids).order_by('pk').values_list('followers_count', flat=True))
+
+    def test_bulk_follow_and_unfollow(self):
+        # savepoint, user lock, followed, tag lookup, insert, counter update, release
+        with self.assertNumQueries(7):
+            response = self.client.post(self.url, {'tag_ids': self.tag_ids}, format='json')
+        self.assertEqual(response.data['followed'], self.tag_ids)
+        self.assertEqual(self.followers(), [1] * 20)
+
+        response = self.client.post(self.url, {'tag_ids': self.tag_ids[:5] + [999999]}, format='json')
+        self.assertEqual(response.data['followed'], [])
+        self.assertEqual(self.followers(), [1] * 20)
+
+        response = self.client.delete(self.url, {'tag_ids': self.tag_ids[:10]}, format='json')
+        self.assertEqual(response.data['unfollowed'], self.tag_ids[:10])
+        self.assertEqual(self.followers(), [0] * 10 + [1] * 10)
+        self.assertEqual(TagFollow.objects.filter(user=self.user).count(), 10)
+
+    def test_counter_update_leaves_other_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('follow-tag', args=[self.tags[0].id]))
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('"description"', updates[0])
+
+    def test_single_tag_endpoint(self):
+        url = reverse('follow-tag', args=[self.tags[0].id])
+        self.assertEqual(self.client.post(url).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.post(url).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.followers()[0], 0)
+
+    def test_invalid_tag_ids(self):
+        for tag_ids in [None, [], ['python'], list(range(1, 102))]:
+            response = self.client.post(self.url, {'tag_ids': tag_ids}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PostingListTests(TestCase):
+
+    def test_encode_round_trip(self):
+        self.assertEqual(list(decode(encode([1, 7, 65535]))), [1, 7, 65535])
+
+    def test_set_operations_span_blocks(self):
+        postings = {
+            1: {0: decode(encode([3, 9])), 2: decode(encode([5]))},
+            2: {0: decode(encode([9])), 2: decode(encode([5, 6]))},
+        }
+        self.assertEqual(match_all(postings), [9, (2 << 16) | 5])
+        self.assertEqual(match_any(postings), [3, 9, (2 << 16) | 5, (2 << 16) | 6])
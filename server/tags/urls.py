@@ -3,7 +3,11 @@ from . import views
 
 urlpatterns = [
     path('', views.TagListCreateView.as_view(), name='tag-list-create'),
+    path('autocomplete/', views.autocomplete_tags, name='tag-autocomplete'),
+    path('suggest/', views.suggest_tags, name='suggest-tags'),
     path('<int:pk>/', views.TagDetailView.as_view(), name='tag-detail'),
+    path('<int:pk>/related/', views.related_tags, name='related-tags'),
     path('<int:tag_id>/follow/', views.follow_tag, name='follow-tag'),
+    path('follow/', views.bulk_follow_tags, name='bulk-follow-tags'),
     path('followed/', views.user_followed_tags, name='user-followed-tags'),
 ]
@@ -2,8 +2,13 @@ from rest_framework.views import APIView
 from rest_framework import status, permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
-from django.db.models import Q, Count
+from django.db.models import Q
 from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from common.cache import cache_response
+from .autocomplete import DEFAULT_LIMIT, TOP_K, tag_autocomplete
+from .cooccurrence import tag_cooccurrence
+from .follows import MAX_TAGS_PER_REQUEST, follow_tags, unfollow_tags
 from .models import Tag, TagFollow
 from .serializers import TagSerializer, TagListSerializer, TagFollowSerializer
 
@@ -27,6 +32,7 @@ class TagDetailView(APIView):
 class TagListCreateView(APIView):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     
+    @method_decorator(cache_response('tags'))
     def get(self, request):
         """List tags with filtering and sorting"""
         queryset = Tag.objects.all()
@@ -84,15 +90,10 @@ class TagListCreateView(APIView):
 @permission_classes([permissions.IsAuthenticated])
 def follow_tag(request, tag_id):
     """Follow or unfollow a tag"""
-    tag = get_object_or_404(Tag, id=tag_id)
+    tag = get_object_or_404(Tag.objects.only('id'), id=tag_id)
     
     if request.method == 'POST':
-        follow, created = TagFollow.objects.get_or_create(
-            user=request.user,
-            tag=tag
-        )
-        
-        if created:
+        if follow_tags(request.user, [tag.id]):
             return Response({'message': 'Tag followed successfully.'})
         else:
             return Response(
@@ -101,15 +102,37 @@ def follow_tag(request, tag_id):
             )
     
     elif request.method == 'DELETE':
-        try:
-            follow = TagFollow.objects.get(user=request.user, tag=tag)
-            follow.delete()
+        if unfollow_tags(request.user, [tag.id]):
             return Response({'message': 'Tag unfollowed successfully.'})
-        except TagFollow.DoesNotExist:
-            return Response(
-                {'error': 'Tag is not followed.'}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        return Response(
+            {'error': 'Tag is not followed.'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+
+@api_view(['POST', 'DELETE'])
+@permission_classes([permissions.IsAuthenticated])
+def bulk_follow_tags(request):
+    """Follow (POST) or unfollow (DELETE) a list of tags in one request"""
+    tag_ids = request.data.get('tag_ids')
+    if (
+        not isinstance(tag_ids, list)
+        or not tag_ids
+        or not all(isinstance(tag_id, int) and not isinstance(tag_id, bool) for tag_id in tag_ids)
+    ):
+        return Response(
+            {'error': 'tag_ids must be a non-empty list of tag IDs.'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if len(tag_ids) > MAX_TAGS_PER_REQUEST:
+        return Response(
+            {'error': f'At most {MAX_TAGS_PER_REQUEST} tags can be changed at once.'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    if request.method == 'POST':
+        return Response({'followed': follow_tags(request.user, tag_ids)})
+    return Response({'unfollowed': unfollow_tags(request.user, tag_ids)})
 
 
 @api_view(['GET'])
@@ -120,3 +143,58 @@ def user_followed_tags(request):
     tags = [follow.tag for follow in follows]
     serializer = TagListSerializer(tags, many=True, context={'request': request})
     return Response(serializer.data)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def autocomplete_tags(request):
+    """Tags matching what has been typed so far, most used first"""
+    query = request.query_params.get('q', '')
+    try:
+        limit = min(max(int(request.query_params.get('limit', DEFAULT_LIMIT)), 1), TOP_K)
+    except ValueError:
+        limit = DEFAULT_LIMIT
+    
+    tags = [
+        {'id': tag_id, 'name': name, 'question_count': question_count}
+        for _, question_count, tag_id, name in tag_autocomplete.search(query, limit)
+    ]
+    return Response({'tags': tags})
+
+
+def _tag_limit(request, default=10, maximum=50):
+    try:
+        return min(max(int(request.query_params.get('limit', default)), 1), maximum)
+    except ValueError:
+        return default
+
+
+def _scored_tags(pairs, field):
+    """Serialize (tag_id, value) pairs in order, skipping deleted tags"""
+    tags = Tag.objects.in_bulk([tag_id for tag_id, _ in pairs])
+    return [
+        {'id': tag_id, 'name': tags[tag_id].name, 'question_count': tags[tag_id].question_count, field: value}
+        for tag_id, value in pairs
+        if tag_id in tags
+    ]
+
+
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def related_tags(request, pk):
+    """Tags most often used on the same questions as this tag"""
+    tag = get_object_or_404(Tag.objects.only('id'), pk=pk)
+    pairs = tag_cooccurrence.related(tag.id, _tag_limit(request))
+    return Response({'tags': _scored_tags(pairs, 'count')})
+
+
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def suggest_tags(request):
+    """Tags for a draft question from its title and the tags chosen so far"""
+    title = request.query_params.get('title', '')
+    names = [name.strip().lower() for name in request.query_params.get('tags', '').split(',') if name.strip()]
+    tag_ids = list(Tag.objects.filter(name__in=names).values_list('id', flat=True)) if names else []
+    
+    pairs = tag_cooccurrence.suggest(title, tag_ids, _tag_limit(request, default=5, maximum=20))
+    return Response({'tags': _scored_tags([(tag_id, round(score, 4)) for tag_id, score in pairs], 'score')})